@@ -0,0 +1,201 @@
+import argparse
+import json
+import sqlite3
+import sys
+from datetime import datetime
+from hash_check import classify_ioc
+from hash_index import check_local_lists
+from url_check import AnalysisPoller
+from utils import log_search
+from vt_cache import get_cache
+from vt_client import get_client
+
+
+def read_iocs(stream):
+    """
+    Reads indicators one line at a time from a file or stdin. Blank lines and # comments are skipped.
+
+    :param stream: An open text file or sys.stdin
+    :return: Yields each indicator as a stripped str
+    """
+    for line in stream:
+        ioc = line.strip()
+        if ioc and not ioc.startswith("#"):
+            yield ioc
+
+
+def classify_and_dedupe(iocs):
+    """
+    Classifies every indicator and drops the ones we have already seen. The cache keys of the indicators seen so far
+    are kept in a temporary SQLite table, so memory stays flat however many million lines the input has - the table
+    lives on disk and is deleted when the generator finishes.
+
+    :param iocs: Iterable of indicator strings
+    :return: Yields (ioc_type, ioc) tuples, ioc_type being None for values that are not a hash or URL
+    """
+    cache = get_cache()
+    seen = sqlite3.connect("")  # An empty path gives a private on-disk database, removed when it is closed
+    seen.execute("CREATE TABLE seen (key TEXT PRIMARY KEY) WITHOUT ROWID")
+
+    try:
+        for ioc in iocs:
+            ioc_type = classify_ioc(ioc)
+
+            if ioc_type == "URL":
+                try:
+                    key = cache.url_key(ioc)
+                except ValueError:
+                    key = ioc  # A malformed URL - lookup_ioc() reports it as invalid
+            elif ioc_type:
+                key = cache.hash_key(ioc)
+            else:
+                key = ioc
+
+            # The row is only inserted if the key is new
+            if seen.execute("INSERT OR IGNORE INTO seen (key) VALUES (?)", (key,)).rowcount == 0:
+                continue
+            yield ioc_type, ioc
+    finally:
+        seen.close()
+
+
+def build_record(ioc, ioc_type, attributes):
+    """
+    Builds the result record for an indicator from its VirusTotal attributes.
+
+    :return: Returns the record as a dict with the engine counts for each category
+    """
+    record = {"ioc": ioc, "type": ioc_type}
+
+    if attributes is None:
+        record["status"] = "error"
+        return record
+
+    # File reports keep their counts in last_analysis_stats, URL analyses in stats.
+    stats = attributes.get("stats") if ioc_type == "URL" else attributes.get("last_analysis_stats")
+    record["status"] = "ok"
+    for category in ("malicious", "suspicious", "undetected", "harmless", "timeout"):
+        record[category] = (stats or {}).get(category, 0)
+    return record
+
+
+def lookup_ioc(classified):
+    """
+    Looks up one classified indicator, from the local hash lists or the verdict cache where possible. URLs that are not cached are only
+    submitted here - their analysis is then waited for by the AnalysisPoller instead of blocking a worker.
+
+    :param classified: An (ioc_type, ioc) tuple from classify_and_dedupe()
+    :return: Returns ("done", record) or ("pending", analysis_id)
+    """
+    ioc_type, ioc = classified
+
+    if ioc_type is None:
+        return "done", {"ioc": ioc, "type": None, "status": "invalid", "reason": "not a hash or URL"}
+
+    cache = get_cache()
+    client = get_client()
+
+    if ioc_type == "URL":
+        try:
+            key = cache.url_key(ioc)
+        except ValueError as e:
+            return "done", {"ioc": ioc, "type": None, "status": "invalid", "reason": f"malformed URL: {e}"}
+
+        attributes, is_stale = cache.get(key)
+        if attributes is not None and not is_stale:
+            return "done", build_record(ioc, ioc_type, attributes)
+
+        analysis_id = client.submit_url(ioc)
+        if analysis_id is None:
+            return "done", build_record(ioc, ioc_type, attributes)
+        return "pending", analysis_id
+
+    # Hashes on our local known-good / known-bad lists never need to spend API quota
+    local_verdict = check_local_lists(ioc)
+    if local_verdict:
+        return "done", {"ioc": ioc, "type": ioc_type, "status": "ok", "local_verdict": local_verdict}
+
+    attributes = cache.get_or_fetch(cache.hash_key(ioc), lambda: client.get_file_attributes(ioc))
+    return "done", build_record(ioc, ioc_type, attributes)
+
+
+def lookup_ioc_or_error(classified):
+    """
+    Runs lookup_ioc(), turning any failure for the indicator (a dropped connection, a timeout, a bad response) into an
+    error record, so one bad lookup never ends the whole run.
+
+    :param classified: An (ioc_type, ioc) tuple from classify_and_dedupe()
+    :return: Returns ("done", record) or ("pending", analysis_id)
+    """
+    try:
+        return lookup_ioc(classified)
+    except Exception as e:
+        ioc_type, ioc = classified
+        return "done", {"ioc": ioc, "type": ioc_type, "status": "error", "reason": str(e)}
+
+
+def stream_results(stream):
+    """
+    Streams IOCs from a file or stdin through VirusTotal. Lookups and URL submissions run concurrently on the shared
+    client, pending URL analyses are polled on this thread, and only a bounded window of indicators is held in
+    memory at once.
+
+    :param stream: An open text file or sys.stdin
+    :return: Yields a result record for each unique indicator, as soon as it is ready
+    """
+    client = get_client()
+    cache = get_cache()
+    poller = AnalysisPoller(client)
+
+    def finished_urls(results):
+        for url, attributes, state in results:
+            if state == "completed":
+                cache.put(cache.url_key(url), attributes)
+                yield build_record(url, "URL", attributes)
+            else:
+                record = build_record(url, "URL", None)
+                record["status"] = state  # "error" or "timeout"
+                yield record
+
+    for (ioc_type, ioc), (outcome, value) in client.map_in_flight(lookup_ioc_or_error, classify_and_dedupe(read_iocs(stream))):
+        if outcome == "pending":
+            poller.add(value, ioc)
+        else:
+            yield value
+        yield from finished_urls(poller.poll_due())
+
+    yield from finished_urls(poller.run())
+
+
+def main():
+    """
+    Bulk IOC entry point. Reads hashes and URLs from a file (or stdin with '-') and writes one JSON result per line.
+    """
+    parser = argparse.ArgumentParser(description="Look up a list of hashes and URLs with VirusTotal")
+    parser.add_argument("input", nargs="?", default="-", help="File of IOCs, one per line ('-' for stdin)")
+    parser.add_argument("--output", default="-", help="JSONL file to write results to ('-' for stdout)")
+    args = parser.parse_args()
+
+    source = sys.stdin if args.input == "-" else open(args.input, "r")
+    destination = sys.stdout if args.output == "-" else open(args.output, "w")
+
+    try:
+        for record in stream_results(source):
+            destination.write(json.dumps(record) + "\n")
+            destination.flush()
+
+            # Queue the search for the audit logs - written in the background, so this never waits on disk
+            if record["status"] == "ok":
+                date = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+                search = "URL" if record["type"] == "URL" else "Hash"
+                result = {key: value for key, value in record.items() if key not in ("ioc", "type", "status")}
+                log_search(date, search, record["ioc"], result)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if destination is not sys.stdout:
+            destination.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# VirusTotal accepts all three of these digests, so we compute them together in one pass.
+DEFAULT_ALGORITHMS = ("md5", "sha1", "sha256")
+
+# Large reads keep the disks busy and let hashlib release the GIL for longer stretches.
+CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
+# Same rule as find_local_files() - skip the programme's own files.
+IGNORED_EXTENSIONS = (".py", ".env")
+
+
+# One reusable read buffer per worker thread, so hashing thousands of files doesn't allocate a new bytes object for
+# every chunk.
+_buffers = threading.local()
+
+
+def _get_buffer(chunk_size):
+    """Returns this thread's reusable read buffer, (re)creating it if the chunk size changed."""
+    buffer = getattr(_buffers, "buffer", None)
+    if buffer is None or len(buffer) != chunk_size:
+        buffer = bytearray(chunk_size)
+        _buffers.buffer = buffer
+    return buffer
+
+
+def hash_file(path, algorithms=DEFAULT_ALGORITHMS, chunk_size=CHUNK_SIZE):
+    """
+    Reads a file once and feeds every requested hashlib algorithm with each chunk.
+
+    Chunks are read with readinto() straight into a reusable bytearray and passed to hashlib as memoryview slices,
+    so no per-chunk bytes objects are created. hashlib releases the GIL while hashing large buffers, so several
+    files can be hashed in parallel on threads.
+
+    :param path: Path of the file to hash
+    :param algorithms: The hashlib algorithm names to compute
+    :param chunk_size: How many bytes to read from the file at a time
+    :return: Returns a dict of algorithm name -> hex digest
+    """
+    hashers = {name: hashlib.new(name) for name in algorithms}
+    buffer = _get_buffer(chunk_size)
+
+    with memoryview(buffer) as view, open(path, "rb", buffering=0) as f:
+        while size := f.readinto(buffer):
+            chunk = view[:size]
+            for hasher in hashers.values():
+                hasher.update(chunk)
+            chunk.release()
+
+    return {name: hasher.hexdigest() for name, hasher in hashers.items()}
+
+
+def walk_directory(root):
+    """
+    Walks the whole directory tree under root and yields the path of every regular file.
+    Symlinks are not followed, and programme files are skipped like in find_local_files().
+
+    :param root: The directory to start walking from
+    :return: Yields file paths one at a time
+    """
+    for dir_path, dir_names, file_names in os.walk(root):
+        for file_name in file_names:
+            if file_name.endswith(IGNORED_EXTENSIONS):
+                continue
+
+            path = os.path.join(dir_path, file_name)
+            if os.path.isfile(path) and not os.path.islink(path):
+                yield path
+
+
+def _hash_or_error(path, algorithms):
+    """Hashes one file for the worker pool, returning the error instead of raising it."""
+    try:
+        return path, hash_file(path, algorithms), None
+    except OSError as e:
+        return path, None, str(e)
+
+
+def scan_directory(root, workers=None, algorithms=DEFAULT_ALGORITHMS, manifest=None):
+    """
+    Hashes every file under root on a thread pool. hashlib releases the GIL while hashing large
+    buffers, so threads give us parallel reads and parallel hashing without extra processes.
+
+    With a ScanManifest, files whose (device, inode, size, mtime_ns) match the last scan reuse their stored digests
+    and are never read, so a rescan only hashes new or changed files.
+
+    :param root: The directory to scan
+    :param workers: Number of worker threads (defaults to the same as ThreadPoolExecutor)
+    :param algorithms: The hashlib algorithm names to compute
+    :param manifest: Optional ScanManifest from an earlier scan
+    :return: Yields (path, digests, error, reused) tuples as each file finishes, in the order the files were found
+    """
+    workers = workers or min(32, (os.cpu_count() or 1) + 4)
+    max_pending = workers * 4  # Keep memory flat on trees with millions of files
+    pending = deque()  # Each entry is a finished result tuple, or a (future, stat) for a file still being hashed
+
+    def check_or_submit(executor, path):
+        if manifest is None:
+            return executor.submit(_hash_or_error, path, algorithms), None
+
+        try:
+            stat = os.stat(path)  # Taken before hashing, so a change mid-read is caught next time
+        except OSError as e:
+            return path, None, str(e), False
+
+        digests = manifest.lookup(stat)
+        if digests:
+            manifest.mark_unchanged(path, stat)
+            return path, digests, None, True
+        return executor.submit(_hash_or_error, path, algorithms), stat
+
+    def result_of(entry):
+        if isinstance(entry[0], Future):
+            future, stat = entry
+            path, digests, error = future.result()
+            if manifest is not None and digests:
+                manifest.record(path, stat, digests)
+            return path, digests, error, False
+        return entry
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for path in walk_directory(os.path.abspath(root)):
+            pending.append(check_or_submit(executor, path))
+            while len(pending) >= max_pending:
+                yield result_of(pending.popleft())
+
+        while pending:
+            yield result_of(pending.popleft())
+
+    if manifest is not None:
+        manifest.finish(root)
@@ -0,0 +1,401 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+import zlib
+import numpy as np
+from vt_cache import get_cache
+
+# Context triggered piecewise hashing (CTPH) in the style of ssdeep. A rolling hash over a small window picks
+# "trigger points" in the file; each piece between two triggers is hashed to one base64 character. Changing a few
+# bytes only changes the characters for the pieces they fall in, so similar files give similar digests.
+ROLLING_WINDOW = 7
+MIN_BLOCKSIZE = 3
+SPAMSUM_LENGTH = 64
+B64 = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+
+# Files are read a chunk at a time, so memory use does not grow with the file. Very large files are still skipped:
+# they take a long time to hash and are rarely useful for similarity matching anyway.
+MAX_FILE_SIZE = 512 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024  # Bytes hashed at once - the temporary NumPy arrays are a few times this size
+
+
+def rolling_hash(values, before):
+    """
+    Computes the rolling hash for every position of a chunk of the data, vectorised with NumPy.
+
+    The window value is built from the plain sum and the position-weighted sum of the last ROLLING_WINDOW bytes,
+    each computed as a handful of shifted whole-array additions, and then mixed with a multiplicative hash so the
+    low bits are well spread.
+
+    :param values: The chunk as a uint8 array
+    :param before: The ROLLING_WINDOW - 1 bytes before the chunk as a uint8 array (zeros at the start of the data)
+    :return: Returns a uint32 array with one hash value per byte of the chunk
+    """
+    overlap = ROLLING_WINDOW - 1
+    padded = np.concatenate((before, values)).astype(np.int32)
+
+    h1 = np.zeros(len(values), dtype=np.int32)
+    h2 = np.zeros(len(values), dtype=np.int32)
+    for age in range(ROLLING_WINDOW):
+        # Byte `age` positions back; newer bytes get a bigger weight in h2
+        shifted = padded[overlap - age:overlap - age + len(values)]
+        h1 += shifted
+        h2 += (ROLLING_WINDOW - age) * shifted
+
+    mixed = ((h1 + 31 * h2).astype(np.uint64) * np.uint64(0x9E3779B1)) >> np.uint64(15)
+    return mixed.astype(np.uint32)  # Keeps the low 32 bits
+
+
+class _Pieces:
+    """
+    The pieces of the data for one block size, worked out a chunk at a time. Only the first SPAMSUM_LENGTH - 1
+    pieces are kept (the most a digest part uses), each as its base64 character and the offset it ends at.
+    """
+
+    def __init__(self, blocksize):
+        self.blocksize = blocksize
+        self.chars = []
+        self.ends = []
+        self.crc = 0  # CRC of the piece read so far
+
+    def update(self, view, offset, triggers):
+        """
+        Adds a chunk of the data.
+
+        :param view: memoryview of the chunk
+        :param offset: Where the chunk starts in the data
+        :param triggers: Positions in the chunk of this block size's trigger points
+        """
+        start = 0
+        for position in triggers[:SPAMSUM_LENGTH - 1 - len(self.chars)]:
+            position = int(position) + 1
+            self.crc = zlib.crc32(view[start:position], self.crc)
+            self.chars.append(B64[self.crc & 63])
+            self.ends.append(offset + position)
+            self.crc = 0
+            start = position
+
+        if len(self.chars) < SPAMSUM_LENGTH - 1:
+            self.crc = zlib.crc32(view[start:], self.crc)
+
+    def part(self, max_length, length, read_from):
+        """
+        Builds the digest part: one character per piece, with the last character covering the rest of the data.
+
+        :param max_length: Maximum digest length
+        :param length: Length of the data
+        :param read_from: Function returning the chunks of the data from an offset, to hash the rest of it again
+        :return: Returns the digest part as a str
+        """
+        if len(self.chars) < max_length - 1:
+            start = self.ends[-1] if self.ends else 0
+            last = self.crc
+        else:
+            start = self.ends[max_length - 2]
+            last = 0
+            for chunk in read_from(start):
+                last = zlib.crc32(chunk, last)
+
+        part = "".join(self.chars[:max_length - 1])
+        if start < length:
+            part += B64[last & 63]
+        return part
+
+
+def fuzzy_hash_chunks(chunks, length, read_from):
+    """
+    Generates the fuzzy digest of data read in chunks, in the form 'blocksize:part1:part2'. part2 uses double the
+    block size, so digests with neighbouring block sizes can still be compared.
+
+    Every block size the digest could end up using is worked out in the same pass. Their block sizes are
+    MIN_BLOCKSIZE doubled again and again, so each one's trigger points are a subset of the previous one's.
+
+    :param chunks: Iterable of the data's chunks (bytes or memoryview)
+    :param length: Length of the data, used to choose the block size
+    :param read_from: Function returning the chunks of the data from an offset
+    :return: Returns the digest as a str
+    """
+    # Start with the block size that would give about SPAMSUM_LENGTH pieces, and halve it while we get too few.
+    blocksize = MIN_BLOCKSIZE
+    while blocksize * SPAMSUM_LENGTH < length:
+        blocksize *= 2
+
+    levels = [_Pieces(MIN_BLOCKSIZE)]
+    while levels[-1].blocksize < blocksize * 2:
+        levels.append(_Pieces(levels[-1].blocksize * 2))
+
+    before = np.zeros(ROLLING_WINDOW - 1, dtype=np.uint8)
+    offset = 0
+    for chunk in chunks:
+        values = np.frombuffer(chunk, dtype=np.uint8)
+        hashes = rolling_hash(values, before)
+        before = np.concatenate((before, values))[-(ROLLING_WINDOW - 1):]
+
+        triggers = np.flatnonzero(hashes % MIN_BLOCKSIZE == MIN_BLOCKSIZE - 1)
+        view = memoryview(chunk)
+        for level in levels:
+            if level.blocksize > MIN_BLOCKSIZE:
+                triggers = triggers[hashes[triggers] % level.blocksize == level.blocksize - 1]
+            level.update(view, offset, triggers)
+        offset += len(values)
+
+    index = len(levels) - 2
+    while True:
+        part1 = levels[index].part(SPAMSUM_LENGTH, offset, read_from)
+        if len(part1) >= SPAMSUM_LENGTH // 2 or index == 0:
+            break
+        index -= 1
+
+    part2 = levels[index + 1].part(SPAMSUM_LENGTH // 2, offset, read_from)
+    return f"{levels[index].blocksize}:{part1}:{part2}"
+
+
+def fuzzy_hash_bytes(data):
+    """
+    Generates the fuzzy digest of some data, see fuzzy_hash_chunks().
+
+    :param data: The data as bytes
+    :return: Returns the digest as a str
+    """
+    view = memoryview(data)
+
+    def read_from(start):
+        return (view[position:position + CHUNK_SIZE] for position in range(start, len(view), CHUNK_SIZE))
+
+    return fuzzy_hash_chunks(read_from(0), len(view), read_from)
+
+
+def fuzzy_hash_file(path):
+    """
+    Generates the fuzzy digest and SHA-256 of a file, reading it a chunk at a time.
+
+    :param path: Path of the file
+    :return: Returns (fuzzy digest, sha256), or None if the file is too large to fuzzy hash
+    """
+    size = os.path.getsize(path)
+    if size > MAX_FILE_SIZE:
+        return None
+
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+
+        def read_from(start):
+            f.seek(start)
+            while chunk := f.read(CHUNK_SIZE):
+                yield chunk
+
+        def chunks():
+            for chunk in read_from(0):
+                sha256.update(chunk)
+                yield chunk
+
+        digest = fuzzy_hash_chunks(chunks(), size, read_from)
+    return digest, sha256.hexdigest()
+
+
+def parse_digest(digest):
+    """Splits a digest into (blocksize, part1, part2)."""
+    blocksize, part1, part2 = digest.split(":", 2)
+    return int(blocksize), part1, part2
+
+
+def eliminate_sequences(part):
+    """Shortens runs of more than 3 identical characters to 3, as they carry little information (e.g. padding)."""
+    result = []
+    for char in part:
+        if len(result) < 3 or not (result[-1] == result[-2] == result[-3] == char):
+            result.append(char)
+    return "".join(result)
+
+
+def ngrams(part):
+    """Returns the set of ROLLING_WINDOW-length substrings of a digest part."""
+    return {part[i:i + ROLLING_WINDOW] for i in range(len(part) - ROLLING_WINDOW + 1)}
+
+
+def _edit_distance(a, b):
+    """Edit distance with insert/delete costing 1 and substitution 2 (a delete plus an insert)."""
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (0 if char_a == char_b else 2)))
+        previous = current
+    return previous[-1]
+
+
+def _score_parts(a, b, blocksize):
+    """Scores two digest parts made with the same block size from 0 (unrelated) to 100 (identical)."""
+    a, b = eliminate_sequences(a), eliminate_sequences(b)
+
+    # Parts without a common n-gram are not considered related at all.
+    if not a or not b or not (ngrams(a) & ngrams(b)):
+        return 0
+
+    score = 100 - (100 * _edit_distance(a, b)) // (len(a) + len(b))
+
+    # Digests of small files are short, so don't let them claim a very strong match.
+    cap = blocksize // MIN_BLOCKSIZE * min(len(a), len(b))
+    return min(score, cap)
+
+
+def compare(digest_a, digest_b):
+    """
+    Compares two fuzzy digests.
+
+    :return: Returns a similarity score from 0 to 100
+    """
+    blocksize_a, a1, a2 = parse_digest(digest_a)
+    blocksize_b, b1, b2 = parse_digest(digest_b)
+
+    if blocksize_a == blocksize_b:
+        return max(_score_parts(a1, b1, blocksize_a), _score_parts(a2, b2, blocksize_a * 2))
+    if blocksize_a == blocksize_b * 2:
+        return _score_parts(a1, b2, blocksize_a)
+    if blocksize_b == blocksize_a * 2:
+        return _score_parts(a2, b1, blocksize_b)
+    return 0
+
+
+class FuzzyIndex:
+    """
+    FuzzyIndex stores fuzzy digests of known samples in SQLite and finds similar ones without comparing against
+    every stored digest.
+
+    Each digest part is split into its n-grams, which are stored in a table keyed by (block size, n-gram). Two parts
+    can only score above 0 if they share an n-gram at the same block size, so a search looks up the query's n-grams,
+    takes the samples sharing the most of them as candidates, and only scores those.
+    """
+
+    def __init__(self, path="fuzzy_index.db"):
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS samples ("
+            "id INTEGER PRIMARY KEY, sha256 TEXT UNIQUE NOT NULL, digest TEXT NOT NULL, name TEXT)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS grams ("
+            "blocksize INTEGER NOT NULL, gram TEXT NOT NULL, sample_id INTEGER NOT NULL, "
+            "PRIMARY KEY (blocksize, gram, sample_id)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _keys(digest):
+        """Returns the (block size, n-gram) keys for both parts of a digest."""
+        blocksize, part1, part2 = parse_digest(digest)
+        keys = {(blocksize, gram) for gram in ngrams(eliminate_sequences(part1))}
+        keys |= {(blocksize * 2, gram) for gram in ngrams(eliminate_sequences(part2))}
+        return keys
+
+    def add(self, sha256, digest, name=None):
+        """
+        Adds a sample to the index. Samples already in the index (by SHA-256) are skipped.
+
+        :return: Returns True if the sample was added
+        """
+        with self._conn:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO samples (sha256, digest, name) VALUES (?, ?, ?)", (sha256, digest, name)
+            )
+            if cursor.rowcount == 0:
+                return False
+            sample_id = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO grams (blocksize, gram, sample_id) VALUES (?, ?, ?)",
+                [(blocksize, gram, sample_id) for blocksize, gram in self._keys(digest)],
+            )
+        return True
+
+    def search(self, digest, threshold=50, max_candidates=500):
+        """
+        Finds stored samples similar to a digest.
+
+        :param digest: The fuzzy digest to search for
+        :param threshold: Minimum similarity score (0-100) to report
+        :param max_candidates: How many of the samples sharing the most n-grams to score
+        :return: Returns a list of dicts (sha256, name, digest, score, vt_malicious), best match first
+        """
+        keys = self._keys(digest)
+        if not keys:
+            return []
+
+        placeholders = " OR ".join("(blocksize = ? AND gram = ?)" for _ in keys)
+        parameters = [value for key in keys for value in key]
+        candidates = self._conn.execute(
+            f"SELECT s.sha256, s.name, s.digest FROM samples s JOIN ("
+            f"SELECT sample_id, COUNT(*) AS shared FROM grams WHERE {placeholders} "
+            f"GROUP BY sample_id ORDER BY shared DESC LIMIT ?) c ON s.id = c.sample_id",
+            parameters + [max_candidates],
+        ).fetchall()
+
+        matches = []
+        cache = get_cache()
+        for sha256, name, candidate_digest in candidates:
+            score = compare(digest, candidate_digest)
+            if score < threshold:
+                continue
+
+            # Link the match to any VirusTotal verdict we already have for it (never calls the API)
+            attributes, _ = cache.get(cache.hash_key(sha256))
+            stats = (attributes or {}).get("last_analysis_stats")
+            matches.append({
+                "sha256": sha256,
+                "name": name,
+                "digest": candidate_digest,
+                "score": score,
+                "vt_malicious": f"{stats.get('malicious', 0)}/{sum(stats.values())}" if stats else None
+            })
+
+        return sorted(matches, key=lambda match: match["score"], reverse=True)
+
+    def close(self):
+        self._conn.close()
+
+
+def main():
+    """
+    Command line for fuzzy hashing, e.g.
+    python fuzzy_hash.py hash sample.exe
+    python fuzzy_hash.py add known_malware/*
+    python fuzzy_hash.py search suspicious.exe --threshold 60
+    """
+    parser = argparse.ArgumentParser(description="Fuzzy (similarity) hashing of files")
+    parser.add_argument("--index", default="fuzzy_index.db", help="Index database (default: fuzzy_index.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("hash", help="Print the fuzzy hash of files").add_argument("files", nargs="+")
+    commands.add_parser("add", help="Add files to the similarity index").add_argument("files", nargs="+")
+    search = commands.add_parser("search", help="Find indexed samples similar to files")
+    search.add_argument("files", nargs="+")
+    search.add_argument("--threshold", type=int, default=50, help="Minimum similarity score, 0-100 (default: 50)")
+    args = parser.parse_args()
+
+    index = None if args.command == "hash" else FuzzyIndex(args.index)
+
+    for path in args.files:
+        result = fuzzy_hash_file(path)
+        if result is None:
+            print(f"{path}: skipped, larger than {MAX_FILE_SIZE // 1024 ** 2} MiB")
+            continue
+        digest, sha256 = result
+
+        if args.command == "hash":
+            print(f"{digest}  {path}")
+        elif args.command == "add":
+            added = index.add(sha256, digest, os.path.basename(path))
+            print(f"{'Added' if added else 'Already indexed'}: {path}")
+        else:
+            matches = index.search(digest, threshold=args.threshold)
+            print(f"\n{path} ({digest}) - {len(matches)} similar sample(s)")
+            for match in matches:
+                verdict = match["vt_malicious"] or "no cached verdict"
+                print(f" - {match['score']:3d}  {match['sha256']}  {match['name']}  VirusTotal: {verdict}")
+
+    if index is not None:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
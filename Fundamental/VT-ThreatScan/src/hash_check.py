@@ -1,12 +1,47 @@
-import requests
-import json
 from utils import control_user_choice, retry_func
 from datetime import datetime
 import os
-from dotenv import load_dotenv
-import hashlib
-from utils import CSV
-import time
+import csv
+from utils import SearchLog, log_search
+from file_hasher import hash_file, scan_directory, DEFAULT_ALGORITHMS
+from vt_cache import get_cache
+from vt_client import get_client
+from hash_index import check_local_lists
+from scan_manifest import ScanManifest
+
+# The length parameters for the hash types available at VirusTotal
+hash_lengths = {
+    "MD5": 32,
+    "SHA-1": 40,
+    "SHA-256": 64
+}
+
+HEX_DIGITS = set("0123456789abcdefABCDEF")
+
+
+def classify_ioc(value):
+    """
+    Works out what kind of indicator a string is, using the hash_lengths dictionary for hashes.
+
+    :param value: A hash or URL as a str
+    :return: Returns "MD5", "SHA-1", "SHA-256" or "URL", or None if the value is not a valid indicator
+    """
+    value = value.strip()
+    if not value or any(char.isspace() for char in value):
+        return None
+
+    if set(value) <= HEX_DIGITS:
+        for hash_name, length in hash_lengths.items():
+            if len(value) == length:
+                return hash_name
+        return None
+
+    # Anything with a scheme or a dotted host name is treated as a URL
+    host = value.split("://", 1)[-1].split("/", 1)[0]
+    if "://" in value or "." in host:
+        return "URL"
+    return None
+
 
 def validate_hash():
     """
@@ -17,12 +52,6 @@ def validate_hash():
     :return: Returns the inserted hash as a str
     """
 
-    hash_lengths = {
-        "MD5": 32,
-        "SHA-1": 40,
-        "SHA-256": 64
-    }
-
     # Display the available hash types and their expected character lengths
     print("\nPlease select the hash you would like to check. (1,2,3)")
     for index, (hash_name, length) in enumerate(hash_lengths.items(), start=1):
@@ -110,8 +139,9 @@ def select_file():
 
 def gen_file_hash(algorithm="sha256"):
     """
-    Generates a sha256 hash for the selected file chosen by the user.
-    :return: Returns it as a str to be used in generating the report.
+    Generates the MD5, SHA-1 and SHA-256 hashes for the selected file chosen by the user in a single read of the file.
+    :param algorithm: Which of the hashes to use for generating the report
+    :return: Returns that hash as a str to be used in generating the report.
     """
 
     file_to_check = select_file()
@@ -120,59 +150,105 @@ def gen_file_hash(algorithm="sha256"):
         return
 
     try:
-        new_hash = hashlib.new(algorithm)
-        with open(file_to_check, "rb") as f:
-            while chunk := f.read(8192):
-                new_hash.update(chunk)
-
-        validated_hash = new_hash.hexdigest()
-        string_hash = str(validated_hash)
-        print(f"Generating SHA256 hash for the selected file '{file_to_check}'")
-        print(f"SHA256 Hash: {string_hash}")
-        return string_hash
+        print(f"Generating hashes for the selected file '{file_to_check}'")
+        digests = hash_file(file_to_check, algorithms=DEFAULT_ALGORITHMS)
+        for name, digest in digests.items():
+            print(f"{name.upper()} Hash: {digest}")
+        return digests[algorithm]
 
     except Exception as e:
         print(f"An error occurred as: {e}")
 
 
-def get_hash_report(hash_values, manual_or_file):
+def cached_verdict(digests):
     """
-    Makes an API call to VirusTotal, using the hash manually inserted from the user, or generated from a local file.
+    Looks for a VirusTotal verdict we already have in the local verdict cache for any of a file's digests.
+    Never calls the API.
 
-    Works through the response file and appends crucial information to our dict. We then call the log_entry method from
-    CSV in order to create a log of this search.
-
-    :param manual_or_file: Specifies whether the hash was inserted manually by the user, or generated from a local file
-    :param hash_values: The hash itself as a str
-    :return: Returns false only if the user would not like to recheck another file, taking you back to the Main Menu
+    :param digests: Dict of algorithm -> hex digest
+    :return: Returns the verdict as "malicious/total" engines, or "" if none of the digests are cached
     """
-    url = "https://www.virustotal.com/api/v3/files/"
-    hash_to_check = hash_values
-    complete_url = url + hash_to_check
+    cache = get_cache()
+    for digest in digests.values():
+        attributes, _ = cache.get(cache.hash_key(digest))
+        if attributes:
+            stats = attributes.get('last_analysis_stats', {})
+            return f"{stats.get('malicious', 0)}/{sum(stats.values())}"
+    return ""
 
-    # Securely load the API key
-    load_dotenv()
-    api_key = os.getenv('VT_API_KEY')
 
-    headers = {
-        "accept": "application/json",
-        "x-apikey": api_key
-    }
+def batch_scan(root, output_file="directory_scan.csv", workers=None, manifest_file="scan_manifest.db"):
+    """
+    Non-interactive directory scan. Walks the whole tree under root, hashes every file with MD5, SHA-1 and SHA-256
+    on a thread pool, and writes one row per file to output_file so the hashes can be triaged in bulk.
+
+    Files that have not changed since the last scan (same device, inode, size and mtime) are recorded in the
+    manifest_file and reuse their stored digests instead of being hashed again. Any VirusTotal verdict already in the
+    verdict cache is added to the row.
+
+    :param root: The directory to scan
+    :param output_file: CSV file to write the results to
+    :param workers: Number of worker threads hashing files
+    :param manifest_file: Manifest of previously hashed files, or None to hash every file
+    :return: Returns the number of files hashed
+    """
+    if not os.path.isdir(root):
+        print(f"Directory not found: {root}")
+        return 0
 
-    response = requests.get(complete_url, headers=headers)
+    columns = ["path", *DEFAULT_ALGORITHMS, "status", "vt_malicious", "error"]
+    hashed = 0
+    unchanged = 0
+    failed = 0
+    manifest = ScanManifest(manifest_file) if manifest_file else None
 
-    if response.status_code != 200:
-        print(f"Error: {response.status_code} from the API call.")
-        return False
+    try:
+        with open(output_file, "w", newline="") as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=columns)
+            writer.writeheader()
+
+            for path, digests, error, reused in scan_directory(root, workers=workers, manifest=manifest):
+                row = {"path": path, "error": error or ""}
+                if digests:
+                    row.update(digests)
+                    row["status"] = "unchanged" if reused else "hashed"
+                    row["vt_malicious"] = cached_verdict(digests)
+                    if reused:
+                        unchanged += 1
+                    else:
+                        hashed += 1
+                else:
+                    row["status"] = "error"
+                    failed += 1
+                writer.writerow(row)
+    finally:
+        if manifest is not None:
+            manifest.close()
+
+    print(f"Hashed {hashed} new or changed files under '{root}', reused {unchanged} unchanged "
+          f"({failed} could not be read).")
+    print(f"Results have been saved to '{output_file}'")
+    return hashed
+
+
+def fetch_hash_attributes(hash_to_check):
+    """
+    Makes the API call to VirusTotal for a single hash, using the shared VirusTotalClient.
 
-    response_data = json.loads(response.text)
-    time.sleep(6)  # Allows enough time for the API call.
-    hash_info = response_data['data']['attributes']
+    :param hash_to_check: The hash itself as a str
+    :return: Returns the 'attributes' dict from the file report, or None if the call failed
+    """
+    return get_client().get_file_attributes(hash_to_check)
 
-    if not hash_info:
-        print(f"Unable to retrieve information about this hash.")
-        return False
 
+def display_hash_info(hash_to_check, hash_info):
+    """
+    Displays the key information from a VirusTotal file report back to the user.
+
+    :param hash_to_check: The hash itself as a str
+    :param hash_info: The 'attributes' dict of the file report
+    :return: Returns the dict of information to log for this search
+    """
     # Extract and display key information back to the user.
     print("\n--- Displaying General Hash information ---")
     print(f"Hash: {hash_to_check}")
@@ -228,13 +304,53 @@ def get_hash_report(hash_values, manual_or_file):
         "Result": result
     }
 
+    return info_to_log
+
+
+def get_hash_report(hash_values, manual_or_file):
+    """
+    Gets the VirusTotal file report for the hash manually inserted from the user, or generated from a local file.
+    Hashes on our local known-good / known-bad lists are answered without calling VirusTotal at all, and reports we
+    have looked up before are served from the local verdict cache instead of calling the API again.
+
+    Works through the response file and appends crucial information to our dict. We then call log_search from utils
+    in order to create a log of this search.
+
+    :param manual_or_file: Specifies whether the hash was inserted manually by the user, or generated from a local file
+    :param hash_values: The hash itself as a str
+    :return: Returns false only if the user would not like to recheck another file, taking you back to the Main Menu
+    """
+    hash_to_check = hash_values
+
+    # Let the user know if this hash has come up in an earlier search
+    times_searched, first_seen, last_seen = SearchLog.history(hash_to_check)
+    if times_searched:
+        print(f"\nThis hash has been searched {times_searched} time(s) before. First: {first_seen}, Last: {last_seen}")
+
+    local_verdict = check_local_lists(hash_to_check)
+
+    if local_verdict:
+        # On one of our own lists, so there is no need to spend VirusTotal quota on it.
+        print(f"\nHash {hash_to_check} is on a local {local_verdict} list. Skipping the VirusTotal lookup.")
+        info_to_log = {"Local verdict": local_verdict}
+
+    else:
+        cache = get_cache()
+        hash_info = cache.get_or_fetch(cache.hash_key(hash_to_check), lambda: fetch_hash_attributes(hash_to_check))
+
+        if not hash_info:
+            print(f"Unable to retrieve information about this hash.")
+            return False
+
+        info_to_log = display_hash_info(hash_to_check, hash_info)
+
     # Log the hash search
     date = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
 
     if manual_or_file == "manual":
-        CSV.log_entry(date, "Hash", hash_values, info_to_log)
+        log_search(date, "Hash", hash_values, info_to_log)
     elif manual_or_file == "file":
-        CSV.log_entry(date, "File", hash_values, info_to_log)
+        log_search(date, "File", hash_values, info_to_log)
 
     print("This search has been saved to the log file 'complete_searches.csv'")
 
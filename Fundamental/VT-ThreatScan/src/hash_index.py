@@ -0,0 +1,289 @@
+import argparse
+import heapq
+import math
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+from dotenv import load_dotenv
+
+# Digest width in bytes for each algorithm we can index. One index file holds one algorithm.
+DIGEST_SIZES = {
+    "md5": 16,
+    "sha1": 20,
+    "sha256": 32
+}
+
+INDEX_MAGIC = b"VTHIDX1\0"
+BLOOM_MAGIC = b"VTBLOOM1"
+INDEX_HEADER = struct.Struct("<8sHQ")   # magic, digest width, number of digests
+BLOOM_HEADER = struct.Struct("<8sQB")   # magic, number of bits, number of hash functions
+
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+RUN_SIZE = 2_000_000  # Digests sorted in memory at once while building (about 150 MB for SHA-256, ~74 bytes each)
+
+
+class BloomFilter:
+    """
+    Bloom filter kept in front of a HashIndex, so a hash that is not in the list is ruled out without touching the
+    sorted index at all. Digests are already uniformly random, so the bit positions are derived straight from the
+    digest bytes (double hashing) instead of hashing them again.
+    """
+
+    def __init__(self, bits, num_bits, num_hashes):
+        self.bits = bits
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+
+    @classmethod
+    def for_capacity(cls, capacity, false_positive_rate=BLOOM_FALSE_POSITIVE_RATE):
+        """Creates an empty filter sized for capacity digests at the given false positive rate."""
+        capacity = max(capacity, 1)
+        num_bits = max(8, int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        return cls(bytearray((num_bits + 7) // 8), num_bits, num_hashes)
+
+    def _positions(self, digest):
+        """Yields the bit positions for a digest."""
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, digest):
+        for position in self._positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, digest):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(digest))
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(BLOOM_HEADER.pack(BLOOM_MAGIC, self.num_bits, self.num_hashes))
+            f.write(self.bits)
+
+
+class HashIndex:
+    """
+    Read-only lookup over an on-disk index of sorted, fixed-width binary digests.
+
+    The index file is memory mapped and searched with a binary search, so lists with hundreds of millions of entries
+    are never loaded into memory and each lookup reads only a few pages. The Bloom filter next to it ('.bloom') is
+    memory mapped too and checked first, so most misses cost no index reads at all.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.width, self.count = INDEX_HEADER.unpack_from(self._mmap, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{path} is not a hash index file")
+
+        self.bloom = None
+        bloom_path = path + ".bloom"
+        if os.path.exists(bloom_path):
+            self._bloom_file = open(bloom_path, "rb")
+            self._bloom_mmap = mmap.mmap(self._bloom_file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, num_bits, num_hashes = BLOOM_HEADER.unpack_from(self._bloom_mmap, 0)
+            if magic == BLOOM_MAGIC:
+                bits = memoryview(self._bloom_mmap)[BLOOM_HEADER.size:]
+                self.bloom = BloomFilter(bits, num_bits, num_hashes)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, hash_value):
+        try:
+            digest = bytes.fromhex(hash_value.strip())
+        except ValueError:
+            return False
+
+        if len(digest) != self.width:
+            return False
+        if self.bloom is not None and digest not in self.bloom:
+            return False
+
+        # Binary search over the fixed-width records
+        low, high = 0, self.count
+        offset = INDEX_HEADER.size
+        while low < high:
+            middle = (low + high) // 2
+            start = offset + middle * self.width
+            record = self._mmap[start:start + self.width]
+            if record < digest:
+                low = middle + 1
+            elif record > digest:
+                high = middle
+            else:
+                return True
+        return False
+
+
+def read_digests(paths, width):
+    """
+    Reads hex digests from plain hash lists or NSRL-style CSV files. The first hex value of the right length on
+    each line is taken, so quoted CSV columns for other algorithms are skipped.
+
+    :param paths: Files to read
+    :param width: Digest width in bytes
+    :return: Yields each digest as bytes
+    """
+    pattern = re.compile(rf"(?<![0-9a-fA-F])[0-9a-fA-F]{{{width * 2}}}(?![0-9a-fA-F])")
+
+    for path in paths:
+        with open(path, "r", errors="replace") as f:
+            for line in f:
+                match = pattern.search(line)
+                if match:
+                    yield bytes.fromhex(match.group())
+
+
+def _write_run(digests, directory):
+    """Sorts one run of digests and writes it to a temporary file, returning (path, count)."""
+    digests.sort()
+    fd, path = tempfile.mkstemp(suffix=".run", dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        f.write(b"".join(digests))
+    return path, len(digests)
+
+
+def _read_run(path, width):
+    """Yields the digests of a sorted run file in order."""
+    with open(path, "rb") as f:
+        while record := f.read(width * 4096):
+            for start in range(0, len(record), width):
+                yield record[start:start + width]
+
+
+def build_index(input_paths, output_path, algorithm="sha256"):
+    """
+    Builds a sorted binary index (plus its Bloom filter) from hash lists. Lists larger than memory are handled with
+    an external merge sort: runs of RUN_SIZE digests are sorted and spilled to disk, then merged in one pass with
+    duplicates dropped.
+
+    :param input_paths: Hash list files (one hash per line, or NSRL-style CSV)
+    :param output_path: Where to write the index; the Bloom filter is written to output_path + '.bloom'
+    :param algorithm: md5, sha1 or sha256
+    :return: Returns the number of unique digests in the index
+    """
+    width = DIGEST_SIZES[algorithm]
+    directory = os.path.dirname(os.path.abspath(output_path))
+    runs = []
+
+    try:
+        run = []
+        for digest in read_digests(input_paths, width):
+            run.append(digest)
+            if len(run) >= RUN_SIZE:
+                runs.append(_write_run(run, directory))
+                run = []
+        if run or not runs:
+            runs.append(_write_run(run, directory))
+
+        bloom = BloomFilter.for_capacity(sum(count for _, count in runs))
+        count = 0
+        previous = None
+
+        with open(output_path, "wb") as out:
+            out.write(INDEX_HEADER.pack(INDEX_MAGIC, width, 0))
+            for digest in heapq.merge(*(_read_run(path, width) for path, _ in runs)):
+                if digest == previous:
+                    continue
+                out.write(digest)
+                bloom.add(digest)
+                previous = digest
+                count += 1
+
+            # Now we know the real count, fill it in
+            out.seek(0)
+            out.write(INDEX_HEADER.pack(INDEX_MAGIC, width, count))
+
+        bloom.save(output_path + ".bloom")
+        return count
+
+    finally:
+        for path, _ in runs:
+            os.remove(path)
+
+
+class LocalHashLists:
+    """
+    Known-good (e.g. NSRL) and known-bad (internal blocklist) indexes that hash_check consults before spending
+    VirusTotal quota. The index files are listed, comma separated, in VT_KNOWN_GOOD_INDEXES and
+    VT_KNOWN_BAD_INDEXES in the .env file.
+    """
+
+    def __init__(self, known_good_paths=(), known_bad_paths=()):
+        self.known_good = [HashIndex(path) for path in known_good_paths]
+        self.known_bad = [HashIndex(path) for path in known_bad_paths]
+
+    @classmethod
+    def from_env(cls):
+        load_dotenv()
+
+        def paths(name):
+            return [path.strip() for path in os.getenv(name, "").split(",") if path.strip()]
+
+        return cls(paths("VT_KNOWN_GOOD_INDEXES"), paths("VT_KNOWN_BAD_INDEXES"))
+
+    def check(self, hash_value):
+        """
+        Checks a hash against the local lists. Blocklists win if a hash is somehow on both.
+
+        :param hash_value: MD5, SHA-1 or SHA-256 hex digest
+        :return: Returns "known-bad", "known-good", or None when the hash is not on any list
+        """
+        if any(hash_value in index for index in self.known_bad):
+            return "known-bad"
+        if any(hash_value in index for index in self.known_good):
+            return "known-good"
+        return None
+
+
+_local_lists = None
+_local_lists_lock = threading.Lock()
+
+
+def check_local_lists(hash_value):
+    """Checks a hash against the local known-good / known-bad indexes configured in the .env file."""
+    global _local_lists
+    with _local_lists_lock:
+        if _local_lists is None:
+            _local_lists = LocalHashLists.from_env()
+    return _local_lists.check(hash_value)
+
+
+def main():
+    """
+    Command line for building and checking indexes, e.g.
+    python hash_index.py build --algorithm sha1 --output nsrl_sha1.idx NSRLFile.txt
+    python hash_index.py lookup nsrl_sha1.idx <hash>
+    """
+    parser = argparse.ArgumentParser(description="Build or query a local known-good / known-bad hash index")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Build an index from hash list files")
+    build.add_argument("inputs", nargs="+", help="Hash lists (one hash per line, or NSRL-style CSV)")
+    build.add_argument("--output", required=True, help="Index file to write")
+    build.add_argument("--algorithm", choices=DIGEST_SIZES, default="sha256")
+
+    lookup = commands.add_parser("lookup", help="Check whether a hash is in an index")
+    lookup.add_argument("index", help="Index file")
+    lookup.add_argument("hash", help="Hash to look up")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        count = build_index(args.inputs, args.output, args.algorithm)
+        print(f"Indexed {count} unique {args.algorithm} hashes into '{args.output}'")
+    else:
+        found = args.hash in HashIndex(args.index)
+        print(f"{args.hash}: {'found' if found else 'not found'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
+import argparse
 from utils import control_user_choice
-from hash_check import hash_sub_menu
+from hash_check import hash_sub_menu, batch_scan
 from url_check import review_analysis
-from utils import CSV
+from utils import CSV, SearchLog
 
 
 def main():
@@ -11,7 +12,8 @@ def main():
     - File report on a URL which a user uploads manually
 
     This programme makes API calls to VirusTotal, in order to generate results.
-    Results are saved to completed_searches.csv, for audit trailing and a permanent search history.
+    Results are saved to completed_searches.csv, for audit trailing and a permanent search history, and to the
+    indexed completed_searches.db so earlier searches can be looked up quickly.
 
     Contains control flow and logic to keep the user from creating an error in the programme
     Uses control_user_choice from utils to allow users to safely navigate the Menu
@@ -19,6 +21,8 @@ def main():
 
     # Initialise the CSV file - File used as an audit trail of hash/url searches
     CSV.initialise_csv()
+    # Initialise the indexed search log - answers "have we searched this before, and when"
+    SearchLog.initialise_db()
 
     while True:
         print("\n --- Main Menu ---")
@@ -43,5 +47,29 @@ def main():
             break
 
 
+def parse_args():
+    """
+    Command line options for running the programme without the menu.
+    With no options the interactive Main Menu is started as before.
+    """
+    parser = argparse.ArgumentParser(description="VT-ThreatScan - check hashes and URLs with VirusTotal")
+    parser.add_argument("--scan-dir", metavar="DIR",
+                        help="Hash every file under DIR (MD5, SHA-1, SHA-256) without using the menu")
+    parser.add_argument("--output", default="directory_scan.csv",
+                        help="CSV file for --scan-dir results (default: directory_scan.csv)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of files to hash in parallel")
+    parser.add_argument("--manifest", default="scan_manifest.db",
+                        help="Manifest of previously hashed files; unchanged files are not hashed again")
+    parser.add_argument("--full-rescan", action="store_true",
+                        help="Hash every file, ignoring (and not updating) the manifest")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    if args.scan_dir:
+        manifest = None if args.full_rescan else args.manifest
+        batch_scan(args.scan_dir, output_file=args.output, workers=args.workers, manifest_file=manifest)
+    else:
+        main()
@@ -0,0 +1,91 @@
+import os
+import sqlite3
+import time
+from file_hasher import DEFAULT_ALGORITHMS
+
+
+class ScanManifest:
+    """
+    ScanManifest remembers every file a directory scan has hashed, keyed by (device, inode), together with the size
+    and mtime_ns it had at the time. On the next scan a file whose size and mtime_ns are unchanged reuses its stored
+    digests instead of being read again, so only new or changed files cost any I/O.
+
+    Writes are batched, and rows for files under the scanned directory that were not seen in a run are removed when
+    the run finishes.
+    """
+    BATCH_SIZE = 500
+
+    def __init__(self, path="scan_manifest.db"):
+        self.path = path
+        self._pending = []   # Digests of new/changed files waiting to be written
+        self._seen = []      # Unchanged files whose last_seen time needs updating
+        self._run_started = time.time()
+
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "device INTEGER NOT NULL, inode INTEGER NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+            "path TEXT NOT NULL, md5 TEXT, sha1 TEXT, sha256 TEXT, last_seen REAL NOT NULL, "
+            "PRIMARY KEY (device, inode))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_files_path ON files (path)")
+        self._conn.commit()
+
+    def lookup(self, stat):
+        """
+        Returns the stored digests for a file if it has not changed since it was last hashed.
+
+        :param stat: os.stat_result of the file
+        :return: Returns a dict of algorithm -> digest, or None if the file is new or has changed
+        """
+        row = self._conn.execute(
+            "SELECT size, mtime_ns, md5, sha1, sha256 FROM files WHERE device = ? AND inode = ?",
+            (stat.st_dev, stat.st_ino),
+        ).fetchone()
+
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+            return None
+        return dict(zip(DEFAULT_ALGORITHMS, row[2:]))
+
+    def mark_unchanged(self, path, stat):
+        """Records that an unchanged file was seen in this run (and where it now lives)."""
+        self._seen.append((path, self._run_started, stat.st_dev, stat.st_ino))
+        if len(self._seen) >= self.BATCH_SIZE:
+            self.flush()
+
+    def record(self, path, stat, digests):
+        """Stores the digests of a new or changed file."""
+        self._pending.append((stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, path,
+                              *(digests.get(name) for name in DEFAULT_ALGORITHMS), self._run_started))
+        if len(self._pending) >= self.BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Writes all batched changes in one transaction."""
+        with self._conn:
+            if self._pending:
+                self._conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", self._pending)
+                self._pending.clear()
+            if self._seen:
+                self._conn.executemany(
+                    "UPDATE files SET path = ?, last_seen = ? WHERE device = ? AND inode = ?", self._seen
+                )
+                self._seen.clear()
+
+    def finish(self, root):
+        """
+        Writes everything still batched and forgets files under root that were not seen in this run (deleted files).
+        """
+        self.flush()
+        prefix = os.path.join(os.path.abspath(root), "")
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM files WHERE last_seen < ? AND substr(path, 1, ?) = ?",
+                (self._run_started, len(prefix), prefix),
+            )
+
+    def close(self):
+        self.flush()
+        self._conn.close()
@@ -1,82 +1,168 @@
-import requests
-import os
-from dotenv import load_dotenv
-import json
+import heapq
+import itertools
+import random
+import sys
+import time
 from collections import Counter
-from utils import CSV
+from utils import SearchLog, log_search
+from vt_cache import get_cache
+from vt_client import get_client
 from datetime import datetime
-import time
 
-# Securely load the API key
-load_dotenv()
-api_key = os.getenv('VT_API_KEY')
+# Polling settings for URL analyses that are still queued or in progress.
+POLL_INITIAL_DELAY = 5   # Seconds before the first status check
+POLL_MAX_DELAY = 60      # Upper limit for the backoff between checks
+POLL_DEADLINE = 300      # Give up on an analysis after this many seconds
 
-def get_analysis_id():
+
+class AnalysisPoller:
     """
-    Gets the URL via input and makes POST request to VirusTotal in order to get the analysisID
-    :return: Returns the analysis id along with the URL submitted via the CLI
+    Waits for many VirusTotal URL analyses on a single thread.
+
+    Each pending analysis moves through a small state machine: it is checked once its next poll time is due, and
+    finishes as 'completed' when attributes.status says so, 'error' when the API call fails, or 'timeout' once its
+    deadline has passed. Otherwise it is rescheduled with exponential backoff and jitter. A heap ordered by next poll
+    time means one loop can multiplex thousands of analyses without a thread each.
     """
 
-    url = "https://www.virustotal.com/api/v3/urls"
+    def __init__(self, client=None, initial_delay=POLL_INITIAL_DELAY, max_delay=POLL_MAX_DELAY,
+                 deadline=POLL_DEADLINE):
+        self.client = client or get_client()
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self._heap = []
+        self._order = itertools.count()  # Tie breaker so the heap never compares contexts
+
+    def __len__(self):
+        return len(self._heap)
+
+    def add(self, analysis_id, context=None):
+        """
+        Starts tracking a submitted analysis.
+
+        :param analysis_id: The id returned when the URL was submitted
+        :param context: Anything the caller wants back with the result, e.g. the URL
+        """
+        now = time.monotonic()
+        heapq.heappush(self._heap, (now + self.initial_delay, next(self._order), analysis_id, context, 0,
+                                    now + self.deadline))
+
+    def poll_due(self):
+        """
+        Checks every analysis whose poll time has come, without waiting for any others.
+
+        :return: Returns a list of (context, attributes, state) for analyses that finished
+        """
+        finished = []
+
+        while self._heap and self._heap[0][0] <= time.monotonic():
+            _, _, analysis_id, context, attempt, deadline = heapq.heappop(self._heap)
+            try:
+                attributes = self.client.get_analysis(analysis_id)
+            except Exception as e:  # A bad response - the analysis finishes as an error instead of ending the run
+                print(f"Error: {e} while checking analysis {analysis_id}.", file=sys.stderr)
+                attributes = None
+
+            if attributes is None:
+                finished.append((context, None, "error"))
+            elif attributes.get("status") == "completed":
+                finished.append((context, attributes, "completed"))
+            elif time.monotonic() >= deadline:
+                finished.append((context, attributes, "timeout"))
+            else:
+                # Still queued / in-progress: back off exponentially, with jitter so polls don't bunch up.
+                delay = min(self.max_delay, self.initial_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+                next_poll = min(time.monotonic() + delay, deadline)
+                heapq.heappush(self._heap, (next_poll, next(self._order), analysis_id, context, attempt + 1,
+                                            deadline))
+
+        return finished
+
+    def run(self):
+        """
+        Polls until every tracked analysis has finished, sleeping until the next one is due.
+
+        :return: Yields (context, attributes, state) as each analysis finishes
+        """
+        while self._heap:
+            wait = self._heap[0][0] - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            yield from self.poll_due()
+
+
+def get_analysis_id(url_to_check):
+    """
+    Makes POST request to VirusTotal in order to get the analysisID for the URL
+    :param url_to_check: The URL submitted via the CLI
+    :return: Returns the analysis id, or False if the API call failed
+    """
+    # POST request NOT get
+    print("Getting analysis ID for this URL scan...")
+    analysis_id = get_client().submit_url(url_to_check)
 
-    headers = {
-        "accept": "application/json",
-        "content-type": "application/x-www-form-urlencoded",
-        "x-apikey": api_key
-    }
+    if analysis_id is None:
+        return False
+    return analysis_id
 
-    while True:
-        print("Please paste the url you wish to scan")
-        url_to_check = input("URL: ").strip()
 
-        if not url_to_check:
-            print("Input cannot be empty")
-            continue
+def fetch_url_attributes(url_to_check):
+    """
+    Submits the URL and polls VirusTotal with GET requests until the analysis of the URL has completed.
+    :param url_to_check: The URL submitted via the CLI
+    :return: Returns the 'attributes' dict of the analysis, or None if it failed or did not complete in time
+    """
 
-        payload = { "url": url_to_check}
-        # POST request NOT get
-        print("Getting analysis ID for this URL scan...")
-        response = requests.post(url, data=payload, headers=headers)
+    analysis_id = get_analysis_id(url_to_check)
+    if analysis_id is False:
+        return None
 
-        if response.status_code != 200:
-            print(f"Error: {response.status_code} from the API call.")
-            return False
+    # GET request NOT post
+    print(f"Performing URL scan on: '{url_to_check}'...")
+    poller = AnalysisPoller()
+    poller.add(analysis_id, url_to_check)
 
-        response_data = json.loads(response.text)
-        analysis_id = response_data['data']['id']
-        return analysis_id, url_to_check
+    for _, attributes, state in poller.run():
+        if state == "completed":
+            return attributes
+        if state == "timeout":
+            print(f"The analysis was still '{attributes.get('status')}' after {poller.deadline} seconds. "
+                  f"Please try again later.", file=sys.stderr)
+    return None
 
 
 def get_url_analysis():
     """
-    Gets the analysisID and url submitted via the CLI to proceed. Makes a GET request to VirusTotal to get the file report
-    on the specified URL.
-    :return: Returns the file report along with the URL
+    Gets the URL via input, and returns its analysis from the local verdict cache when we have scanned it before,
+    or from VirusTotal otherwise.
+    :return: Returns the analysis attributes along with the URL
     """
 
-    analysis_id, url_to_check = get_analysis_id()
-    if analysis_id is False:
-        return None
+    cache = get_cache()
 
-    url = "https://www.virustotal.com/api/v3/analyses/"
-    complete_url = url + analysis_id
+    while True:
+        print("Please paste the url you wish to scan")
+        url_to_check = input("URL: ").strip()
 
-    headers = {
-        "accept": "application/json",
-        "x-apikey": api_key
-    }
+        if not url_to_check:
+            print("Input cannot be empty")
+            continue
 
-    # GET request NOT post
-    print(f"Performing URL scan on: '{url_to_check}'...")
-    response = requests.get(complete_url, headers=headers)
+        try:
+            cache_key = cache.url_key(url_to_check)
+        except ValueError as e:
+            print(f"That URL is not valid ({e}), please try again")
+            continue
+        break
 
-    if response.status_code != 200:
-        print(f"Error: {response.status_code} from the API call.")
-        return False
+    # Let the user know if this URL has come up in an earlier search
+    times_searched, first_seen, last_seen = SearchLog.history(url_to_check)
+    if times_searched:
+        print(f"This URL has been searched {times_searched} time(s) before. First: {first_seen}, Last: {last_seen}")
 
-    response_data = json.loads(response.text)
-    time.sleep(6)  # Allows enough time for the API call.
-    return response_data, url_to_check
+    analysis = cache.get_or_fetch(cache_key, lambda: fetch_url_attributes(url_to_check))
+    return analysis, url_to_check
 
 
 def review_analysis():
@@ -84,7 +170,7 @@ def review_analysis():
     Works through our file report on the specified URL. Counts instances of particular engine results such as
     Malicious count, Suspicious count, etc.
 
-    We then save this information calling the log_entry method from CSV, to create a permanent log of this search.
+    We then save this information calling log_search from utils, to create a permanent log of this search.
     :return: N/A
     """
 
@@ -93,7 +179,7 @@ def review_analysis():
     if not url_analysis:
         return False
 
-    analysis_data = url_analysis['data']['attributes']['results']
+    analysis_data = url_analysis['results']
 
     # Collect all the category values into a single list
     categories = [engine['category'] for engine in analysis_data.values()]
@@ -117,4 +203,4 @@ def review_analysis():
 
     # Log the hash search
     date = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
-    CSV.log_entry(date, "URL", url_to_check, info_to_log)
+    log_search(date, "URL", url_to_check, info_to_log)
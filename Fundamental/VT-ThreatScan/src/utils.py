@@ -1,5 +1,16 @@
+import atexit
 import csv
+import json
 import os
+import queue
+import sqlite3
+import sys
+import random
+import threading
+import time
+from datetime import datetime
+import requests
+from dotenv import load_dotenv
 
 
 class CSV:
@@ -25,34 +36,374 @@ class CSV:
             print(f"Error initialising the CSV file: {e}")
 
     @classmethod
-    def log_entry(cls, date, search, query, result):
+    def format_entry(cls, date, search, query, result):
         """
-        Adds a new log entry after the user performs a search on a hash or url
+        Builds the CSV row for a search
         :param date: The date of the search
         :param search: The type of search (HASH/URL)
         :param query: The hash/url searched
         :param result: The result of the search
-        :return:
+        :return: Returns the row as a dict
         """
 
         # Format the result (dict) neatly for the CSV log entry
         format_result = ", ".join([f"{key}: {value}" for key, value in result.items()])
 
-        new_entry = {
+        return {
             "date": date,
             "search": search,
             "query": query,
             "result": format_result
         }
 
-        # Take a dict and write it into the CSV file (CSV WRITER)
+
+class SearchLog:
+    """
+    SearchLog keeps a structured, indexed copy of every search in 'completed_searches.db' (SQLite in WAL mode).
+    Unlike the CSV audit trail the result fields are stored as JSON, and the table is indexed on query, search type
+    and date, so "have we seen this hash before, and when" is an index lookup instead of a scan of the whole log.
+
+    Entries are written in batches by the background LogWriter.
+    """
+    DB_FILE = "completed_searches.db"
+
+    _conn = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def initialise_db(cls):
+        """
+        Opens the database, creating the table and its indexes if they do not exist yet
+        :return:
+        """
+        with cls._lock:
+            if cls._conn is not None:
+                return
+            try:
+                cls._conn = sqlite3.connect(cls.DB_FILE, check_same_thread=False)
+                cls._conn.execute("PRAGMA journal_mode=WAL")
+                cls._conn.execute("PRAGMA synchronous=NORMAL")
+                cls._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS searches ("
+                    "id INTEGER PRIMARY KEY, date TEXT NOT NULL, search TEXT NOT NULL, query TEXT NOT NULL, "
+                    "result TEXT NOT NULL)"
+                )
+                cls._conn.execute("CREATE INDEX IF NOT EXISTS idx_searches_query ON searches (query, date)")
+                cls._conn.execute("CREATE INDEX IF NOT EXISTS idx_searches_search ON searches (search, date)")
+                cls._conn.execute("CREATE INDEX IF NOT EXISTS idx_searches_date ON searches (date)")
+                cls._conn.commit()
+            except sqlite3.Error as e:
+                cls._conn = None
+                print(f"Error initialising the search log: {e}")
+
+    @staticmethod
+    def _iso_date(date):
+        """Converts our 'dd-mm-YYYY HH:MM:SS' log dates to ISO format, so they sort and index correctly."""
         try:
-            with open(cls.CSV_FILE, "a", newline="") as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=cls.COLUMNS)
-                writer.writerow(new_entry)
-            print("Entry added successfully.")
-        except Exception as e:
-            print(f"Error writing to CSV file: {e}")
+            return datetime.strptime(date, "%d-%m-%Y %H:%M:%S").isoformat(sep=" ")
+        except ValueError:
+            return date
+
+    @classmethod
+    def write_entries(cls, entries):
+        """
+        Writes a batch of searches to the database in a single transaction
+        :param entries: List of (date, search, query, result) tuples, result being a dict
+        :return:
+        """
+        cls.initialise_db()
+        rows = [(cls._iso_date(date), search, query, json.dumps(result, default=str))
+                for date, search, query, result in entries]
+
+        with cls._lock:
+            if cls._conn is None:
+                return
+            try:
+                with cls._conn:
+                    cls._conn.executemany("INSERT INTO searches (date, search, query, result) VALUES (?, ?, ?, ?)", rows)
+            except sqlite3.Error as e:
+                print(f"Error writing to the search log: {e}")
+
+    @classmethod
+    def history(cls, query):
+        """
+        Looks up when a hash/url has been searched before.
+        :param query: The hash/url to look up
+        :return: Returns (times_searched, first_seen, last_seen), with None dates if it was never searched
+        """
+        cls.initialise_db()
+        get_log_writer().flush()  # Make sure searches still queued for writing are included
+        with cls._lock:
+            if cls._conn is None:
+                return 0, None, None
+            return cls._conn.execute(
+                "SELECT COUNT(*), MIN(date), MAX(date) FROM searches WHERE query = ?", (query,)
+            ).fetchone()
+
+
+class LogWriter:
+    """
+    LogWriter moves all writes to the search logs onto one dedicated background thread, so lookups never wait on
+    disk and concurrent searches can never interleave rows in the CSV.
+
+    Searches are queued by log_search() and written in batches: a batch is written as soon as it holds batch_size
+    entries, or after flush_interval seconds otherwise. The CSV file is fsynced according to fsync_policy:
+    "always" (after every batch), "interval" (at most once every fsync_interval seconds, and when closing) or "never".
+    Anything still queued is written when the programme exits. A batch that fails to write is reported and skipped,
+    so the thread keeps running and flush() never waits forever.
+    """
+
+    def __init__(self, batch_size=100, flush_interval=1.0, fsync_policy="interval", fsync_interval=5.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self._queue = queue.Queue()
+        self._stop = object()  # Sentinel telling the thread to drain and finish
+        self._last_fsync = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="search-log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Builds the writer from settings in the .env file:
+        VT_LOG_BATCH_SIZE, VT_LOG_FLUSH_INTERVAL (seconds) and VT_LOG_FSYNC (always/interval/never)
+        """
+        load_dotenv()
+        return cls(
+            batch_size=int(os.getenv("VT_LOG_BATCH_SIZE", "100")),
+            flush_interval=float(os.getenv("VT_LOG_FLUSH_INTERVAL", "1.0")),
+            fsync_policy=os.getenv("VT_LOG_FSYNC", "interval").lower(),
+        )
+
+    def submit(self, entry):
+        """Queues a (date, search, query, result) entry. Never blocks on disk."""
+        self._queue.put(entry)
+
+    def flush(self):
+        """Blocks until every entry queued so far has been written (or gives up if the writer thread has stopped)."""
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks and self._thread.is_alive():
+                self._queue.all_tasks_done.wait(0.1)
+
+    def close(self):
+        """Writes anything still queued and stops the writer thread."""
+        if self._thread.is_alive():
+            self._queue.put(self._stop)
+            self._thread.join()
+
+    def _run(self):
+        """The writer thread: collects batches from the queue and writes them until told to stop."""
+        CSV.initialise_csv()
+        stopping = False
+
+        try:
+            csvfile = open(CSV.CSV_FILE, "a", newline="")
+            writer = csv.DictWriter(csvfile, fieldnames=CSV.COLUMNS)
+        except OSError as e:
+            print(f"Error opening the CSV file, searches will only be kept in the search log: {e}", file=sys.stderr)
+            csvfile = writer = None
+
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+
+            # Wait for the first entry, then keep collecting until the batch is full or the interval is up.
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic() if batch else None
+                try:
+                    entry = self._queue.get(timeout=max(timeout, 0) if timeout is not None else None)
+                except queue.Empty:
+                    break
+
+                if entry is self._stop:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(entry)
+
+            if batch:
+                try:
+                    self._write_batch(csvfile, writer, batch)
+                except Exception as e:
+                    print(f"Error writing to the search logs: {e}", file=sys.stderr)
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+
+        if csvfile is not None:
+            try:
+                if self.fsync_policy != "never":
+                    os.fsync(csvfile.fileno())  # The last batch may not have been synced yet
+                csvfile.close()
+            except OSError as e:
+                print(f"Error closing the CSV file: {e}", file=sys.stderr)
+
+    def _write_batch(self, csvfile, writer, batch):
+        """Writes one batch to the CSV file (if it could be opened) and the SearchLog database."""
+        if csvfile is not None:
+            try:
+                writer.writerows(CSV.format_entry(*entry) for entry in batch)
+                csvfile.flush()
+
+                now = time.monotonic()
+                if self.fsync_policy == "always" or (
+                        self.fsync_policy == "interval" and now - self._last_fsync >= self.fsync_interval):
+                    os.fsync(csvfile.fileno())
+                    self._last_fsync = now
+            except Exception as e:
+                print(f"Error writing to CSV file: {e}", file=sys.stderr)
+
+        SearchLog.write_entries(batch)
+
+
+_log_writer = None
+_log_writer_lock = threading.Lock()
+
+
+def get_log_writer():
+    """Returns the shared LogWriter, starting its thread on first use."""
+    global _log_writer
+    with _log_writer_lock:
+        if _log_writer is None:
+            _log_writer = LogWriter.from_env()
+    return _log_writer
+
+
+def log_search(date, search, query, result):
+    """
+    Queues a completed search for the CSV audit trail and the indexed SearchLog. The write happens on the
+    background LogWriter thread, so this returns straight away.
+    :param date: The date of the search
+    :param search: The type of search (HASH/URL)
+    :param query: The hash/url searched
+    :param result: The result of the search as a dict
+    """
+    get_log_writer().submit((date, search, query, result))
+
+
+# Requests per minute allowed by each VirusTotal API tier. Premium quotas vary by contract, so
+# VT_REQUESTS_PER_MINUTE in the .env file overrides the value for the chosen tier.
+VT_TIER_LIMITS = {
+    "public": 4,
+    "premium": 1000
+}
+
+# Seconds to wait for a connection, and then for each read, before a VirusTotal call gives up - so a stalled socket
+# can never hold a pooled connection (and the thread using it) forever.
+VT_REQUEST_TIMEOUT = (10, 60)
+
+
+class RateLimiter:
+    """
+    Token bucket shared by everything that calls the VirusTotal API. The bucket holds up to `burst` tokens and refills
+    at the tier's rate, so a request is sent as soon as quota is available instead of sleeping a fixed time after every
+    call. Callers waiting for a token are served in the order they arrived.
+    """
+
+    def __init__(self, requests_per_minute, burst=None):
+        self.rate = requests_per_minute / 60  # Tokens added per second
+        self.capacity = burst or requests_per_minute
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._paused_until = 0  # Set when the API tells us to back off (429 / Retry-After)
+        self._next_ticket = 0
+        self._serving = 0
+        self._condition = threading.Condition()
+
+    def _refill(self, now):
+        """Adds the tokens earned since the last refill, up to the bucket capacity."""
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self):
+        """Blocks until a token is available and it is this caller's turn, then spends the token."""
+        with self._condition:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+
+            while ticket != self._serving:
+                self._condition.wait()
+
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._paused_until - now
+
+                if wait <= 0:
+                    if self._tokens >= 1:
+                        break
+                    wait = (1 - self._tokens) / self.rate
+
+                self._condition.wait(wait)
+
+            self._tokens -= 1
+            self._serving += 1
+            self._condition.notify_all()
+
+    def pause(self, seconds):
+        """Stops handing out tokens for the given number of seconds, e.g. after a 429 response."""
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+            self._condition.notify_all()
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """
+    Returns the shared VirusTotal rate limiter, sized from VT_API_TIER (public/premium) and the optional
+    VT_REQUESTS_PER_MINUTE override in the .env file.
+    """
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            load_dotenv()
+            tier = os.getenv("VT_API_TIER", "public").lower()
+            per_minute = int(os.getenv("VT_REQUESTS_PER_MINUTE", VT_TIER_LIMITS.get(tier, VT_TIER_LIMITS["public"])))
+            _rate_limiter = RateLimiter(per_minute)
+    return _rate_limiter
+
+
+def send_vt_request(method, url, session=None, max_retries=5, **kwargs):
+    """
+    Sends a request to the VirusTotal API through the shared rate limiter. Every VT call should go through here.
+    A 429 (quota exceeded) response pauses the limiter for the Retry-After time, or an exponential backoff with
+    jitter when the header is missing, and the request is tried again.
+
+    :param method: HTTP method, e.g. "GET" or "POST"
+    :param url: The full API url
+    :param session: Optional requests.Session to send the request with
+    :param max_retries: How many times to retry after a 429 response
+    :param kwargs: Passed straight to requests (headers, data, etc.). timeout defaults to VT_REQUEST_TIMEOUT
+    :return: Returns the requests Response. Network errors (requests.RequestException) are raised to the caller
+    """
+    sender = session or requests
+    kwargs.setdefault("timeout", VT_REQUEST_TIMEOUT)
+    limiter = get_rate_limiter()
+
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        response = sender.request(method, url, **kwargs)
+
+        if response.status_code != 429 or attempt == max_retries:
+            return response
+
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            delay = int(retry_after)
+        else:
+            delay = min(60 * 2 ** attempt, 900) * random.uniform(0.5, 1.0)
+
+        print(f"VirusTotal quota exceeded. Retrying in {delay:.0f} seconds...", file=sys.stderr)
+        limiter.pause(delay)
+
+    return response
 
 
 def retry_func(prompt=" "):
@@ -0,0 +1,193 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+from dotenv import load_dotenv
+
+MAX_REVALIDATIONS = 4  # Stale entries refreshed in the background at once, each on its own thread
+
+
+class VerdictCache:
+    """
+    VerdictCache keeps the raw VirusTotal 'attributes' JSON for hashes and URLs we have already looked up, in a small
+    SQLite database on disk. Repeat lookups are answered locally instead of spending API quota.
+
+    Entries older than the TTL are stale. With stale-while-revalidate turned on, a stale entry is still returned
+    straight away while a fresh copy is fetched in the background. The cache is bounded to max_entries, and the
+    least recently used entries are evicted first.
+    """
+
+    def __init__(self, path="vt_cache.db", ttl=86400, max_entries=100000, stale_while_revalidate=False):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stale_while_revalidate = stale_while_revalidate
+        self._revalidating = set()  # Keys currently being refreshed in the background
+        self._touched = {}  # Access times not yet written to disk, so reads never wait on a commit
+        self._lock = threading.Lock()
+
+        # One shared connection - access is serialised with our own lock so background refreshes are safe.
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS verdicts ("
+            "key TEXT PRIMARY KEY, attributes TEXT NOT NULL, fetched_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_verdicts_last_access ON verdicts (last_access)")
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Builds the cache from settings in the .env file:
+        VT_CACHE_FILE, VT_CACHE_TTL (seconds), VT_CACHE_MAX_ENTRIES and VT_CACHE_STALE_WHILE_REVALIDATE (true/false)
+        """
+        load_dotenv()
+        return cls(
+            path=os.getenv("VT_CACHE_FILE", "vt_cache.db"),
+            ttl=int(os.getenv("VT_CACHE_TTL", "86400")),
+            max_entries=int(os.getenv("VT_CACHE_MAX_ENTRIES", "100000")),
+            stale_while_revalidate=os.getenv("VT_CACHE_STALE_WHILE_REVALIDATE", "false").lower() == "true",
+        )
+
+    @staticmethod
+    def hash_key(hash_value):
+        """Cache key for a file hash. Hex digests are case-insensitive."""
+        return f"file:{hash_value.strip().lower()}"
+
+    @staticmethod
+    def url_key(url):
+        """
+        Cache key for a URL, normalised so trivially different spellings share one entry.
+        Lower-cases the scheme and host, drops default ports and fragments, and uses '/' for an empty path.
+        Raises ValueError for a URL that cannot be parsed, e.g. a port over 65535 or an unclosed "[" in the host.
+        """
+        url = url.strip()
+        if "://" not in url:
+            url = "http://" + url
+
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or "").lower()
+        port = parts.port
+        if port and not ((scheme == "http" and port == 80) or (scheme == "https" and port == 443)):
+            host = f"{host}:{port}"
+
+        normalised = urlunsplit((scheme, host, parts.path or "/", parts.query, ""))
+        return f"url:{normalised}"
+
+    def get(self, key):
+        """
+        Looks up a key in the cache.
+
+        :param key: Cache key from hash_key() or url_key()
+        :return: Returns (attributes, is_stale), or (None, False) when the key is not cached
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT attributes, fetched_at FROM verdicts WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None, False
+            self._touched[key] = now
+
+        attributes, fetched_at = row
+        return json.loads(attributes), now - fetched_at > self.ttl
+
+    def put(self, key, attributes):
+        """
+        Stores the attributes for a key and evicts the least recently used entries if the cache is over its size.
+        """
+        now = time.time()
+        with self._lock:
+            self._flush_access_times()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO verdicts (key, attributes, fetched_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(attributes), now, now),
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM verdicts WHERE key IN (SELECT key FROM verdicts ORDER BY last_access LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            self._conn.commit()
+
+    def _flush_access_times(self):
+        """Writes the buffered access times used for LRU eviction. Must be called with the lock held."""
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE verdicts SET last_access = ? WHERE key = ?",
+                [(accessed, key) for key, accessed in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def close(self):
+        """Saves the buffered access times and closes the database."""
+        with self._lock:
+            self._flush_access_times()
+            self._conn.commit()
+            self._conn.close()
+
+    def get_or_fetch(self, key, fetch):
+        """
+        Returns the cached attributes for key, only calling fetch() (the VirusTotal API) when we have to.
+
+        :param key: Cache key from hash_key() or url_key()
+        :param fetch: Function taking no arguments that returns fresh attributes, or None on failure
+        :return: Returns the attributes, or None if they were not cached and could not be fetched
+        """
+        attributes, is_stale = self.get(key)
+
+        if attributes is not None and not is_stale:
+            return attributes
+
+        if attributes is not None and self.stale_while_revalidate:
+            self._revalidate_in_background(key, fetch)
+            return attributes
+
+        fresh = fetch()
+        if fresh is not None:
+            self.put(key, fresh)
+            return fresh
+
+        # Fall back to a stale copy rather than nothing if the API call failed.
+        return attributes
+
+    def _revalidate_in_background(self, key, fetch):
+        """
+        Refreshes a stale entry on a daemon thread, making sure only one refresh per key runs at a time. When
+        MAX_REVALIDATIONS refreshes are already running the stale entry is left alone - a later lookup refreshes it.
+        """
+        with self._lock:
+            if key in self._revalidating or len(self._revalidating) >= MAX_REVALIDATIONS:
+                return
+            self._revalidating.add(key)
+
+        def refresh():
+            try:
+                fresh = fetch()
+                if fresh is not None:
+                    self.put(key, fresh)
+            finally:
+                with self._lock:
+                    self._revalidating.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Returns the shared VerdictCache, creating it from the .env settings on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = VerdictCache.from_env()
+            atexit.register(_cache.close)
+    return _cache
@@ -0,0 +1,131 @@
+import os
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from utils import send_vt_request
+from vt_cache import MAX_REVALIDATIONS
+
+
+class VirusTotalClient:
+    """
+    VirusTotalClient is shared by hash_check and url_check for every call to the VirusTotal API.
+
+    It keeps one requests.Session, so connections (and their TLS handshakes) are reused across lookups, and sends
+    every request through the shared rate limiter in utils. lookup_hashes() keeps several lookups in flight at once,
+    so a premium key can actually use its quota on large IOC lists.
+    """
+    BASE_URL = "https://www.virustotal.com/api/v3"
+
+    def __init__(self, api_key, max_in_flight=4):
+        self.max_in_flight = max_in_flight
+
+        self.session = requests.Session()
+        # Keep a pooled connection for every thread sharing this session: one per in-flight lookup, one for the
+        # thread polling URL analyses (or the interactive menu), and one per background cache refresh.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight + 1 + MAX_REVALIDATIONS)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "accept": "application/json",
+            "x-apikey": api_key
+        })
+
+    @classmethod
+    def from_env(cls):
+        """Builds the client from VT_API_KEY and the optional VT_MAX_IN_FLIGHT in the .env file."""
+        load_dotenv()
+        return cls(os.getenv("VT_API_KEY"), max_in_flight=int(os.getenv("VT_MAX_IN_FLIGHT", "4")))
+
+    def _get_attributes(self, path):
+        """
+        GETs an API path and returns the 'attributes' of the object in the response.
+
+        :param path: API path after the base url, e.g. "/files/<hash>"
+        :return: Returns the attributes dict, or None if the API call failed
+        """
+        try:
+            response = send_vt_request("GET", self.BASE_URL + path, session=self.session)
+        except requests.RequestException as e:
+            print(f"Error: {e} from the API call.", file=sys.stderr)
+            return None
+
+        if response.status_code != 200:
+            print(f"Error: {response.status_code} from the API call.", file=sys.stderr)
+            return None
+
+        return response.json()['data']['attributes']
+
+    def get_file_attributes(self, hash_value):
+        """Gets the file report for an MD5, SHA-1 or SHA-256 hash."""
+        return self._get_attributes(f"/files/{hash_value}")
+
+    def submit_url(self, url_to_check):
+        """
+        Submits a URL for scanning.
+
+        :param url_to_check: The URL to scan
+        :return: Returns the analysis id, or None if the API call failed
+        """
+        try:
+            response = send_vt_request("POST", self.BASE_URL + "/urls", session=self.session,
+                                       data={"url": url_to_check})
+        except requests.RequestException as e:
+            print(f"Error: {e} from the API call.", file=sys.stderr)
+            return None
+
+        if response.status_code != 200:
+            print(f"Error: {response.status_code} from the API call.", file=sys.stderr)
+            return None
+
+        return response.json()['data']['id']
+
+    def get_analysis(self, analysis_id):
+        """Gets the analysis object for an analysis id returned by submit_url()."""
+        return self._get_attributes(f"/analyses/{analysis_id}")
+
+    def map_in_flight(self, func, items):
+        """
+        Calls func on each item with up to max_in_flight calls running at once. Only a bounded number of items are
+        read ahead, so items can be a generator over a very large list.
+
+        :param func: Function to call with each item (normally a method of this client)
+        :param items: Iterable of items
+        :return: Yields (item, result) tuples in the same order as items
+        """
+        pending = deque()
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            for item in items:
+                pending.append((item, executor.submit(func, item)))
+                if len(pending) >= self.max_in_flight * 2:
+                    item_done, future = pending.popleft()
+                    yield item_done, future.result()
+
+            while pending:
+                item_done, future = pending.popleft()
+                yield item_done, future.result()
+
+    def lookup_hashes(self, hashes):
+        """
+        Gets the file reports for many hashes concurrently.
+
+        :param hashes: Iterable of hash strings
+        :return: Yields (hash, attributes) tuples, attributes being None when the lookup failed
+        """
+        yield from self.map_in_flight(self.get_file_attributes, hashes)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Returns the shared VirusTotalClient, creating it from the .env settings on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = VirusTotalClient.from_env()
+    return _client
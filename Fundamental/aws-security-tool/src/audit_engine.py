@@ -0,0 +1,112 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import boto3
+from iam_security import IamSecurity
+from s3_compliance import S3Compliance
+from ec2_security import EC2Security
+from utils import make_finding
+from client_factory import make_client, throttle_counts, throttles_since
+
+
+class AuditEngine:
+    """
+    Runs every security check headlessly, fanning the work out across services and regions on a thread pool.
+
+    IAM and S3 are global and are audited once; EC2 is audited in every enabled region. boto3 sessions are not safe
+    to share between threads, so every task builds its own session (and from it its own clients) through
+    session_factory. With enough workers a full sweep takes about as long as the slowest single task.
+    """
+
+    def __init__(self, session_factory=None, regions=None, max_workers=8, critical_ports=None, as_of=None):
+        """
+        :param session_factory: Function taking an optional region name and returning a new boto3.Session
+        :param regions: Regions to audit EC2 in (defaults to every region enabled for the account)
+        :param max_workers: Maximum number of checks running at once
+        :param critical_ports: Critical port catalogue for the security group checks (see sg_analyzer)
+        :param as_of: Work out ages as of this time instead of now (used when replaying a snapshot)
+        """
+        self.session_factory = session_factory or (lambda region=None: boto3.Session(region_name=region))
+        self.regions = regions
+        self.max_workers = max_workers
+        self.critical_ports = critical_ports
+        self.as_of = as_of
+
+    def enabled_regions(self):
+        """Returns the names of all regions enabled for the account."""
+        ec2_client = make_client(self.session_factory(), 'ec2', 'us-east-1')
+        response = ec2_client.describe_regions()  # Only lists regions that are enabled
+        return sorted(region['RegionName'] for region in response['Regions'])
+
+    def tasks(self):
+        """Returns the (service, region) pairs to audit."""
+        regions = self.regions or self.enabled_regions()
+        return [("IAM", None), ("S3", None)] + [("EC2", region) for region in regions]
+
+    def run_task(self, service, region):
+        """Audits one service (in one region) with a fresh session, returning its findings."""
+        session = self.session_factory(region)
+
+        if service == "IAM":
+            return IamSecurity(session, as_of=self.as_of).audit()
+        if service == "S3":
+            return S3Compliance(session).audit()
+        return EC2Security(session, region_name=region, critical_ports=self.critical_ports).audit()
+
+    def run(self):
+        """
+        Runs every task on the worker pool. A task that fails is reported as a finding instead of stopping the sweep.
+
+        :return: Returns (findings, summary) - the merged findings, and timings / counts for the run
+        """
+        started = time.perf_counter()
+        throttles_before = throttle_counts()
+        tasks = [(service, region, None, self.run_task) for service, region in self.tasks()]
+        findings, task_times = run_tasks(tasks, self.max_workers)
+
+        summary = {
+            "tasks": len(tasks),
+            "findings": len(findings),
+            "seconds": round(time.perf_counter() - started, 2),
+            "task_seconds": task_times,
+            "throttles": throttles_since(throttles_before)
+        }
+        return findings, summary
+
+
+def run_tasks(tasks, max_workers):
+    """
+    Runs audit tasks on one bounded thread pool, so the number of API calls in flight is set by max_workers however
+    many services, regions or accounts there are.
+
+    :param tasks: List of (service, region, account, function), where function(service, region) returns findings
+    :param max_workers: Maximum number of tasks running at once
+    :return: Returns (findings, task_times) - every task's findings merged, and seconds per task (None if it failed)
+    """
+    findings = []
+    task_times = {}
+
+    def timed(service, region, function):
+        task_started = time.perf_counter()
+        result = function(service, region)
+        return result, time.perf_counter() - task_started
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(timed, service, region, function): (service, region, account)
+                   for service, region, account, function in tasks}
+
+        for future in as_completed(futures):
+            service, region, account = futures[future]
+            label = "/".join(part for part in (account, service, region) if part)
+            try:
+                task_findings, seconds = future.result()
+                task_times[label] = round(seconds, 2)
+            except Exception as e:
+                task_findings = [make_finding(service, "audit_failed", label, f"The audit failed: {e}", region=region)]
+                task_times[label] = None
+
+            if account:
+                for finding in task_findings:
+                    finding['account'] = account
+            findings.extend(task_findings)
+
+    return findings, task_times
@@ -0,0 +1,469 @@
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+import boto3
+from botocore import xform_name
+from audit_engine import AuditEngine
+from iam_security import IamSecurity
+from s3_compliance import S3Compliance
+from ec2_security import EC2Security
+from client_factory import parse_rate_limit, set_rate_limits
+import snapshots
+
+# Account sizes for --scale. Any size can also be set on its own, e.g. --users 20000
+SCALES = {
+    'small': {'users': 1000, 'buckets': 1000, 'security_groups': 2000, 'instances': 1000},
+    'large': {'users': 50000, 'buckets': 10000, 'security_groups': 20000, 'instances': 10000},
+}
+MIN_SLOWDOWN = 0.05  # Seconds; smaller differences from the baseline are timing noise, not regressions
+
+REPORT_COLUMNS = ['user', 'arn', 'user_creation_time', 'password_enabled', 'password_last_used',
+                  'password_last_changed', 'password_next_rotation', 'mfa_active',
+                  'access_key_1_active', 'access_key_1_last_rotated', 'access_key_1_last_used_date',
+                  'access_key_1_last_used_region', 'access_key_1_last_used_service',
+                  'access_key_2_active', 'access_key_2_last_rotated', 'access_key_2_last_used_date',
+                  'access_key_2_last_used_region', 'access_key_2_last_used_service',
+                  'cert_1_active', 'cert_1_last_rotated', 'cert_2_active', 'cert_2_last_rotated']
+ADMIN_POLICY = {'PolicyName': 'AdministratorAccess', 'PolicyArn': 'arn:aws:iam::aws:policy/AdministratorAccess'}
+# IAM sends policy documents URL encoded, and botocore decodes them
+FULL_ACCESS = quote(json.dumps({'Version': '2012-10-17',
+                                'Statement': [{'Effect': 'Allow', 'Action': '*', 'Resource': '*'}]}))
+PUBLIC_READ = {'Grantee': {'Type': 'Group', 'URI': 'http://acs.amazonaws.com/groups/global/AllUsers'},
+               'Permission': 'READ'}
+RULE_PORTS = [(22, 22), (80, 80), (443, 443), (3389, 3389), (5432, 5432), (8080, 8090), (0, 65535), (1024, 2048)]
+RULE_CIDRS = ['10.0.0.0/8', '192.168.1.0/24', '0.0.0.0/0', '203.0.113.0/24', '52.0.0.0/8', '3.120.0.0/14']
+
+
+class ApiError(Exception):
+    """An error response from the synthetic account, e.g. a bucket without encryption."""
+
+    def __init__(self, code, status_code=404):
+        super().__init__(code)
+        self.code = code
+        self.status_code = status_code
+
+
+def page(items, params, token_key, limit_key, default_size):
+    """Returns (one page of items, token for the next page or None) for a paginated call."""
+    start = int(params.get(token_key) or 0)
+    end = start + (params.get(limit_key) or default_size)
+    return items[start:end], (str(end) if end < len(items) else None)
+
+
+class SentResponse:
+    """
+    Stands in for the HTTP response to a request the synthetic account answered. The body is just enough for
+    botocore's parser, and the real response is filled in before it is parsed.
+    """
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.headers = {}
+        self.content = content
+        self.raw = None
+
+
+def empty_body(model):
+    """Returns the smallest body botocore can parse for an operation, e.g. <Response><ListUsersResult/></Response>."""
+    protocol = model.service_model.resolved_protocol
+    if protocol not in ('query', 'ec2', 'rest-xml'):
+        return b'{}'
+    wrapper = (model.output_shape.serialization.get('resultWrapper') if model.output_shape else None)
+    return f"<Response><{wrapper}/></Response>".encode() if wrapper else b'<Response/>'
+
+
+class SyntheticAccount:
+    """
+    A local stand-in for an AWS account, for benchmarking the checks at sizes no test account has. Users, groups,
+    roles, the credentials report, buckets, security groups and instances are generated up front (with a mix of
+    problems for the checks to find), and the IAM, S3 and EC2 calls the checks make are answered from that data in
+    process. Requests still go through botocore up to the point of sending - serialising, signing, retries and the
+    client factory's rate limiter - so only the network is left out. Every call is counted, so a benchmark shows how
+    many API calls a check makes as well as how long it takes.
+    """
+
+    def __init__(self, users=1000, buckets=1000, security_groups=2000, instances=1000, regions=None, seed=0):
+        """
+        :param users: Number of IAM users (a tenth as many roles are generated)
+        :param buckets: Number of S3 buckets, spread over the regions
+        :param security_groups: Number of security groups in total, spread over the regions
+        :param instances: Number of EC2 instances in total, spread over the regions
+        :param regions: Regions the account uses
+        :param seed: Seed for the generated data, so runs can be compared
+        """
+        self.regions = regions or ['us-east-1']
+        self.now = datetime.now(timezone.utc)
+        self.calls = Counter()
+        self.calls_lock = threading.Lock()
+        self.pending = threading.local()  # The answer to the call being made on each thread
+
+        rng = random.Random(seed)
+        self.make_iam(rng, users)
+        self.make_buckets(rng, buckets)
+        self.make_ec2(rng, security_groups, instances)
+
+    def days_ago(self, rng, most):
+        return (self.now - timedelta(days=rng.randint(0, most))).strftime('%Y-%m-%dT%H:%M:%S+00:00')
+
+    def make_iam(self, rng, count):
+        """Generates the users, groups, roles and policies, and the matching credentials report."""
+        self.groups = [
+            {'GroupName': 'Admins', 'AttachedManagedPolicies': [ADMIN_POLICY], 'GroupPolicyList': []},
+            {'GroupName': 'Ops', 'AttachedManagedPolicies': [
+                {'PolicyName': 'OpsFullAccess', 'PolicyArn': 'arn:aws:iam::123456789012:policy/OpsFullAccess'}],
+             'GroupPolicyList': []},
+            {'GroupName': 'Developers', 'AttachedManagedPolicies': [], 'GroupPolicyList': []},
+            {'GroupName': 'ReadOnly', 'AttachedManagedPolicies': [], 'GroupPolicyList': []},
+        ]
+        self.policies = [{
+            'PolicyName': 'OpsFullAccess', 'Arn': 'arn:aws:iam::123456789012:policy/OpsFullAccess',
+            'DefaultVersionId': 'v1',
+            'PolicyVersionList': [{'VersionId': 'v1', 'IsDefaultVersion': True, 'Document': FULL_ACCESS}],
+        }]
+
+        self.users = []
+        rows = [",".join(REPORT_COLUMNS),
+                "<root_account>,arn:aws:iam::123456789012:root," + self.days_ago(rng, 2000) + ",not_supported,"
+                + self.days_ago(rng, 120) + ",not_supported,not_supported,true,false,N/A,N/A,N/A,N/A,"
+                + "false,N/A,N/A,N/A,N/A,false,N/A,false,N/A"]
+
+        for number in range(count):
+            name = f"user-{number:05d}"
+            user = {'UserName': name, 'Arn': f"arn:aws:iam::123456789012:user/{name}",
+                    'GroupList': [rng.choice(['Developers', 'Developers', 'ReadOnly'])],
+                    'AttachedManagedPolicies': [], 'UserPolicyList': []}
+            if number % 50 == 0:
+                user['GroupList'].append(rng.choice(['Admins', 'Ops']))
+            if number % 200 == 0:
+                user['AttachedManagedPolicies'].append(ADMIN_POLICY)
+            if number % 500 == 0:
+                user['UserPolicyList'].append({'PolicyName': 'Everything', 'PolicyDocument': FULL_ACCESS})
+            self.users.append(user)
+
+            keys = []
+            for _ in (1, 2):
+                if rng.random() < 0.6:
+                    keys.append(f"true,{self.days_ago(rng, 300)},{self.days_ago(rng, 150)},us-east-1,s3")
+                else:
+                    keys.append("false,N/A,N/A,N/A,N/A")
+            rows.append(",".join([
+                name, user['Arn'], self.days_ago(rng, 1000), 'true', self.days_ago(rng, 150),
+                self.days_ago(rng, 200), 'N/A', rng.choice(['true', 'true', 'false']), keys[0], keys[1],
+                'false', 'N/A', 'false', 'N/A',
+            ]))
+
+        self.roles = [{'RoleName': f"role-{number:05d}",
+                       'AttachedManagedPolicies': [ADMIN_POLICY] if number % 25 == 0 else [],
+                       'RolePolicyList': []} for number in range(count // 10)]
+        self.report = ("\n".join(rows) + "\n").encode('utf-8')
+
+    def make_buckets(self, rng, count):
+        """Generates the buckets, with a mix of public, unencrypted, unversioned and unlogged ones."""
+        self.buckets = {}
+        for number in range(count):
+            name = f"bucket-{number:05d}"
+            self.buckets[name] = {
+                'region': rng.choice(self.regions),
+                'public_acl': rng.random() < 0.02,
+                'public_policy': rng.random() < 0.01,
+                'access_block': rng.random() < 0.5,
+                'encrypted': rng.random() < 0.9,
+                'versioned': rng.random() < 0.5,
+                'logged': rng.random() < 0.3,
+            }
+
+    def make_ec2(self, rng, security_groups, instances):
+        """Generates the security groups (1-5 rules each) and instances of every region."""
+        self.security_groups = {region: [] for region in self.regions}
+        self.reservations = {region: [] for region in self.regions}
+
+        for number in range(security_groups):
+            rules = []
+            for _ in range(rng.randint(1, 5)):
+                low, high = rng.choice(RULE_PORTS)
+                rules.append({'IpProtocol': rng.choice(['tcp', 'tcp', 'udp', '-1']), 'FromPort': low, 'ToPort': high,
+                              'IpRanges': [{'CidrIp': rng.choice(RULE_CIDRS)}],
+                              'Ipv6Ranges': [{'CidrIpv6': '::/0'}] if rng.random() < 0.05 else []})
+            self.security_groups[rng.choice(self.regions)].append(
+                {'GroupId': f"sg-{number:017x}", 'GroupName': f"group-{number}", 'IpPermissions': rules})
+
+        for number in range(instances):
+            instance = {'InstanceId': f"i-{number:017x}", 'State': {'Name': 'running'}}
+            if rng.random() < 0.3:
+                instance['PublicIpAddress'] = f"54.{number // 65536 % 256}.{number // 256 % 256}.{number % 256}"
+            if rng.random() < 0.9:
+                instance['KeyName'] = 'default'
+            self.reservations[rng.choice(self.regions)].append({'Instances': [instance]})
+
+    def session(self, region=None):
+        """Returns a new boto3 session whose calls are all answered by this account."""
+        session = boto3.Session(region_name=region or self.regions[0], aws_access_key_id='benchmark',
+                                aws_secret_access_key='benchmark')
+        session.events.register_first('before-parameter-build', self.remember_params)
+        session.events.register('before-call', self.answer)
+        session.events.register('before-send', self.send)
+        session.events.register('before-parse', self.fill_response)
+        return session
+
+    def remember_params(self, params, context, **kwargs):
+        """Keeps the parameters of a call as the caller gave them, before botocore serialises them."""
+        context['benchmark_params'] = dict(params)
+
+    def answer(self, model, context, **kwargs):
+        """Counts a call and works out its response (or error response), which is sent back once botocore sends it."""
+        with self.calls_lock:
+            self.calls[f"{model.service_model.service_name}.{model.name}"] += 1
+
+        operation = getattr(self, xform_name(model.name), None)
+        try:
+            if operation is None:
+                raise ApiError('NotInBenchmark', 400)
+            parsed = operation(context['benchmark_params'], context.get('client_region'))
+            # Like a real response, every call gets its own copy (botocore changes some responses in place)
+            self.pending.response = 200, copy.deepcopy(parsed)
+        except ApiError as e:
+            self.pending.response = e.status_code, {'Error': {'Code': e.code, 'Message': str(e)}}
+        self.pending.body = empty_body(model)
+
+    def send(self, **kwargs):
+        """Returns the HTTP response instead of sending the request (after the rate limiter has let it go)."""
+        return SentResponse(self.pending.response[0], self.pending.body)
+
+    def fill_response(self, customized_response_dict, **kwargs):
+        """Puts the answer into the response botocore is parsing."""
+        customized_response_dict.update(self.pending.response[1])
+
+    # IAM
+
+    def generate_credential_report(self, params, region):
+        return {'State': 'COMPLETE'}
+
+    def get_credential_report(self, params, region):
+        return {'Content': self.report, 'ReportFormat': 'text/csv', 'GeneratedTime': self.now}
+
+    def get_account_authorization_details(self, params, region):
+        users, marker = page(self.users, params, 'Marker', 'MaxItems', 100)
+        first = not params.get('Marker')  # Groups, roles and policies all come with the first page
+        response = {'UserDetailList': users, 'GroupDetailList': self.groups if first else [],
+                    'RoleDetailList': self.roles if first else [], 'Policies': self.policies if first else [],
+                    'IsTruncated': marker is not None}
+        if marker:
+            response['Marker'] = marker
+        return response
+
+    # S3
+
+    def bucket(self, params):
+        if params['Bucket'] not in self.buckets:
+            raise ApiError('NoSuchBucket')
+        return self.buckets[params['Bucket']]
+
+    def list_buckets(self, params, region):
+        names, token = page(sorted(self.buckets), params, 'ContinuationToken', 'MaxBuckets', 10000)
+        response = {'Buckets': [{'Name': name, 'BucketRegion': self.buckets[name]['region']} for name in names]}
+        if token:
+            response['ContinuationToken'] = token
+        return response
+
+    def get_bucket_location(self, params, region):
+        location = self.bucket(params)['region']
+        return {'LocationConstraint': None if location == 'us-east-1' else location}
+
+    def get_bucket_acl(self, params, region):
+        return {'Grants': [PUBLIC_READ] if self.bucket(params)['public_acl'] else []}
+
+    def get_bucket_policy_status(self, params, region):
+        if not self.bucket(params)['public_policy']:
+            raise ApiError('NoSuchBucketPolicy')
+        return {'PolicyStatus': {'IsPublic': True}}
+
+    def get_public_access_block(self, params, region):
+        if not self.bucket(params)['access_block']:
+            raise ApiError('NoSuchPublicAccessBlockConfiguration')
+        return {'PublicAccessBlockConfiguration': {'BlockPublicAcls': True, 'IgnorePublicAcls': True,
+                                                   'BlockPublicPolicy': True, 'RestrictPublicBuckets': True}}
+
+    def get_bucket_encryption(self, params, region):
+        if not self.bucket(params)['encrypted']:
+            raise ApiError('ServerSideEncryptionConfigurationNotFoundError')
+        return {'ServerSideEncryptionConfiguration': {
+            'Rules': [{'ApplyServerSideEncryptionByDefault': {'SSEAlgorithm': 'AES256'}}]}}
+
+    def get_bucket_versioning(self, params, region):
+        return {'Status': 'Enabled'} if self.bucket(params)['versioned'] else {}
+
+    def get_bucket_logging(self, params, region):
+        if not self.bucket(params)['logged']:
+            return {}
+        return {'LoggingEnabled': {'TargetBucket': 'logs', 'TargetPrefix': params['Bucket'] + '/'}}
+
+    # EC2
+
+    def describe_regions(self, params, region):
+        return {'Regions': [{'RegionName': name} for name in self.regions]}
+
+    def describe_security_groups(self, params, region):
+        groups, token = page(self.security_groups.get(region, []), params, 'NextToken', 'MaxResults', 1000)
+        return dict({'SecurityGroups': groups}, **({'NextToken': token} if token else {}))
+
+    def describe_instances(self, params, region):
+        reservations = self.reservations.get(region, [])
+        if any(item['Name'] == 'ip-address' for item in params.get('Filters', [])):
+            reservations = [item for item in reservations if item['Instances'][0].get('PublicIpAddress')]
+        reservations, token = page(reservations, params, 'NextToken', 'MaxResults', 1000)
+        return dict({'Reservations': reservations}, **({'NextToken': token} if token else {}))
+
+
+def benchmarks(account):
+    """
+    Returns {name: function} for every check to time. Each function makes all the calls its check needs and returns
+    its findings. The clients are created here, so client setup is not timed.
+    """
+    region = account.regions[0]
+    iam = IamSecurity(account.session())
+    s3 = S3Compliance(account.session())
+    ec2 = EC2Security(account.session(region), region_name=region)
+    engine = AuditEngine(session_factory=account.session, regions=account.regions)
+
+    return {
+        'IAM/users_without_mfa': lambda: iam.find_users_without_mfa(iam.fetch_credentials_report()),
+        'IAM/check_access_keys': lambda: iam.find_old_access_keys(iam.fetch_credentials_report()),
+        'IAM/users_in_admin_groups': lambda: iam.find_admin_users(iam.fetch_snapshot()),
+        'IAM/audit': iam.audit,
+        'S3/is_bucket_public': lambda: s3.find_public_buckets(s3.collector.collect()),
+        'S3/audit': s3.audit,
+        'EC2/check_security_groups': ec2.find_open_security_groups,
+        'EC2/check_for_public_instance': ec2.find_public_instances,
+        'EC2/check_key_pair': ec2.find_instances_without_key_pair,
+        'audit_all': lambda: engine.run()[0],
+    }
+
+
+def run_benchmarks(account, repeat=1, only=None):
+    """
+    Times every check against the account.
+
+    :param account: The SyntheticAccount
+    :param repeat: Runs of each check; the fastest is kept
+    :param only: Names (or name prefixes, e.g. "S3/") of the checks to run, defaults to all of them
+    :return: Returns {name: {'seconds', 'api_calls', 'calls', 'findings'}}
+    """
+    results = {}
+    for name, function in benchmarks(account).items():
+        if only and not any(name.startswith(prefix) for prefix in only):
+            continue
+
+        best = None
+        for _ in range(repeat):
+            account.calls.clear()
+            started = time.perf_counter()
+            findings = function()
+            seconds = time.perf_counter() - started
+            best = seconds if best is None else min(best, seconds)
+
+        results[name] = {'seconds': round(best, 3), 'api_calls': sum(account.calls.values()),
+                         'calls': dict(account.calls), 'findings': len(findings)}
+        print(f"{name:32} {best:8.3f}s {results[name]['api_calls']:8} calls {len(findings):8} findings")
+    return results
+
+
+def check_snapshots(account):
+    """
+    Records a full audit of the account to a snapshot, replays it offline, and returns the findings that differ
+    between the live and the replayed audit (none when replaying works).
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "account.snapshot.json.gz")
+        live, _ = snapshots.record(path, account.regions, session_factory=account.session)
+        replayed, _ = snapshots.evaluate(path)
+
+    live = Counter(snapshots.finding_id(finding) for finding in live)
+    replayed = Counter(snapshots.finding_id(finding) for finding in replayed)
+    return list((live - replayed).elements()) + list((replayed - live).elements())
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns a message for every check that got slower than the baseline by more than the threshold (e.g. 1.25 for
+    25%), or that makes more API calls than it did.
+    """
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        if result['seconds'] > old['seconds'] * threshold and result['seconds'] - old['seconds'] > MIN_SLOWDOWN:
+            regressions.append(f"{name} took {result['seconds']}s, was {old['seconds']}s")
+        if result['api_calls'] > old['api_calls']:
+            regressions.append(f"{name} made {result['api_calls']} API calls, was {old['api_calls']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the security checks against a synthetic AWS account")
+    parser.add_argument("--scale", choices=SCALES, default="small", help="Account size preset (default: small)")
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--buckets", type=int)
+    parser.add_argument("--security-groups", type=int)
+    parser.add_argument("--instances", type=int)
+    parser.add_argument("--regions", nargs="+", default=["us-east-1", "eu-west-1"])
+    parser.add_argument("--repeat", type=int, default=1, help="Runs of each check, the fastest is kept")
+    parser.add_argument("--only", nargs="+", help="Only run these checks, e.g. IAM/ or S3/audit")
+    parser.add_argument("--check-snapshots", action="store_true",
+                        help="Also check that recording the account to a snapshot and replaying it gives the same findings")
+    parser.add_argument("--save", help="Save the results as a baseline JSON file")
+    parser.add_argument("--baseline", help="Fail if the checks are slower, or make more calls, than this baseline")
+    parser.add_argument("--rate-limit", action="append", default=[], metavar="SERVICE=N", type=parse_rate_limit,
+                        help="Change a service's rate limit, as in main.py, e.g. s3=0 to turn it off")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="How much slower than the baseline counts as a regression (default: 1.25, i.e. 25%%)")
+    args = parser.parse_args()
+
+    sizes = dict(SCALES[args.scale])
+    for key in sizes:
+        if getattr(args, key) is not None:
+            sizes[key] = getattr(args, key)
+
+    set_rate_limits(dict(args.rate_limit))
+    print(f"Generating the account: {sizes} in {args.regions}..")
+    account = SyntheticAccount(regions=args.regions, **sizes)
+    results = run_benchmarks(account, args.repeat, args.only)
+
+    if args.check_snapshots:
+        differences = check_snapshots(account)
+        for difference in differences[:20]:
+            print(f"SNAPSHOT MISMATCH: {difference}")
+        if differences:
+            sys.exit(1)
+        print("Replaying a snapshot gives the same findings as the live audit.")
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump({'sizes': sizes, 'regions': args.regions, 'results': results}, file, indent=2)
+        print(f"Saved the results to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline['sizes'] != sizes or baseline['regions'] != args.regions:
+            parser.error(f"The baseline is for a different account ({baseline['sizes']} in {baseline['regions']})")
+
+        regressions = compare(results, baseline['results'], args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
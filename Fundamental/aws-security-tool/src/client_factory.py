@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+from collections import Counter
+from botocore.config import Config
+
+# Every client retries throttled and failed calls in "adaptive" mode: with exponential backoff, and slowing its own
+# request rate down when AWS starts throttling. The pool holds enough connections for the parallel S3 collector.
+CLIENT_CONFIG = Config(retries={'mode': 'adaptive', 'max_attempts': 10}, max_pool_connections=32)
+
+# Requests per second allowed per account, service and region, shared by every client in the process, so that many
+# parallel checks together stay under the AWS API limits instead of all being throttled at once. These are cautious
+# defaults - change them with --rate-limit SERVICE=N or the AUDIT_RATE_LIMITS environment variable
+# (e.g. "s3=500,ec2=40"). A limit of 0 turns the limiter off, leaving only the adaptive retries.
+RATE_LIMITS = {'iam': 15, 'sts': 50, 'ec2': 20, 's3': 100}
+DEFAULT_RATE_LIMIT = 20
+
+# Error codes AWS uses for "too many requests"
+THROTTLE_CODES = {
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException', 'TooManyRequestsException',
+    'RequestLimitExceeded', 'LimitExceededException', 'RequestThrottled', 'SlowDown', 'EC2ThrottledException',
+}
+
+limiters = {}
+limiters_lock = threading.Lock()
+throttles = Counter()  # Throttled calls, by "service/region"
+throttles_lock = threading.Lock()
+
+
+class RateLimiter:
+    """
+    Spaces requests out to at most `rate` per second, shared between threads. Up to `burst` requests can go straight
+    away after a quiet spell, as AWS's own token buckets allow.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.interval = 1.0 / rate
+        self.burst = burst or rate
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, **kwargs):
+        """Waits until the next request may be sent (used as a botocore before-send handler)."""
+        with self.lock:
+            now = time.monotonic()
+            self.next_time = max(self.next_time, now - self.burst * self.interval) + self.interval
+            wait = self.next_time - now
+        if wait > 0:
+            time.sleep(wait)
+
+
+def parse_rate_limit(text):
+    """
+    Parses a rate limit given as "service=N", e.g. "s3=500".
+
+    :param text: The rate limit
+    :return: Returns (service, requests per second). Raises ValueError if the text is not a valid limit
+    """
+    service, _, rate = text.partition('=')
+    try:
+        rate = float(rate)
+    except ValueError:
+        rate = -1
+    if not service.strip() or rate < 0:
+        raise ValueError(f"Invalid rate limit (expected service=N, e.g. s3=500): {text}")
+    return service.strip().lower(), rate
+
+
+def set_rate_limits(limits):
+    """
+    Changes the rate limits of some services, for the clients created from now on.
+
+    :param limits: {service: requests per second}, e.g. {'s3': 500}. 0 turns a service's limiter off
+    """
+    with limiters_lock:
+        RATE_LIMITS.update(limits)
+        limiters.clear()
+
+
+def limiter_for(access_key, service, region):
+    """
+    Returns the shared rate limiter for a service in a region, for one set of credentials (i.e. one account), or
+    None if the service's limit is turned off.
+    """
+    rate = RATE_LIMITS.get(service, DEFAULT_RATE_LIMIT)
+    if not rate:
+        return None
+
+    key = (access_key, service, region)
+    with limiters_lock:
+        if key not in limiters:
+            limiters[key] = RateLimiter(rate)
+        return limiters[key]
+
+
+def count_throttle(label):
+    """Returns a botocore needs-retry handler counting the throttled responses of a client."""
+
+    def handler(response=None, **kwargs):
+        if response and response[1].get('Error', {}).get('Code') in THROTTLE_CODES:
+            with throttles_lock:
+                throttles[label] += 1
+
+    return handler
+
+
+def make_client(session, service, region_name=None):
+    """
+    Creates a boto3 client with adaptive retries, a bigger connection pool, the shared rate limit of its service, and
+    throttle counting. Every AWS client in the tool is created here.
+
+    :param session: The boto3 session to create the client from
+    :param service: The AWS service, e.g. "iam"
+    :param region_name: The region (defaults to the session's region)
+    :return: Returns the client
+    """
+    client = session.client(service, region_name=region_name, config=CLIENT_CONFIG)
+    credentials = session.get_credentials()
+    access_key = credentials.access_key if credentials else None
+    region = client.meta.region_name
+
+    limiter = limiter_for(access_key, service, region)
+    if limiter:
+        client.meta.events.register('before-send', limiter.acquire)
+    client.meta.events.register_first('needs-retry', count_throttle(f"{service}/{region}"))
+    return client
+
+
+set_rate_limits(dict(parse_rate_limit(limit) for limit in os.getenv('AUDIT_RATE_LIMITS', '').split(',')
+                     if limit.strip()))
+
+
+def throttle_counts():
+    """Returns the number of throttled calls so far, by "service/region"."""
+    with throttles_lock:
+        return dict(throttles)
+
+
+def throttles_since(before):
+    """Returns the calls throttled since an earlier throttle_counts(), e.g. during one audit run."""
+    return {label: count - before.get(label, 0) for label, count in throttle_counts().items()
+            if count > before.get(label, 0)}
@@ -0,0 +1,128 @@
+import io
+import pandas as pd
+from datetime import datetime, timedelta, timezone
+from utils import make_finding
+
+ROOT_USER = '<root_account>'
+
+# Columns holding true/false, and columns holding timestamps (or "N/A", "no_information", "not_supported")
+BOOL_COLUMNS = ['password_enabled', 'mfa_active', 'access_key_1_active', 'access_key_2_active',
+                'cert_1_active', 'cert_2_active']
+DATE_COLUMNS = ['user_creation_time', 'password_last_used', 'password_last_changed', 'password_next_rotation',
+                'access_key_1_last_rotated', 'access_key_1_last_used_date',
+                'access_key_2_last_rotated', 'access_key_2_last_used_date',
+                'cert_1_last_rotated', 'cert_2_last_rotated']
+
+
+def prepare_report(user_data):
+    """
+    Converts the credentials report to proper types once, so every check can work on whole columns at a time: the
+    true/false columns become bools, and the date columns become UTC timestamps (NaT where there is no date).
+    """
+    user_data = user_data.copy()
+    for column in BOOL_COLUMNS:
+        if column in user_data:
+            user_data[column] = user_data[column].astype(str).str.lower() == 'true'
+    for column in DATE_COLUMNS:
+        if column in user_data:
+            user_data[column] = pd.to_datetime(user_data[column], format='ISO8601', errors='coerce', utc=True)
+    return user_data
+
+
+def load_report(content):
+    """Returns the credentials report content (CSV text, as AWS sends it) as a typed DataFrame."""
+    # Read as text and converted by prepare_report - guessing the types chunk by chunk gives mixed columns on big reports
+    return prepare_report(pd.read_csv(io.StringIO(content), dtype=str))
+
+
+def report_masks(user_data, days=60, now=None):
+    """
+    Works out every credentials report check for all users at once. Each check is a True/False column, True where
+    the user has the problem.
+
+    :param user_data: The typed credentials report (see prepare_report)
+    :param days: How old a password or access key can be, and how long a user can go unused
+    :param now: The time to compare against (defaults to now)
+    :return: Returns a DataFrame with a bool column per check, in the same row order as user_data
+    """
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=days)
+    root = user_data['user'] == ROOT_USER
+    masks = pd.DataFrame(index=user_data.index)
+
+    masks['no_mfa'] = ~user_data['mfa_active']
+    masks['old_password'] = user_data['password_last_changed'] < cutoff  # NaT compares as False
+
+    for number in (1, 2):
+        active = user_data[f'access_key_{number}_active']
+        masks[f'old_access_key_{number}'] = active & (user_data[f'access_key_{number}_last_rotated'] < cutoff)
+        masks[f'unused_access_key_{number}'] = active & (user_data[f'access_key_{number}_last_used_date'] < cutoff)
+        masks[f'root_access_key_{number}'] = root & active
+
+    # Last sign in or access key use, whichever was latest
+    last_activity = user_data[['password_last_used', 'access_key_1_last_used_date',
+                               'access_key_2_last_used_date']].max(axis=1)
+    masks['root_used'] = root & (last_activity >= cutoff)
+    masks['unused_user'] = ~root & (user_data['user_creation_time'] < cutoff) & \
+        (last_activity.isna() | (last_activity < cutoff))
+    return masks
+
+
+def report_findings(user_data, checks=None, days=60, now=None):
+    """
+    Returns a finding for every problem found in the credentials report.
+
+    :param user_data: The typed credentials report (see prepare_report)
+    :param checks: The checks to report, e.g. ["no_mfa"] (defaults to all of them)
+    :param days: See report_masks
+    :param now: See report_masks
+    :return: Returns a list of findings
+    """
+    masks = report_masks(user_data, days, now)
+    checks = checks or ['no_mfa', 'old_password', 'old_access_key', 'unused_access_key', 'root_access_key',
+                        'root_used', 'unused_user']
+    findings = []
+
+    def flagged(mask, column='arn'):
+        """Returns (user, value of column) for only the users flagged by a check."""
+        rows = user_data.loc[masks[mask], ['user', column]]
+        return zip(rows['user'], rows[column])
+
+    if 'no_mfa' in checks:
+        for user, arn in flagged('no_mfa'):
+            findings.append(make_finding("IAM", "no_mfa", user, "Does not have MFA enabled.", arn=arn))
+
+    if 'old_password' in checks:
+        for user, changed in flagged('old_password', 'password_last_changed'):
+            findings.append(make_finding("IAM", "old_password", user,
+                                         f"Password has not been changed since {changed:%Y-%m-%d}.",
+                                         password_last_changed=str(changed)))
+
+    for number in (1, 2):
+        if 'old_access_key' in checks:
+            for user, rotated in flagged(f'old_access_key_{number}', f'access_key_{number}_last_rotated'):
+                findings.append(make_finding("IAM", "old_access_key", user,
+                                             f"Access key {number} has not been changed since {rotated:%Y-%m-%d}.",
+                                             AccessKey=number))
+        if 'unused_access_key' in checks:
+            for user, used in flagged(f'unused_access_key_{number}', f'access_key_{number}_last_used_date'):
+                findings.append(make_finding("IAM", "unused_access_key", user,
+                                             f"Access key {number} has not been used since {used:%Y-%m-%d}.",
+                                             AccessKey=number))
+        if 'root_access_key' in checks:
+            for user, arn in flagged(f'root_access_key_{number}'):
+                findings.append(make_finding("IAM", "root_access_key", user,
+                                             f"The root account has an active access key ({number}). Delete it and "
+                                             f"use IAM users or roles instead.", AccessKey=number))
+
+    if 'root_used' in checks:
+        for user, arn in flagged('root_used'):
+            findings.append(make_finding("IAM", "root_used", user,
+                                         f"The root account was used in the last {days} days. Use IAM users or "
+                                         f"roles for everyday tasks."))
+
+    if 'unused_user' in checks:
+        for user, arn in flagged('unused_user'):
+            findings.append(make_finding("IAM", "unused_user", user,
+                                         f"Has not signed in or used an access key in over {days} days. Consider "
+                                         f"removing this user.", arn=arn))
+    return findings
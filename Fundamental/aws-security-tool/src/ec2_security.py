@@ -1,22 +1,37 @@
 import boto3
 import pandas as pd
-import time
 import os
 from datetime import datetime, timedelta, timezone
+from utils import make_finding, paginate, paginate_instances, PAGE_SIZE
+from reporting import Report
+from sg_analyzer import SecurityGroupAnalyzer
+from client_factory import make_client
+
+# Server side filter, so AWS only sends back the instances the check is interested in.
+PUBLIC_IP_FILTER = [{'Name': 'ip-address', 'Values': ['*']}]
+
 
 class EC2Security:
     """Handles EC2 security checks."""
-    def __init__(self):
-        self.ec2_client = boto3.client('ec2')
+    def __init__(self, session=None, region_name=None, report=None, critical_ports=None):
+        # A session per instance, so audit workers running in parallel never share one.
+        session = session or boto3.Session()
+        self.report = report or Report()  # How findings are shown in the menu
+        self.region = region_name or session.region_name
+        self.ec2_client = make_client(session, 'ec2', region_name)
+        self.analyzer = SecurityGroupAnalyzer(critical_ports)  # Matches rules against the critical port catalogue
+
+    def describe_security_groups(self, filters=None):
+        """Yields every security group in the region matching the (server side) filters, page by page"""
+        return paginate(self.ec2_client, 'describe_security_groups', 'SecurityGroups', Filters=filters or [],
+                        PaginationConfig={'PageSize': PAGE_SIZE})
 
     def list_security_groups(self):
         """Lists all our security groups with key information"""
 
-        my_security_groups = self.ec2_client.describe_security_groups()
         print("Finding security groups in your AWS account..")
-        time.sleep(2)
         # Access Key SecurityGroups with data
-        for sg in my_security_groups['SecurityGroups']:
+        for sg in self.describe_security_groups():
             print(f"\nSecurity Group: {sg['GroupId']}. Group Name: {sg['GroupName']}")
             # Access nested keys within SecurityGroups -> IpPermissions -> Keys
             for rule in sg['IpPermissions']:
@@ -25,122 +40,82 @@ class EC2Security:
                 print(f"To Port: {rule.get('ToPort')}")
                 print("CIDR Ranges:")
 
-                for ip_range in rule.get('IpRanges'):
+                for ip_range in rule.get('IpRanges', []):
                     print(f" - {ip_range['CidrIp']}")
-                    time.sleep(2)
 
         print("Returning to EC2 Menu..")
-        time.sleep(3)
 
     def check_security_groups(self):
         """Checks for vulnerabilities in the identified Security Groups"""
-        my_security_groups = self.ec2_client.describe_security_groups()
-        flagged_rules = []  # To store security groups with security concerns.
-        critical_ports = {22: 'ssh/sftp', 3389: 'RDP', 80: 'http'}  # Identify the critical ports for investigating.
         print("Looking for vulnerabilities..")
-        time.sleep(2)
-
-        for sg in my_security_groups['SecurityGroups']:
-            for rule in sg['IpPermissions']:
-                from_port = rule.get('FromPort')
-                to_port = rule.get('ToPort')
-                protocol = rule.get('IpProtocol')
-
-                if from_port is None or to_port is None:
-                    continue  # Skip rules without port information.
-
-                # Check if the rule allows unrestricted access
-                for ip_range in rule.get('IpRanges', []):
-                    cidr = ip_range.get('CidrIp')
-                    if cidr == '0.0.0.0/0' or cidr == '::/0':
-                        # Ports for ssh,sftp,and rdp.
-                        if from_port in [22, 3389, 80]:
-                            flagged_rules.append({
-                                'GroupId': sg['GroupId'],
-                                'GroupName': sg['GroupName'],
-                                'FromPort': from_port,
-                                'ToPort': to_port,
-                                'Protocol': protocol,
-                                'CidrIp': cidr
-                            })
-
-        if flagged_rules:
-            print("\nFlagged Security Groups are:")
-            for rule in flagged_rules:
-                port_type = critical_ports.get(rule['FromPort'])
-                print(f"\nSecurity Group ID: {rule['GroupId']}")
-                print(f"This security group allows unrestricted access from {rule['CidrIp']}"
-                      f" on port {rule['FromPort']} ({port_type})")
-                print(f"Please check security group ID: {rule['GroupId']} - Group Name: {rule['GroupName']}")
-                time.sleep(3)
-        else:
-            print("No security groups with unrestricted critical ports found.")
+        findings = self.find_open_security_groups()
+        self.report.show(findings, "Flagged Security Groups",
+                         "No security groups exposing critical ports found.",
+                         "Please check these security groups.")
+        return findings
 
     def check_for_public_instance(self):
         """Checks if an EC2 instance has public access"""
 
-        my_instances = self.ec2_client.describe_instances()
-        num_of_instance = len(my_instances['Reservations'])
-
-        print(f"Checking {num_of_instance} EC2 instances...")
-        time.sleep(2)
-
-        public_instances = []
-
-        for reservation in my_instances['Reservations']:
-            for instance in reservation['Instances']:
-                instance_id = instance.get('InstanceId')
-                public_ip = instance.get('PublicIpAddress')
-                state = instance['State']['Name']
-
-                if public_ip:
-                    public_instances.append({
-                        'InstanceId': instance_id,
-                        'PublicIp': public_ip,
-                        'State': state
-                    })
-
-        if public_instances:
-            print(f"{len(public_instances)} EC2 instance(s) were found with public access.")
-            time.sleep(1)
-
-            for item in public_instances:
-                print(f"Instance ID: {item['InstanceId']}")
-                print(f"IP Address: {item['PublicIp']}")
-                print(f"Current State: {item['State']}")
-                time.sleep(3)
-                print(f"Should '{item['InstanceId']}' have an assigned public IP? Please check.")
-                time.sleep(4)
-
-        else:
-            print("No EC2 instances were found with a public IP Address.")
-            time.sleep(3)
+        print("Checking EC2 instances...")
+        findings = self.find_public_instances()
+        self.report.show(findings, "EC2 instance(s) with public access",
+                         "No EC2 instances were found with a public IP Address.")
+        return findings
 
     def check_key_pair(self):
         """Checks our EC2 Instances for Key-Pairs."""
 
         print("Checking EC2 instances..")
-        time.sleep(3)
-        get_instances = self.ec2_client.describe_instances()
-
-        for reservations in get_instances['Reservations']:
-            for instances in reservations['Instances']:
-                instance_id = instances.get('InstanceId')
-                key_name = instances.get('KeyName')
-
-                if not key_name:
-                    print(f"Instance: {instance_id} has no key pair. This could"
-                          f" compromise the security of your instance.")
-                    time.sleep(3)
-                    print("Please check these instances.")
-                    time.sleep(3)
-                    print("Returning to EC2 Menu.")
-                    time.sleep(3)
+        findings = self.find_instances_without_key_pair()
+        self.report.show(findings, "EC2 instance(s) without a key pair", "All EC2 instances have a key pair.",
+                         "Please check these instances.")
+        print("Returning to EC2 Menu.")
+        return findings
+
+    def find_open_security_groups(self):
+        """
+        Returns a finding for every security group rule (IPv4 or IPv6, any protocol) exposing a critical port to the
+        whole internet or to a very broad public network.
+        """
+        return self.analyzer.analyse(self.describe_security_groups(), region=self.region)
+
+    def find_public_instances(self):
+        """Returns a finding for every EC2 instance with a public IP address."""
+        findings = []
+
+        for instance in paginate_instances(self.ec2_client, PUBLIC_IP_FILTER):
+            public_ip = instance.get('PublicIpAddress')
+            if public_ip:
+                findings.append(make_finding(
+                    "EC2", "public_instance", instance.get('InstanceId'),
+                    f"Has the public IP address {public_ip}. Should it have an assigned public IP?",
+                    region=self.region, PublicIp=public_ip, State=instance['State']['Name']
+                ))
+        return findings
+
+    def find_instances_without_key_pair(self):
+        """Returns a finding for every EC2 instance without a key pair."""
+        findings = []
+
+        for instance in paginate_instances(self.ec2_client):
+            if not instance.get('KeyName'):
+                findings.append(make_finding(
+                    "EC2", "no_key_pair", instance.get('InstanceId'),
+                    "Has no key pair. This could compromise the security of the instance.",
+                    region=self.region
+                ))
+        return findings
+
+    def audit(self):
+        """Runs every EC2 check for this region without any output, and returns all the findings."""
+        return (self.find_open_security_groups()
+                + self.find_public_instances()
+                + self.find_instances_without_key_pair())
 
     def ec2_sub_menu(self):
         """Provides a sub menu for checking security concerns with our EC2 instances."""
         print("Loading EC2 menu..")
-        time.sleep(2)
         print("Choose an option from the Menu.")
 
         while True:
@@ -166,7 +141,6 @@ class EC2Security:
 
                 elif user_choice == 5:
                     print("Returning to Main Menu")
-                    time.sleep(2)
                     break
 
                 else:
@@ -1,276 +1,164 @@
 import boto3
-import pandas as pd
 import time
-import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from utils import make_finding
+from client_factory import make_client
+from reporting import Report
+from iam_snapshot import IamSnapshot
+from credential_report import load_report, report_findings
+
+REPORT_MAX_AGE = timedelta(hours=4)  # AWS only generates a new credentials report once the last one is this old
 
 
 class IamSecurity:
     """Handles IAM related security checks."""
 
-    def __init__(self):
-        self.iam_client = boto3.client('iam')  # Initialise the IAM client
+    def __init__(self, session=None, report=None, as_of=None):
+        session = session or boto3.Session()
+        self.as_of = as_of  # Time the ages are worked out at (defaults to now), e.g. when replaying a snapshot
+        self.report = report or Report()  # How findings are shown in the menu
+        self.iam_client = make_client(session, 'iam')  # Initialise the IAM client
         self.last_report_generated_time = None  # Initialise a timestamp variable
+        self.user_data = None  # The credentials report as a typed DataFrame, replaced when a newer one is fetched
+        self.report_future = None  # The credentials report being fetched in the background, if any
 
-    @staticmethod  # Does not depend on any instance-specific data (self)
-    def check_existing_report():
-        """Checks if the credentials report has been generated or not"""
-        if not os.path.exists("credentials_report.csv"):
+    def check_existing_report(self):
+        """Checks if the credentials report has been generated (or is being generated) or not"""
+        if self.user_data is None and self.report_future is None:
             print("No credentials report was found. Please generate one!")
             return False
         return True
 
-    def iam_credentials_report(self):
-        """Generates a Credential Report for all IAM Users."""
+    def latest_credentials_report(self):
+        """
+        Returns the credentials report AWS already has, if it is under 4 hours old - AWS would hand back the same
+        report for a new request anyway. Returns None when there is no report, or it is too old.
+        """
+        try:
+            response = self.iam_client.get_credential_report()
+        except (self.iam_client.exceptions.CredentialReportNotPresentException,
+                self.iam_client.exceptions.CredentialReportExpiredException,
+                self.iam_client.exceptions.CredentialReportNotReadyException):
+            return None
+
+        if (self.as_of or datetime.now(timezone.utc)) - response['GeneratedTime'] > REPORT_MAX_AGE:
+            return None
+        return response
 
-        print("Getting the credentials report from AWS...")
-        time.sleep(2)
+    def iam_credentials_report(self, max_wait=300):
+        """
+        Generates a Credential Report for all IAM Users. AWS is polled with exponential backoff - quickly at first,
+        then less often - until the report is ready.
 
-        while True:
+        :param max_wait: Seconds to wait for the report before giving up
+        :return: Returns the get_credential_report response
+        """
+        delay = 0.5
+        deadline = time.monotonic() + max_wait
+
+        while self.iam_client.generate_credential_report()['State'] != 'COMPLETE':
+            if time.monotonic() + delay > deadline:
+                raise TimeoutError(f"The credentials report was not ready after {max_wait} seconds")
+            time.sleep(delay)
+            delay = min(delay * 2, 8)
+
+        return self.iam_client.get_credential_report()
+
+    def fetch_credentials_report(self):
+        """
+        Gets the credentials report straight into a typed DataFrame, without saving it to a file first. A report AWS
+        generated in the last 4 hours is reused instead of asking for a new one.
+        """
+        response = self.latest_credentials_report() or self.iam_credentials_report()
+        # The report is encoded as binary. Here we decode it and load it for the checks.
+        self.user_data = load_report(response['Content'].decode('utf-8'))
+        self.last_report_generated_time = response['GeneratedTime']
+        return self.user_data
+
+    def start_credentials_report(self):
+        """Starts fetching the credentials report in the background, so the menu can be used while AWS generates it."""
+        if self.report_future is None:
+            executor = ThreadPoolExecutor(max_workers=1)
+            self.report_future = executor.submit(self.fetch_credentials_report)
+            executor.shutdown(wait=False)  # The thread exits as soon as the report has been fetched
+        return self.report_future
+
+    def load_credentials_report(self):
+        """
+        Returns the credentials report as a typed DataFrame, first waiting for it if it is still being fetched in the
+        background. Returns None if it could not be fetched.
+        """
+        if self.report_future is not None:
+            if not self.report_future.done():
+                print("Waiting for the credentials report to be generated..")
             try:
-                gen_iam_report = self.iam_client.generate_credential_report()
-                if gen_iam_report['State'] == 'COMPLETE':
-                    print("Report generation status: COMPLETE")
-                    # Save the current time that the report was generated
-                    self.last_report_generated_time = datetime.now()
-                    break
-                else:
-                    print("Report generation is still in process..")
-                    time.sleep(3)
+                self.report_future.result()
 
             except self.iam_client.exceptions.LimitExceededException as e:
-                print(f"API call limit has been exceeded. {e}")
-                break
+                print(f"API call limit was still exceeded after retrying. Try again later. {e}")
 
             except self.iam_client.exceptions.ServiceFailureException as e:
-                print(f"API call has failed. Try again later.")
+                print("API call has failed. Try again later.")
                 print(f"Failure encountered: {e}")
-                break
 
             except Exception as e:
                 print(f"An error has occurred: {e}")
-                break
 
-        # This method returns a dictionary containing various pieces of metadata and the actual report content.
-        get_iam_report = self.iam_client.get_credential_report()
-        # The report is encoded as binary. Here we decode it as grab the Contents via the Content Key.
-        file_content = get_iam_report['Content'].decode('utf-8')
-        return file_content
-
-    def transform_data(self):
-        """Fetches the report, saves it to a file, and loads it into a Pandas DF"""
-        report = self.iam_credentials_report()
-
-        # Save the report to a CSV file
-        with open("credentials_report.csv", 'w') as file:
-            file.write(report)
-        print("Report was saved as credentials_report.csv")
-        time.sleep(2)
-        print("Returning to IAM Menu..")
-        time.sleep(2)
+            finally:
+                self.report_future = None
 
-    def users_without_mfa(self):
-        """Identifies and prints out users without MFA enabled"""
+        return self.user_data
 
+    def report_data(self):
+        """Returns the credentials report for a menu check, or None when there is no report yet."""
         # Checks that a credentials report exists.
         if not self.check_existing_report():
             print("Please generate a IAM credentials report first.")
-            time.sleep(2)
-            return None
-
-        user_data = pd.read_csv("credentials_report.csv")
-        # Empty list to add users without MFA
-        users_without_mfa = []
-        # Iterate over each row in the DataFrame
-        for index, row in user_data.iterrows():
-            if row['mfa_active'] == False:
-                users_without_mfa.append({'user': row['user'], 'mfa_active': row['mfa_active'], 'arn': row['arn']})
-
-        print("Calculating..")
-        time.sleep(2)
-        if not users_without_mfa:
-            print("All users have MFA enabled!")
-            time.sleep(2)
             return None
+        return self.load_credentials_report()
 
-        print("Users without MFA enabled:")
-        for index, item in enumerate(users_without_mfa, start=1):
-            print(f"\n{index} - {item['user']}: MFA Status: {item['mfa_active']}")
-
-        time.sleep(3)
-        print("Configure MFA for these users!")
-        time.sleep(3)
+    def transform_data(self):
+        """Starts getting the report from AWS in the background, and returns to the menu straight away"""
+        print("Getting the credentials report from AWS in the background...")
+        self.start_credentials_report()
         print("Returning to IAM Menu..")
-        time.sleep(3)
 
-    def check_for_old_passwords(self):
-        """Identifies users that have passwords older than 2 months."""
+    def users_without_mfa(self):
+        """Identifies and prints out users without MFA enabled"""
 
-        # Checks that a credentials report exists.
-        if not self.check_existing_report():
-            print("Please generate a IAM credentials report first.")
-            time.sleep(2)
+        user_data = self.report_data()
+        if user_data is None:
             return None
 
-        user_data = pd.read_csv("credentials_report.csv")
-        # Get today's date and also set the 2-month difference
-        today = datetime.now()
-        two_months_ago = today - timedelta(days=60)
-        list_of_users = []  # Store users who have not changed their password in 2 months
-
-        for index, row in user_data.iterrows():
-            if pd.isna(row['password_last_changed']):  # Skips rows to avoid errors with null values
-                continue
+        findings = self.find_users_without_mfa(user_data)
+        self.report.show(findings, "Users without MFA enabled", "All users have MFA enabled!",
+                         "Configure MFA for these users!")
+        return findings
 
-            last_changed = datetime.strptime(row['password_last_changed'], "%Y-%m-%dT%H:%M:%SZ")
-            if last_changed < two_months_ago:
-                list_of_users.append({'user': row['user'], 'password_last_changed': row['password_last_changed']})
+    def check_for_old_passwords(self):
+        """Identifies users that have passwords older than 2 months."""
 
-        print("Calculating..")
-        time.sleep(2)
-        if not list_of_users:
-            print("There are no users with passwords older than 2 months.")
+        user_data = self.report_data()
+        if user_data is None:
             return None
-        print("Displaying users with passwords older than 2 months")
-        for index, item in enumerate(list_of_users, start=1):
-            print(f"\n{index} - User: {item['user']}\nPassword last changed: {item['password_last_changed']}")
-        time.sleep(4)
-        print("Please investigate and prompt these users to update their passwords.")
-        time.sleep(3)
-        print("Returning to IAM Menu..")
-        time.sleep(3)
-
-    def list_aws_users(self):
-        """Provides us with a list of our aws users"""
-
-        show_users = self.iam_client.list_users()
-        my_users = []
 
-        for user in show_users['Users']:
-            user_name = user['UserName']
-            my_users.append(user_name)
-
-        # Returns a list of our AWS users.
-        return my_users
-
-    def list_aws_groups(self):
-        """Provides us with a list of our aws groups"""
-
-        show_groups = self.iam_client.list_groups()
-        my_groups = []
-
-        for group in show_groups['Groups']:
-            group_name = group['GroupName']
-            my_groups.append(group_name)
-
-        # Returns a list of our AWS Groups
-        return my_groups
-
-    def check_attached_user_policies(self):
-        """Lists the attached policies on our aws users"""
-
-        aws_users = self.list_aws_users()  # Get all aws users
-        attached_policies = {}
-
-        for user in aws_users:
-            get_list = self.iam_client.list_attached_user_policies(UserName=user)
-
-            # Ensure the user is there even with an empty list if no policies
-            attached_policies[user] = attached_policies.get(user, [])
-
-            # Add the users policies to their list in the dict.
-            for item in get_list['AttachedPolicies']:
-                policy = item['PolicyName']
-                attached_policies[user].append(policy)
-
-        # Output users and policies if they have policies.
-        for user, policies in attached_policies.items():
-            print(f"For user: {user}")
-
-            if policies:
-                print(f"Attached policies are: {policies}")
-            else:
-                print("There were no attached policies found.")
-                time.sleep(3)
-                continue
-
-        return attached_policies
-
-    def check_attached_group_policies(self):
-        """Checks which managed policies are attached to our groups"""
-
-        iam_groups = self.list_aws_groups()
-        admin_groups = {}
-
-        for group in iam_groups:
-            group_policies = self.iam_client.list_attached_group_policies(GroupName=group)
-
-            for item in group_policies['AttachedPolicies']:
-                policy = item['PolicyName']
-
-                if policy == 'AdministratorAccess':
-                    # Only add the group to admin_groups if it has AdministratorAccess
-                    admin_groups[group] = admin_groups.get(group, [])
-                    admin_groups[group].append(policy)
-
-        print("Displaying groups found..")
-        time.sleep(2)
-        for group, policy in admin_groups.items():
-            print(f"\nGroup name: {group} - Attached policies: {policy}")
-            time.sleep(1)
-        time.sleep(3)
-
-        return admin_groups
-
-    def users_in_admin_groups(self):
-        """Identify which users are part of Admin groups"""
-
-        aws_users = self.list_aws_users()  # Get all AWS Users
-        groups_with_admin_access = self.check_attached_group_policies()  # Get Admin groups with Admin access
-
-        users_with_admin = []  # List to store users that have admin access
-
-        for user in aws_users:
-            # Get the groups all users belong to
-            user_groups = self.iam_client.list_groups_for_user(UserName=user)
-
-            # Get the GroupName each user is part of.
-            print("Checking for users in found groups")
-            time.sleep(3)
-            for group in user_groups['Groups']:
-                group_name = group['GroupName']
-
-                if group_name in groups_with_admin_access:  # Python interprets this as .keys() by default.
-                    users_with_admin.append(user)
-                    print(f"\nUser {user} has Admin privileges because they belong to group {group_name}.")
-                    time.sleep(1)
-                time.sleep(3)
-
-            return users_with_admin
-
-        if not users_with_admin:
-            print("No users were found with Admin privileges.")
-            return None
+        findings = self.find_old_passwords(user_data)
+        self.report.show(findings, "Users with passwords older than 2 months",
+                         "There are no users with passwords older than 2 months.",
+                         "Please investigate and prompt these users to update their passwords.")
+        return findings
 
     def check_for_admin(self):
-        """Calls our various methods to look for Admin privileges in our aws users/groups."""
-
-        print("Checking for Admin rights via attached user policies")
-        time.sleep(3)
-        self.check_attached_user_policies()
-        time.sleep(4)
-        print("Checking for Admin rights via IAM Groups.")
-        time.sleep(3)
-        admin_via_group = self.users_in_admin_groups()
-        if admin_via_group:
-            print("Verify that these users should have Admin rights via their group.")
-            time.sleep(3)
-        else:
-            print("Verify there are 0 users with Admin rights via groups.")
-            time.sleep(3)
+        """Looks for Admin privileges in our aws users and roles, attached directly or through groups."""
 
+        print("Checking for Admin rights via attached user policies and IAM Groups.")
+        findings = self.find_admin_users(self.fetch_snapshot())
+        self.report.show(findings, "Users and roles with Admin privileges",
+                         "No users or roles were found with Admin privileges.",
+                         "Verify that these users and roles should have Admin rights.")
         print("Returning to IAM Main Menu..")
-        time.sleep(3)
+        return findings
 
     def check_access_keys(self):
         """
@@ -280,51 +168,95 @@ class IamSecurity:
 
         print("It is recommended to change IAM users access keys every 90 days or less. Many"
               " compliance frameworks require regular credential rotation.")
-        time.sleep(4)
         print("Checking access keys..")
-        time.sleep(3)
-        today = datetime.now(timezone.utc)
-        two_months_ago = today - timedelta(days=60)
-
-        iam_users = self.list_aws_users()
-
-        for user in iam_users:
-            response = self.iam_client.list_access_keys(UserName=user)
-
-            for data in response['AccessKeyMetadata']:
-                key_id = data.get('AccessKeyId')
-                status = data.get('Status')
-                date = data.get('CreateDate')
+        if self.user_data is None:
+            self.start_credentials_report()  # The key ages come from the credentials report
+        user_data = self.load_credentials_report()
+        if user_data is None:
+            return None
 
-                if date < two_months_ago:
-                    print(f"The access key for user: {user} has not been changed in"
-                          f" over two months. Last changed: {date}. Status: {status}.")
-                    time.sleep(3)
+        findings = self.find_old_access_keys(user_data)
+        self.report.show(findings, "Access keys not rotated or used in over two months",
+                         "All access keys have been rotated and used in the last two months.",
+                         "Please check any flagged users with old or inactive access keys.")
+        print("Returning to IAM Main Menu..")
+        return findings
 
-                response_2 = self.iam_client.get_access_key_last_used(AccessKeyId=key_id)
+    def check_root_and_unused_users(self):
+        """Checks for recent use of the root account, root access keys, and users that are no longer used."""
 
-                #  Here .get incase key has not been used.
-                last_used = response_2['AccessKeyLastUsed'].get('LastUsedDate')
-                if last_used:
-                    if last_used < two_months_ago:
-                        print(f"The access key for user: {user} has not been used in over two months. Last"
-                              f" used date {last_used}")
+        user_data = self.report_data()
+        if user_data is None:
+            return None
 
-        print("Please check any flagged users with old or inactive access keys.")
-        time.sleep(3)
-        print("Returning to IAM Main Menu..")
-        time.sleep(3)
+        findings = self.find_root_and_unused_users(user_data)
+        self.report.show(findings, "Root account and unused user concerns",
+                         "The root account has not been used recently and there are no unused users.",
+                         "The root account should be locked away, and unused users removed.")
+        return findings
+
+    @staticmethod
+    def find_users_without_mfa(user_data):
+        """Returns a finding for every user in the credentials report without MFA enabled."""
+        return report_findings(user_data, ['no_mfa'])
+
+    @staticmethod
+    def find_old_passwords(user_data):
+        """Returns a finding for every user in the credentials report whose password is older than 2 months."""
+        return report_findings(user_data, ['old_password'])
+
+    @staticmethod
+    def find_root_and_unused_users(user_data):
+        """Returns a finding for recent root account use, root access keys, and users unused for 2 months."""
+        return report_findings(user_data, ['root_access_key', 'root_used', 'unused_user'])
+
+    def fetch_snapshot(self):
+        """Downloads the account's IAM configuration in one go."""
+        return IamSnapshot.fetch(self.iam_client)
+
+    @staticmethod
+    def find_admin_users(snapshot):
+        """Returns a finding for every user and role with Admin access, attached directly or through a group."""
+        findings = []
+
+        for user, policy, group in snapshot.admin_users():
+            if group:
+                findings.append(make_finding("IAM", "admin_user", user,
+                                             f"Has Admin privileges because they belong to group {group}.",
+                                             group=group, policy=policy))
+            else:
+                findings.append(make_finding("IAM", "admin_user", user,
+                                             f"Has the {policy} policy attached directly.", policy=policy))
+
+        for role, policy in snapshot.admin_roles().items():
+            findings.append(make_finding("IAM", "admin_role", role, f"Has the {policy} policy attached.",
+                                         policy=policy))
+        return findings
+
+    @staticmethod
+    def find_old_access_keys(user_data):
+        """Returns a finding for every access key not rotated, or not used, in over two months."""
+        return report_findings(user_data, ['old_access_key', 'unused_access_key'])
+
+    def audit(self):
+        """Runs every IAM check without any output, and returns all the findings."""
+        future = self.start_credentials_report()  # AWS generates the report while the snapshot downloads
+        snapshot = self.fetch_snapshot()
+        user_data = future.result()
+        self.report_future = None
+        # All the credentials report checks are worked out together, in one pass over the report
+        return report_findings(user_data, now=self.as_of) + self.find_admin_users(snapshot)
 
     def iam_sub_menu(self):
         """Provides a sub menu for checking IAM security concerns."""
         print("Loading IAM menu..")
-        time.sleep(2)
         print("Choose an option from the Menu.")
 
         while True:
             try:
                 last_generated = (
-                    self.last_report_generated_time.strftime("%Y-%m-%d %H:%M:%S")
+                    "Generating now.." if self.report_future and not self.report_future.done()
+                    else self.last_report_generated_time.strftime("%Y-%m-%d %H:%M:%S")
                     if self.last_report_generated_time
                     else "Never"
                 )
@@ -333,7 +265,8 @@ class IamSecurity:
                 print("3 - Check for old passwords.")
                 print("4 - Verify Admin access.")
                 print("5 - Check access keys.")
-                print("6 - Main Menu.")
+                print("6 - Check root account use and unused users.")
+                print("7 - Main Menu.")
                 user_choice = int(input("Enter here: "))
 
                 if user_choice == 1:
@@ -354,8 +287,10 @@ class IamSecurity:
                     self.check_access_keys()
 
                 elif user_choice == 6:
+                    self.check_root_and_unused_users()
+
+                elif user_choice == 7:
                     print("Returning to Main Menu")
-                    time.sleep(2)
                     break
 
                 else:
@@ -0,0 +1,123 @@
+from utils import PAGE_SIZE
+
+ADMIN_POLICY_NAME = 'AdministratorAccess'
+
+
+def fetch_authorization_details(iam_client):
+    """
+    Downloads every user, group, role and customer managed policy in the account, with their attached and inline
+    policies and group memberships, from the paginated get_account_authorization_details call - a handful of calls in
+    total, instead of several per user and per group. (The AWS managed policies are left out - the one that gives full
+    access, AdministratorAccess, is recognised by name.)
+
+    :return: Returns a dict with the lists UserDetailList, GroupDetailList, RoleDetailList and Policies
+    """
+    details = {'UserDetailList': [], 'GroupDetailList': [], 'RoleDetailList': [], 'Policies': []}
+    paginator = iam_client.get_paginator('get_account_authorization_details')
+
+    for page in paginator.paginate(Filter=['User', 'Group', 'Role', 'LocalManagedPolicy'],
+                                   PaginationConfig={'PageSize': PAGE_SIZE}):
+        for key in details:
+            details[key].extend(page.get(key, []))
+    return details
+
+
+def statements(document):
+    """Returns the statements of a policy document as a list (a single statement may be given without a list)."""
+    if not document:
+        return []
+    statement = document.get('Statement', [])
+    return statement if isinstance(statement, list) else [statement]
+
+
+def grants_full_access(document):
+    """Checks if a policy document allows every action on every resource, i.e. is Admin access by another name."""
+    for statement in statements(document):
+        actions = statement.get('Action', [])
+        resources = statement.get('Resource', [])
+        actions = actions if isinstance(actions, list) else [actions]
+        resources = resources if isinstance(resources, list) else [resources]
+
+        if statement.get('Effect') == 'Allow' and '*' in actions and '*' in resources:
+            return True
+    return False
+
+
+class IamSnapshot:
+    """
+    An in-memory copy of the account's IAM configuration - from get_account_authorization_details - indexed by
+    user, group, role and policy, so the admin and policy checks run locally with no further API calls.
+    """
+
+    def __init__(self, details):
+        """
+        :param details: The dict returned by fetch_authorization_details
+        """
+        self.users = {user['UserName']: user for user in details['UserDetailList']}
+        self.groups = {group['GroupName']: group for group in details['GroupDetailList']}
+        self.roles = {role['RoleName']: role for role in details['RoleDetailList']}
+        self.policies = {policy['Arn']: policy for policy in details['Policies']}
+
+        # Customer managed policies whose document gives full access, by ARN
+        self.admin_policy_arns = {arn for arn, policy in self.policies.items()
+                                  if grants_full_access(self.default_document(policy))}
+
+    @classmethod
+    def fetch(cls, iam_client):
+        """Builds a snapshot from the live account."""
+        return cls(fetch_authorization_details(iam_client))
+
+    @staticmethod
+    def default_document(policy):
+        """Returns the policy document of a managed policy's default version."""
+        for version in policy.get('PolicyVersionList', []):
+            if version.get('IsDefaultVersion'):
+                return version.get('Document')
+        return None
+
+    def admin_policy(self, entity, inline_key):
+        """Returns the name of a policy giving the user/group/role full access, or None."""
+        for policy in entity.get('AttachedManagedPolicies', []):
+            if policy['PolicyArn'] in self.admin_policy_arns or policy['PolicyName'] == ADMIN_POLICY_NAME:
+                return policy['PolicyName']
+
+        for policy in entity.get(inline_key, []):
+            if grants_full_access(policy.get('PolicyDocument')):
+                return f"{policy['PolicyName']} (inline)"
+        return None
+
+    def admin_groups(self):
+        """Returns {group name: admin policy name} for every group that gives full access."""
+        groups = {}
+        for name, group in self.groups.items():
+            policy = self.admin_policy(group, 'GroupPolicyList')
+            if policy:
+                groups[name] = policy
+        return groups
+
+    def admin_users(self):
+        """
+        Returns (user, policy, group) for every way a user has full access - group is None when the policy is
+        attached to the user directly.
+        """
+        admin_groups = self.admin_groups()
+        found = []
+
+        for name, user in self.users.items():
+            policy = self.admin_policy(user, 'UserPolicyList')
+            if policy:
+                found.append((name, policy, None))
+
+            for group in user.get('GroupList', []):
+                if group in admin_groups:
+                    found.append((name, admin_groups[group], group))
+        return found
+
+    def admin_roles(self):
+        """Returns {role name: admin policy name} for every role that gives full access."""
+        roles = {}
+        for name, role in self.roles.items():
+            policy = self.admin_policy(role, 'RolePolicyList')
+            if policy:
+                roles[name] = policy
+        return roles
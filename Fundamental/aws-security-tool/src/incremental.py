@@ -0,0 +1,243 @@
+import hashlib
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+from audit_engine import AuditEngine
+from iam_security import IamSecurity
+from s3_compliance import S3Compliance
+from ec2_security import EC2Security
+from client_factory import make_client
+from credential_report import report_findings
+from sg_analyzer import DEFAULT_CRITICAL_PORTS
+from utils import paginate
+
+MAX_AGE = timedelta(days=7)  # Resources are re-checked at least this often, even when nothing says they changed
+CLOUDTRAIL_DELAY = timedelta(hours=1)  # CloudTrail can take a while to show an event, so look back a bit further
+
+
+def fingerprint(value):
+    """Returns a short hash of a value (e.g. a security group's rules), to tell whether it changed since the last run."""
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def findings_by_resource(findings):
+    """Returns {resource: [its findings]}."""
+    grouped = {}
+    for finding in findings:
+        grouped.setdefault(finding['resource'], []).append(finding)
+    return grouped
+
+
+def changed_since(session, region, event_source, since):
+    """
+    Returns the names of the resources of a service (e.g. "s3.amazonaws.com") changed since a time, from CloudTrail's
+    write events in a region - a few cheap calls, however many resources there are. Returns None when CloudTrail
+    cannot be read, or a change does not name its resource, so the caller knows to re-check everything.
+    """
+    cloudtrail_client = make_client(session, 'cloudtrail', region)
+    changed = set()
+    try:
+        # CloudTrail only allows one lookup attribute, so the service is filtered by AWS and read events here
+        for event in paginate(cloudtrail_client, 'lookup_events', 'Events', StartTime=since - CLOUDTRAIL_DELAY,
+                              LookupAttributes=[{'AttributeKey': 'EventSource', 'AttributeValue': event_source}]):
+            if event.get('ReadOnly') == 'true':
+                continue
+            names = {resource['ResourceName'] for resource in event.get('Resources', [])
+                     if resource.get('ResourceName')}
+            # S3 events also name the bucket in the request itself
+            request = json.loads(event.get('CloudTrailEvent') or '{}').get('requestParameters') or {}
+            if request.get('bucketName'):
+                names.add(request['bucketName'])
+            if not names:
+                return None  # Something changed, but we can't tell what
+            changed |= names
+    except Exception:  # Access denied, CloudTrail not available in the region, etc. - everything gets re-checked
+        return None
+    return changed
+
+
+class IncrementalAudit(AuditEngine):
+    """
+    An AuditEngine that remembers every resource it checked - a fingerprint of its configuration and its findings -
+    in a state file, and on the next run only re-checks what changed, carrying the findings forward for the rest.
+
+    - S3: list_buckets and CloudTrail's write events show which buckets are new or were changed since the last run,
+      and only those get the six posture calls each.
+    - EC2: security groups whose rules hash the same as last time are not analysed again. (Instances are always checked
+      in full - one listing call returns everything.)
+    - IAM: the admin analysis is carried forward while the account summary and CloudTrail show no IAM changes. The
+      credentials report checks always run, as they depend on how old passwords and keys are.
+
+    Everything is re-checked at least every MAX_AGE, and whenever CloudTrail cannot be read.
+    """
+
+    def __init__(self, state_file, max_age=MAX_AGE, **kwargs):
+        """
+        :param state_file: JSON file the fingerprints and findings are kept in between runs
+        :param max_age: How long a resource's findings can be carried forward without re-checking it
+        :param kwargs: Passed on to AuditEngine, e.g. regions
+        """
+        super().__init__(**kwargs)
+        self.state_file = state_file
+        self.max_age = max_age
+        self.state = self.load_state()
+        self.new_state = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.started = datetime.now(timezone.utc)
+        self.catalogue = fingerprint(self.critical_ports or DEFAULT_CRITICAL_PORTS)
+
+    def load_state(self):
+        """Returns the state saved by the last run, or an empty state on the first run."""
+        try:
+            with open(self.state_file) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def save_state(self):
+        with open(self.state_file, "w") as file:
+            json.dump(self.state, file, default=str)
+
+    def last_run(self):
+        """Returns when the last run started, or None."""
+        return datetime.fromisoformat(self.state['run']) if self.state.get('run') else None
+
+    def previous(self, label):
+        """Returns what the last run saved for a task, e.g. "S3"."""
+        return self.state.get('tasks', {}).get(label, {})
+
+    def is_stale(self, record):
+        """Checks if a resource was last checked over max_age ago."""
+        return self.started - datetime.fromisoformat(record['checked']) > self.max_age
+
+    def remember(self, label, task_state, checked, carried_forward):
+        """Keeps a task's new state for saving, and how many resources it re-checked and carried forward."""
+        with self.lock:
+            self.new_state[label] = task_state
+            self.stats[label] = {'checked': checked, 'carried_forward': carried_forward}
+
+    def run_task(self, service, region):
+        """Audits one service (in one region) incrementally, returning its findings."""
+        session = self.session_factory(region)
+
+        if service == "IAM":
+            return self.audit_iam(session)
+        if service == "S3":
+            return self.audit_s3(session)
+        return self.audit_ec2(session, region)
+
+    def audit_iam(self, session):
+        iam = IamSecurity(session)
+        future = iam.start_credentials_report()  # AWS generates the report while the rest is worked out
+        previous = self.previous("IAM")
+
+        # One call giving the number of users, groups, roles, policies, attachments, etc. in the account
+        account = iam.iam_client.get_account_summary()['SummaryMap']
+        unchanged = (previous and previous['account'] == fingerprint(account) and not self.is_stale(previous)
+                     and changed_since(session, 'us-east-1', 'iam.amazonaws.com', self.last_run()) == set())
+
+        if unchanged:
+            admin_findings = previous['findings']
+            self.remember("IAM", previous, 0, account['Users'] + account['Roles'])
+        else:
+            snapshot = iam.fetch_snapshot()
+            admin_findings = iam.find_admin_users(snapshot)
+            self.remember("IAM", {'account': fingerprint(account), 'checked': self.started.isoformat(),
+                                  'findings': admin_findings}, len(snapshot.users) + len(snapshot.roles), 0)
+
+        user_data = future.result()
+        iam.report_future = None
+        return report_findings(user_data) + admin_findings
+
+    def audit_s3(self, session):
+        s3 = S3Compliance(session)
+        previous = self.previous("S3").get('resources', {})
+        buckets = list(paginate(s3.s3_client, 'list_buckets', 'Buckets'))
+
+        # Buckets changed since the last run, from CloudTrail in every region the buckets are in (None: unknown)
+        changed = None
+        if previous and self.last_run():
+            regions = {bucket.get('BucketRegion') or previous.get(bucket['Name'], {}).get('region')
+                       for bucket in buckets}
+            if None not in regions:
+                changed = set()
+                for region in regions:
+                    names = changed_since(session, region, 's3.amazonaws.com', self.last_run())
+                    if names is None:
+                        changed = None
+                        break
+                    changed |= names
+
+        to_check = []
+        resources = {}
+        for bucket in buckets:
+            record = previous.get(bucket['Name'])
+            if (changed is None or record is None or bucket['Name'] in changed or self.is_stale(record)
+                    or record['created'] != str(bucket.get('CreationDate'))):
+                to_check.append(bucket)
+            else:
+                resources[bucket['Name']] = record
+
+        posture = s3.collector.collect(to_check)
+        new_findings = findings_by_resource(s3.evaluate(posture))
+
+        for bucket in to_check:
+            found = posture[bucket['Name']]
+            if found['errors']:
+                continue  # Not remembered, so the bucket is re-checked next time
+            resources[bucket['Name']] = {
+                'created': str(bucket.get('CreationDate')),
+                'region': found['region'],
+                'checked': self.started.isoformat(),
+                'findings': new_findings.get(bucket['Name'], []),
+            }
+
+        carried = [finding for name, record in resources.items() if name not in posture
+                   for finding in record['findings']]
+        self.remember("S3", {'resources': resources}, len(to_check), len(buckets) - len(to_check))
+        return carried + [finding for findings in new_findings.values() for finding in findings]
+
+    def audit_ec2(self, session, region):
+        ec2 = EC2Security(session, region_name=region, critical_ports=self.critical_ports)
+        label = f"EC2/{region}"
+        previous = self.previous(label)
+        # Findings are only carried forward if they were found with the same critical port catalogue
+        previous = previous.get('resources', {}) if previous.get('catalogue') == self.catalogue else {}
+
+        to_check = []
+        resources = {}
+        for sg in ec2.describe_security_groups():
+            rules = fingerprint(sg.get('IpPermissions', []))
+            record = previous.get(sg['GroupId'])
+            if record and record['rules'] == rules:
+                resources[sg['GroupId']] = record
+            else:
+                to_check.append(sg)
+                resources[sg['GroupId']] = {'rules': rules, 'findings': []}
+
+        new_findings = findings_by_resource(ec2.analyzer.analyse(to_check, region=region))
+        for group_id, findings in new_findings.items():
+            resources[group_id]['findings'] = findings
+
+        sg_findings = [finding for record in resources.values() for finding in record['findings']]
+        self.remember(label, {'catalogue': self.catalogue, 'resources': resources},
+                      len(to_check), len(resources) - len(to_check))
+        return sg_findings + ec2.find_public_instances() + ec2.find_instances_without_key_pair()
+
+    def run(self):
+        """
+        Runs every task incrementally and saves the new state. A task that fails keeps its state from the last run.
+
+        :return: Returns (findings, summary), where summary["incremental"] has the resources re-checked and carried
+        forward by each task
+        """
+        findings, summary = super().run()
+
+        tasks = dict(self.state.get('tasks', {}))
+        tasks.update(self.new_state)
+        self.state = {'run': self.started.isoformat(), 'tasks': tasks}
+        self.save_state()
+
+        summary['incremental'] = self.stats
+        return findings, summary
@@ -1,6 +1,13 @@
+import argparse
 from iam_security import IamSecurity
 from s3_compliance import S3Compliance
 from ec2_security import EC2Security
+from audit_engine import AuditEngine
+from client_factory import parse_rate_limit, set_rate_limits
+from incremental import IncrementalAudit
+from org_sweep import OrgSweep, read_accounts
+from reporting import Report, summarise, write_json
+from sg_analyzer import load_catalogue
 
 class SecurityTool:
     """Coordinates the execution of security checks across our AWS services.
@@ -11,21 +18,20 @@ class SecurityTool:
     security checks
     """
 
-    def __init__(self):
+    def __init__(self, pager=False, critical_ports=None):
         """Initialises dependencies for our Classes"""
-        self.iam = IamSecurity()
-        self.s3 = S3Compliance()
-        self.ec2 = EC2Security()
+        report = Report(pager=pager)  # Shared by the services, so findings are shown the same way everywhere
+        self.iam = IamSecurity(report=report)
+        self.s3 = S3Compliance(report=report)
+        self.ec2 = EC2Security(report=report, critical_ports=critical_ports)
 
     def security_menu(self):
         """Provides the Main Menu interface for navigating the programme."""
         print("Loading programme...")
-        time.sleep(2)
 
         while True:
             try:
                 print("Choose a AWS Service from the Menu to look for security concerns.")
-                time.sleep(2)
                 print("Main Menu")
                 print("1 - IAM")
                 print("2 - S3")
@@ -46,7 +52,6 @@ class SecurityTool:
 
                 elif user_choice == 4:
                     print("Exiting the application..")
-                    time.sleep(2)
                     print("Bye!")
                     break
 
@@ -57,8 +62,98 @@ class SecurityTool:
                 print("Please input a number.")
 
 
+def audit_all(engine, output_file="audit_report.json", show=False, pager=False):
+    """
+    Runs every check without the menu, and saves the findings as JSON.
+
+    :param engine: An AuditEngine (this account) or OrgSweep (many accounts)
+    """
+    print("Running all security checks...")
+    findings, summary = engine.run()
+    write_json(findings, output_file, summary)
+
+    if show:
+        Report(pager=pager).show_all(findings)
+    else:
+        for check, count in sorted(summarise(findings).items()):
+            print(f"{check}: {count}")
+
+    if summary.get('failed_accounts'):
+        print(f"{len(summary['failed_accounts'])} of {summary['accounts']} account(s) could not be audited.")
+    print(f"{summary['findings']} finding(s) from {summary['tasks']} checks in {summary['seconds']} seconds.")
+    if summary.get('incremental'):
+        checked = sum(task['checked'] for task in summary['incremental'].values())
+        carried = sum(task['carried_forward'] for task in summary['incremental'].values())
+        print(f"Re-checked {checked} resource(s); findings for {carried} unchanged resource(s) were carried forward.")
+    if summary.get('throttles'):
+        print(f"AWS throttled {sum(summary['throttles'].values())} call(s), which were retried: {summary['throttles']}")
+    print(f"The full report was saved as {output_file}")
+
+
+def parse_args():
+    """Command line options. With no options the interactive Main Menu is started."""
+    parser = argparse.ArgumentParser(description="AWS Security Tool - check IAM, S3 and EC2 for security concerns")
+    parser.add_argument("--audit-all", action="store_true",
+                        help="Run every check across all enabled regions without the menu")
+    parser.add_argument("--accounts", nargs="+", metavar="ACCOUNT_ID",
+                        help="Audit these accounts (like --audit-all) by assuming --role-name in each of them")
+    parser.add_argument("--accounts-file", help="File with the account IDs to audit, one per line")
+    parser.add_argument("--role-name", default="OrganizationAccountAccessRole",
+                        help="Role to assume in every account (default: OrganizationAccountAccessRole)")
+    parser.add_argument("--external-id", help="ExternalId required by the role's trust policy, if any")
+    parser.add_argument("--regions", nargs="+", help="Only audit these regions (default: all enabled regions)")
+    parser.add_argument("--workers", type=int, default=8, help="Number of checks to run at once (default: 8)")
+    parser.add_argument("--output", default="audit_report.json", help="Where to save the audit report")
+    parser.add_argument("--show", action="store_true", help="With --audit-all, print every finding, not just counts")
+    parser.add_argument("--pager", action="store_true",
+                        help="Show findings a page at a time, waiting for Enter between pages")
+    parser.add_argument("--critical-ports", metavar="JSON_FILE",
+                        help="Critical port catalogue for the security group checks (default: built in)")
+    parser.add_argument("--incremental", metavar="STATE_FILE",
+                        help="Run --audit-all, only re-checking resources changed since the run that saved STATE_FILE "
+                             "(a single account only)")
+    parser.add_argument("--rate-limit", action="append", default=[], metavar="SERVICE=N",
+                        help="Requests per second allowed per account and region for a service, e.g. s3=500 "
+                             "(0 for no limit). Can be given more than once")
+    args = parser.parse_args()
+
+    try:
+        args.rate_limit = dict(parse_rate_limit(limit) for limit in args.rate_limit)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.incremental:
+        if args.accounts or args.accounts_file:
+            parser.error("--incremental audits a single account and cannot be used with --accounts/--accounts-file")
+        args.audit_all = True
+    return args
+
+
 def main():
-    security_tool = SecurityTool()
+    args = parse_args()
+    critical_ports = load_catalogue(args.critical_ports) if args.critical_ports else None
+    set_rate_limits(args.rate_limit)
+
+    accounts = (args.accounts or []) + (read_accounts(args.accounts_file) if args.accounts_file else [])
+
+    if accounts:
+        engine = OrgSweep(accounts, args.role_name, regions=args.regions, max_workers=args.workers,
+                          external_id=args.external_id, critical_ports=critical_ports)
+        audit_all(engine, output_file=args.output, show=args.show, pager=args.pager)
+        return
+
+    if args.incremental:
+        engine = IncrementalAudit(args.incremental, regions=args.regions, max_workers=args.workers,
+                                  critical_ports=critical_ports)
+        audit_all(engine, output_file=args.output, show=args.show, pager=args.pager)
+        return
+
+    if args.audit_all:
+        engine = AuditEngine(regions=args.regions, max_workers=args.workers, critical_ports=critical_ports)
+        audit_all(engine, output_file=args.output, show=args.show, pager=args.pager)
+        return
+
+    security_tool = SecurityTool(pager=args.pager, critical_ports=critical_ports)
     security_tool.security_menu()
 
 
@@ -0,0 +1,138 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from botocore.credentials import CredentialProvider, CredentialResolver, DeferredRefreshableCredentials
+from botocore.session import get_session
+from audit_engine import AuditEngine, run_tasks
+from utils import make_finding
+from client_factory import make_client, throttle_counts, throttles_since
+
+ROLE_SESSION_NAME = "aws-security-tool"
+ROLE_DURATION = 3600  # Seconds; credentials are refreshed automatically shortly before they expire
+
+
+class CachedCredentialProvider(CredentialProvider):
+    """Gives a botocore session an account's cached role credentials, instead of looking for credentials itself."""
+    METHOD = 'sts-assume-role'
+
+    def __init__(self, credentials):
+        super().__init__()
+        self.credentials = credentials
+
+    def load(self):
+        return self.credentials
+
+
+def read_accounts(path):
+    """Reads account IDs from a file, one per line (blank lines and # comments are skipped)."""
+    with open(path) as file:
+        return [line.split("#")[0].strip() for line in file if line.split("#")[0].strip()]
+
+
+class OrgSweep:
+    """
+    Audits many AWS accounts in one run by assuming a role in each of them. Every account's tasks (IAM, S3, and EC2
+    per region) go onto one shared, bounded worker pool, so throughput is set by max_workers rather than by the
+    number of accounts, and all findings are merged into one report, tagged with their account.
+
+    Each account's role credentials are cached and shared by all of its tasks. They are only fetched when first used,
+    and botocore refreshes them automatically before they expire, so long sweeps never fail on expired credentials.
+    """
+
+    def __init__(self, accounts, role_name, regions=None, max_workers=16, external_id=None, session=None,
+                 critical_ports=None):
+        """
+        :param accounts: The account IDs to audit
+        :param role_name: The role to assume in every account, e.g. "OrganizationAccountAccessRole"
+        :param regions: Regions to audit EC2 in (defaults to every region enabled for each account)
+        :param max_workers: Maximum number of tasks running at once, across all accounts
+        :param external_id: ExternalId required by the role's trust policy, if any
+        :param session: The boto3 session whose credentials are allowed to assume the role
+        :param critical_ports: Critical port catalogue for the security group checks (see sg_analyzer)
+        """
+        self.accounts = list(dict.fromkeys(accounts))  # Drop duplicates, keep the order
+        self.role_name = role_name
+        self.regions = regions
+        self.max_workers = max_workers
+        self.external_id = external_id
+        self.critical_ports = critical_ports
+        self.sts_client = make_client(session or boto3.Session(), 'sts')
+        self.credentials = {account: self.role_credentials(account) for account in self.accounts}
+
+    def role_credentials(self, account):
+        """Returns auto-refreshing credentials for the role in an account (the role is assumed on first use)."""
+        role_arn = f"arn:aws:iam::{account}:role/{self.role_name}"
+
+        def assume_role():
+            params = {'RoleArn': role_arn, 'RoleSessionName': ROLE_SESSION_NAME, 'DurationSeconds': ROLE_DURATION}
+            if self.external_id:
+                params['ExternalId'] = self.external_id
+
+            credentials = self.sts_client.assume_role(**params)['Credentials']
+            return {
+                'access_key': credentials['AccessKeyId'],
+                'secret_key': credentials['SecretAccessKey'],
+                'token': credentials['SessionToken'],
+                'expiry_time': credentials['Expiration'].isoformat(),
+            }
+
+        return DeferredRefreshableCredentials(refresh_using=assume_role, method='sts-assume-role')
+
+    def session_for(self, account, region=None):
+        """Returns a new boto3 session for an account, using its cached role credentials."""
+        botocore_session = get_session()
+        provider = CachedCredentialProvider(self.credentials[account])
+        botocore_session.register_component('credential_provider', CredentialResolver(providers=[provider]))
+        return boto3.Session(botocore_session=botocore_session, region_name=region)
+
+    def engine_for(self, account):
+        """Returns an AuditEngine whose sessions all use the account's role."""
+        return AuditEngine(session_factory=lambda region=None: self.session_for(account, region),
+                           regions=self.regions, critical_ports=self.critical_ports)
+
+    def account_tasks(self, account):
+        """Returns the (service, region, account, function) tasks for one account."""
+        # Assume the role now, so an account we cannot get into fails here even when the regions are given
+        self.credentials[account].get_frozen_credentials()
+        engine = self.engine_for(account)
+        return [(service, region, account, engine.run_task) for service, region in engine.tasks()]
+
+    def run(self):
+        """
+        Audits every account. An account whose role cannot be assumed (or whose regions cannot be listed) is reported
+        as a finding, and the sweep carries on with the rest.
+
+        :return: Returns (findings, summary) - the merged findings, and timings / counts for the run
+        """
+        started = time.perf_counter()
+        throttles_before = throttle_counts()
+        tasks = []
+        findings = []
+        failed_accounts = []
+
+        # Working out each account's tasks needs an API call (enabled regions) - done on the pool too
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {account: executor.submit(self.account_tasks, account) for account in self.accounts}
+
+        for account, future in futures.items():
+            try:
+                tasks.extend(future.result())
+            except Exception as e:
+                failed_accounts.append(account)
+                finding = make_finding("STS", "account_failed", account, f"Could not audit the account: {e}")
+                finding['account'] = account
+                findings.append(finding)
+
+        task_findings, task_times = run_tasks(tasks, self.max_workers)
+        findings.extend(task_findings)
+
+        summary = {
+            "accounts": len(self.accounts),
+            "failed_accounts": failed_accounts,
+            "tasks": len(tasks),
+            "findings": len(findings),
+            "seconds": round(time.perf_counter() - started, 2),
+            "task_seconds": task_times,
+            "throttles": throttles_since(throttles_before)
+        }
+        return findings, summary
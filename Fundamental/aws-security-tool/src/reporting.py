@@ -0,0 +1,79 @@
+import json
+import sys
+from collections import Counter
+
+
+def format_finding(finding):
+    """Returns a finding as one line of text, e.g. "i-0abc (eu-west-1): Has the public IP address ..." """
+    where = f" ({finding['region']})" if finding.get('region') else ""
+    account = f"[{finding['account']}] " if finding.get('account') else ""
+    return f"{account}{finding['resource']}{where}: {finding['message']}"
+
+
+def summarise(findings):
+    """Returns the number of findings for each service and check, e.g. {"IAM/no_mfa": 4}."""
+    return dict(Counter(f"{finding['service']}/{finding['check']}" for finding in findings))
+
+
+def write_json(findings, output_file, summary=None):
+    """Saves findings (and an optional run summary) as a JSON report for other tools to read."""
+    with open(output_file, "w") as file:
+        json.dump({"summary": summary or {}, "counts": summarise(findings), "findings": findings},
+                  file, indent=2, default=str)
+
+
+class Report:
+    """
+    Presents findings. The checks only collect findings (see utils.make_finding) and never print or wait themselves,
+    so how the results are shown is decided here - everything at once with no pauses (the default), or a page at a
+    time, waiting for the user to press Enter (pager).
+    """
+
+    def __init__(self, pager=False, page_size=20, out=None):
+        """
+        :param pager: Pause after every page of findings until the user presses Enter
+        :param page_size: Number of findings per page
+        :param out: Where to print (defaults to the terminal)
+        """
+        self.pager = pager
+        self.page_size = page_size
+        self.out = out or sys.stdout
+
+    def write(self, text=""):
+        print(text, file=self.out)
+
+    def show(self, findings, title, empty_message, advice=None):
+        """
+        Prints the findings of a check, numbered, followed by what to do about them.
+
+        :param findings: The findings returned by a check
+        :param title: Heading printed above the findings
+        :param empty_message: Printed instead when there are no findings
+        :param advice: Printed after the findings, e.g. "Configure MFA for these users!"
+        """
+        findings = list(findings)
+        if not findings:
+            self.write(empty_message)
+            return
+
+        self.write(f"{title} ({len(findings)} found):")
+        for index, finding in enumerate(findings, start=1):
+            self.write(f"\n{index} - {format_finding(finding)}")
+
+            if self.pager and index % self.page_size == 0 and index < len(findings):
+                answer = input(f"-- {index} of {len(findings)} shown. Press Enter for more, or q to stop: ")
+                if answer.strip().lower() == "q":
+                    break
+
+        if advice:
+            self.write(f"\n{advice}")
+
+    def show_all(self, findings):
+        """Prints every finding from a full audit, grouped by service and check."""
+        groups = {}
+        for finding in findings:
+            groups.setdefault(f"{finding['service']}/{finding['check']}", []).append(finding)
+
+        for name, group in sorted(groups.items()):
+            self.show(group, name, "")
+            self.write()
@@ -1,134 +1,168 @@
 import boto3
 import pandas as pd
-import time
 import os
 from datetime import datetime, timedelta, timezone
+from utils import make_finding
+from client_factory import make_client
+from reporting import Report
+from s3_posture import S3PostureCollector
+
+PUBLIC_GROUPS = {
+    "http://acs.amazonaws.com/groups/global/AllUsers": "everyone",
+    "http://acs.amazonaws.com/groups/global/AuthenticatedUsers": "any AWS account",
+}
 
 class S3Compliance:
     """Handles S3 Compliance checks."""
 
-    def __init__(self):
-        self.s3_client = boto3.client('s3')  # Initialise the S3 client
-
-    def list_s3_buckets(self):
-        """Lists the S3 buckets in our AWS account"""
-
-        my_buckets = self.s3_client.list_buckets()
-        bucket_list = []
-
-        for bucket in my_buckets['Buckets']:
-            bucket_name = bucket['Name']
-            bucket_list.append(bucket_name)
-
-        return bucket_list
+    def __init__(self, session=None, report=None):
+        session = session or boto3.Session()
+        self.report = report or Report()  # How findings are shown in the menu
+        self.s3_client = make_client(session, 's3')  # Initialise the S3 client
+        self.collector = S3PostureCollector(session, self.s3_client)
 
     def is_bucket_public(self):
         """Checks if the S3 Bucket is publicly accessible."""
 
-        # Get the list of Buckets
-        my_buckets = self.list_s3_buckets()
-        public_buckets = []
-
-        try:
-            for bucket in my_buckets:
-                acl = self.s3_client.get_bucket_acl(Bucket=bucket)
-
-                # Check the ACL for public access
-                for grant in acl['Grants']:
-                    grantee = grant.get('Grantee', {})
-                    permission = grant.get('Permission', "")
-
-                    if grantee.get('Type') == 'Group':
-                        if grantee.get('URI') == "http://acs.amazonaws.com/groups/global/AllUsers":
-                            # Add the offending bucket to our public bucket list.
-                            public_buckets.append({'bucket_name': bucket, 'permission': permission})
-
-        except Exception as e:
-            print(f"Error checking status of bucket {e}")
-
-        if public_buckets:
-            print("Displaying S3 Buckets with public access security concerns.")
-            time.sleep(2)
-            for bucket in public_buckets:
-                print(f"Bucket: {bucket['bucket_name']} is publicly accessible.")
-                print(f"Reason: A permission in its ACL: {bucket['permission']},"
-                      f" allows public access.")
-                print("Review and update this buckets ACL to restrict public access.\n")
-                time.sleep(2)
-        else:
-            print("There were no buckets identified with public access security concerns")
-            time.sleep(2)
-
-        time.sleep(3)
+        findings = self.find_public_buckets(self.collect_posture())
+        self.report.show(findings, "S3 Buckets with public access security concerns",
+                         "There were no buckets identified with public access security concerns",
+                         "Review and update these buckets ACLs to restrict public access.")
         print("Returning to S3 Menu..")
-        time.sleep(3)
+        return findings
 
     def check_bucket_has_encryption(self):
         """Checks if our S3 Buckets have encryption enabled."""
 
-        my_buckets = self.list_s3_buckets()
         print("Data stored in S3 should be encrypted for data confidentiality,"
               " compliance, and risk mitigation.")
-        time.sleep(3)
-        print("Displaying encryption information on your S3 buckets:")
-        time.sleep(2)
-
-        try:
-            for bucket in my_buckets:
-                response = self.s3_client.get_bucket_encryption(Bucket=bucket)
-                item = response['ServerSideEncryptionConfiguration']
-
-                for rule in item['Rules']:
-                    encryption = rule['ApplyServerSideEncryptionByDefault']
-                    bucket_key = rule['BucketKeyEnabled']
-
-                    print(f"Bucket: {bucket} has encryption enabled {encryption}"
-                          f" and default bucket key enabled: {bucket_key}.\n")
-                    time.sleep(2)
-
-            time.sleep(2)
-            print("Investigate any buckets that do not have at least the default 'server side"
-                  " encryption' enabled.")
-
-            print("Returning to S3 Main Menu..")
-            time.sleep(2)
-
-        except Exception as e:
-            print(f"Error {e}")
+        findings = self.find_unencrypted_buckets(self.collect_posture())
+        self.report.show(findings, "S3 Buckets without encryption", "All S3 buckets have encryption enabled.",
+                         "Investigate any buckets that do not have at least the default 'server side"
+                         " encryption' enabled.")
+        print("Returning to S3 Main Menu..")
+        return findings
 
     def check_bucket_version(self):
         """Checks S3 buckets for bucket versioning enabled"""
 
-        print("Checking your S3 buckets..")
-        time.sleep(2)
-        my_buckets = self.list_s3_buckets()
         print("Bucket versioning ensures data protection and recovery. Investigate"
               " any buckets without versioning enabled.")
-        time.sleep(3)
-
-        for bucket in my_buckets:
-            response = self.s3_client.get_bucket_versioning(Bucket=bucket)
-
-            if 'Status' not in response:
-                print(f"Bucket versioning is not configured in this bucket: {bucket}")
-                time.sleep(2)
-
-            else:
-                status = response['Status']
-
-                if status == 'Enabled':
-                    print(f"Bucket {bucket} has bucket versioning enabled.")
-
-                elif status == 'Suspended':
-                    print(f"Bucket {bucket} has bucket versioning suspended.")
+        findings = self.find_unversioned_buckets(self.collect_posture())
+        self.report.show(findings, "S3 Buckets without versioning", "All S3 buckets have versioning enabled.")
+        print("Returning to S3 Main Menu..")
+        return findings
 
+    def collect_posture(self):
+        """Collects the ACL, policy status, public access block, encryption, versioning and logging of every bucket."""
+        print("Checking your S3 buckets..")
+        return self.collector.collect()
+
+    @staticmethod
+    def failed_checks(posture, keys):
+        """Returns a finding for every bucket where one of the calls a check needs failed."""
+        findings = []
+        for bucket in posture.values():
+            for key in keys:
+                if key in bucket['errors']:
+                    findings.append(make_finding("S3", "check_failed", bucket['name'],
+                                                 f"Could not read the bucket {key}: {bucket['errors'][key]}",
+                                                 region=bucket['region']))
+        return findings
+
+    @staticmethod
+    def find_public_buckets(posture):
+        """
+        Returns a finding for every bucket made public by its ACL (AllUsers / AuthenticatedUsers grants) or its bucket
+        policy, unless the bucket's public access block overrides it.
+        """
+        findings = S3Compliance.failed_checks(posture, ['acl', 'policy_status'])
+
+        for bucket in posture.values():
+            block = bucket['public_access_block'] or {}
+            acl_blocked = block.get('IgnorePublicAcls', False)
+            policy_blocked = block.get('RestrictPublicBuckets', False)
+
+            for grant in bucket['acl'] or []:
+                grantee = grant.get('Grantee', {})
+                if grantee.get('Type') == 'Group' and grantee.get('URI') in PUBLIC_GROUPS and not acl_blocked:
+                    findings.append(make_finding(
+                        "S3", "public_bucket", bucket['name'],
+                        f"A permission in its ACL ({grant.get('Permission', '')}) allows access to "
+                        f"{PUBLIC_GROUPS[grantee['URI']]}.", region=bucket['region'],
+                        Permission=grant.get('Permission', "")
+                    ))
+
+            if (bucket['policy_status'] or {}).get('IsPublic') and not policy_blocked:
+                findings.append(make_finding("S3", "public_bucket", bucket['name'],
+                                             "Its bucket policy allows public access.", region=bucket['region']))
+        return findings
+
+    @staticmethod
+    def find_unencrypted_buckets(posture):
+        """Returns a finding for every bucket without default server side encryption."""
+        findings = S3Compliance.failed_checks(posture, ['encryption'])
+
+        for bucket in posture.values():
+            if bucket['encryption'] is None and 'encryption' not in bucket['errors']:
+                findings.append(make_finding("S3", "no_encryption", bucket['name'],
+                                             "Does not have default server side encryption enabled.",
+                                             region=bucket['region']))
+        return findings
+
+    @staticmethod
+    def find_unversioned_buckets(posture):
+        """Returns a finding for every bucket without versioning enabled."""
+        findings = S3Compliance.failed_checks(posture, ['versioning'])
+
+        for bucket in posture.values():
+            if 'versioning' in bucket['errors']:
+                continue
+
+            status = (bucket['versioning'] or {}).get('Status')
+            if status != 'Enabled':
+                findings.append(make_finding(
+                    "S3", "no_versioning", bucket['name'],
+                    f"Bucket versioning is {status.lower() if status else 'not configured'}.",
+                    region=bucket['region'], Status=status
+                ))
+        return findings
+
+    @staticmethod
+    def find_unlogged_buckets(posture):
+        """Returns a finding for every bucket without server access logging."""
+        findings = S3Compliance.failed_checks(posture, ['logging'])
+
+        for bucket in posture.values():
+            if bucket['logging'] is None and 'logging' not in bucket['errors']:
+                findings.append(make_finding("S3", "no_logging", bucket['name'],
+                                             "Does not have server access logging enabled.", region=bucket['region']))
+        return findings
+
+    @staticmethod
+    def evaluate(posture):
+        """Runs every S3 check on the collected posture, and returns all the findings."""
+        return (S3Compliance.find_public_buckets(posture)
+                + S3Compliance.find_unencrypted_buckets(posture)
+                + S3Compliance.find_unversioned_buckets(posture)
+                + S3Compliance.find_unlogged_buckets(posture))
+
+    def audit(self):
+        """Runs every S3 check without any output, and returns all the findings."""
+        return self.evaluate(self.collector.collect())  # Collected once, and shared by every check
+
+    def check_bucket_logging(self):
+        """Checks S3 buckets for server access logging"""
+
+        print("Server access logging records the requests made to a bucket, for security and access audits.")
+        findings = self.find_unlogged_buckets(self.collect_posture())
+        self.report.show(findings, "S3 Buckets without access logging", "All S3 buckets have access logging enabled.")
         print("Returning to S3 Main Menu..")
-        time.sleep(2)
+        return findings
 
     def s3_sub_menu(self):
         """Provides a sub menu for checking S3 security concerns."""
         print("Loading S3 menu..")
-        time.sleep(2)
         print("Choose an option from the Menu.")
 
         while True:
@@ -136,7 +170,8 @@ class S3Compliance:
                 print("1 - Check for S3 Public Access")
                 print("2 - Check S3 Buckets have encryption")
                 print("3 - Check for S3 versioning enabled")
-                print("4 - Main Menu")
+                print("4 - Check for S3 access logging")
+                print("5 - Main Menu")
                 user_choice = int(input("Enter here: "))
 
                 if user_choice == 1:
@@ -149,8 +184,10 @@ class S3Compliance:
                     self.check_bucket_version()
 
                 elif user_choice == 4:
+                    self.check_bucket_logging()
+
+                elif user_choice == 5:
                     print("Returning to Main Menu")
-                    time.sleep(2)
                     break
 
                 else:
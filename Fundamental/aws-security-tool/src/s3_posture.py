@@ -0,0 +1,105 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import BotoCoreError, ClientError
+from utils import paginate
+from client_factory import make_client
+
+# Error codes that just mean "not configured" - recorded as None rather than as a failure
+NOT_CONFIGURED = {
+    'NoSuchPublicAccessBlockConfiguration',
+    'ServerSideEncryptionConfigurationNotFoundError',
+    'NoSuchBucketPolicy',
+}
+
+# What is collected for every bucket: key -> (client method, key of the response to keep)
+POSTURE_CALLS = {
+    'acl': ('get_bucket_acl', 'Grants'),
+    'policy_status': ('get_bucket_policy_status', 'PolicyStatus'),
+    'public_access_block': ('get_public_access_block', 'PublicAccessBlockConfiguration'),
+    'encryption': ('get_bucket_encryption', 'ServerSideEncryptionConfiguration'),
+    'versioning': ('get_bucket_versioning', None),
+    'logging': ('get_bucket_logging', 'LoggingEnabled'),
+}
+
+
+def bucket_region(location):
+    """Turns a get_bucket_location LocationConstraint into a region name (older regions use special values)."""
+    if not location:
+        return 'us-east-1'
+    if location == 'EU':
+        return 'eu-west-1'
+    return location
+
+
+class S3PostureCollector:
+    """
+    Collects everything the S3 checks need - ACL, policy status, public access block, encryption, versioning and
+    logging - for every bucket in one go. Buckets are collected in parallel, each through a client for the bucket's
+    own region (avoiding redirects), and a failed call is recorded against its bucket instead of stopping the rest.
+    """
+
+    def __init__(self, session, s3_client, max_workers=16):
+        """
+        :param session: The boto3 session, used to create a client per region
+        :param s3_client: The default S3 client, used to list the buckets
+        :param max_workers: Maximum number of buckets collected at once
+        """
+        self.session = session
+        self.s3_client = s3_client
+        self.max_workers = max_workers
+        self.clients = {}
+        self.clients_lock = threading.Lock()  # Creating clients from one session is not thread-safe
+
+    def regional_client(self, region):
+        """Returns the S3 client for a region, creating it the first time."""
+        with self.clients_lock:
+            if region not in self.clients:
+                self.clients[region] = make_client(self.session, 's3', region)
+            return self.clients[region]
+
+    def collect_bucket(self, bucket):
+        """
+        Collects the posture of one bucket.
+
+        :param bucket: A bucket from list_buckets
+        :return: Returns a dict with the bucket's name, region, each POSTURE_CALLS key, and errors (call -> message)
+        """
+        posture = {'name': bucket['Name'], 'region': bucket.get('BucketRegion'), 'errors': {}}
+
+        if not posture['region']:
+            try:
+                location = self.s3_client.get_bucket_location(Bucket=bucket['Name'])
+                posture['region'] = bucket_region(location.get('LocationConstraint'))
+            except (ClientError, BotoCoreError) as e:
+                posture['errors']['location'] = str(e)
+                posture['region'] = self.s3_client.meta.region_name
+
+        client = self.regional_client(posture['region'])
+
+        for key, (method, result_key) in POSTURE_CALLS.items():
+            try:
+                response = getattr(client, method)(Bucket=bucket['Name'])
+                if result_key:
+                    posture[key] = response.get(result_key)
+                else:
+                    posture[key] = {k: v for k, v in response.items() if k != 'ResponseMetadata'}
+            except ClientError as e:
+                posture[key] = None
+                if e.response['Error']['Code'] not in NOT_CONFIGURED:
+                    posture['errors'][key] = str(e)
+            except BotoCoreError as e:  # e.g. the connection failed or timed out, even after retrying
+                posture[key] = None
+                posture['errors'][key] = str(e)
+        return posture
+
+    def collect(self, buckets=None):
+        """
+        Returns {bucket name: posture} for every bucket in the account.
+
+        :param buckets: Only collect these buckets (from list_buckets) instead of listing them all
+        """
+        if buckets is None:
+            buckets = paginate(self.s3_client, 'list_buckets', 'Buckets')
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return {posture['name']: posture for posture in executor.map(self.collect_bucket, buckets)}
@@ -0,0 +1,192 @@
+import ipaddress
+import json
+from functools import lru_cache
+from utils import make_finding
+
+# Ports that should never be open to the internet, by protocol. A key can be one port or a range, e.g. "20-21".
+DEFAULT_CRITICAL_PORTS = {
+    'tcp': {
+        '20-21': 'FTP', '22': 'SSH/SFTP', '23': 'Telnet', '25': 'SMTP', '80': 'HTTP', '135': 'RPC', '139': 'NetBIOS',
+        '445': 'SMB', '1433': 'MSSQL', '1521': 'Oracle', '2049': 'NFS', '2375-2376': 'Docker', '3306': 'MySQL',
+        '3389': 'RDP', '5432': 'PostgreSQL', '5900': 'VNC', '5984': 'CouchDB', '6379': 'Redis',
+        '9200-9300': 'Elasticsearch', '11211': 'Memcached', '27017': 'MongoDB',
+    },
+    'udp': {
+        '53': 'DNS', '69': 'TFTP', '111': 'RPC', '137-138': 'NetBIOS', '161': 'SNMP', '2049': 'NFS',
+        '11211': 'Memcached',
+    },
+}
+
+ALL_PORTS = (0, 65535)
+PROTOCOL_NAMES = {'6': 'tcp', '17': 'udp', '1': 'icmp', '58': 'icmpv6'}
+BROAD_PREFIX = {4: 16, 6: 32}  # Public networks bigger than a /16 (IPv4) or /32 (IPv6) count as broad
+
+
+def load_catalogue(path):
+    """Loads a critical port catalogue from a JSON file, in the same shape as DEFAULT_CRITICAL_PORTS."""
+    with open(path) as file:
+        return json.load(file)
+
+
+def parse_ports(ports):
+    """Turns "22" or "20-21" into the interval (low, high)."""
+    low, _, high = str(ports).partition('-')
+    return int(low), int(high or low)
+
+
+@lru_cache(maxsize=None)
+def parse_network(cidr):
+    """Parses a CIDR once - accounts repeat the same few CIDRs across thousands of rules."""
+    return ipaddress.ip_network(cidr, strict=False)
+
+
+class IntervalTree:
+    """
+    A centred interval tree: every node keeps the intervals that contain its centre point (sorted by start and by
+    end), with the intervals entirely left or right of it in its subtrees. Finding every interval that overlaps a
+    query range takes O(log n + matches) instead of checking each interval.
+    """
+
+    def __init__(self, intervals):
+        """
+        :param intervals: List of (low, high, value), where low and high are inclusive
+        """
+        self.node = self.build(list(intervals))
+
+    def build(self, intervals):
+        if not intervals:
+            return None
+
+        points = sorted(point for low, high, _ in intervals for point in (low, high))
+        centre = points[len(points) // 2]
+        left = [item for item in intervals if item[1] < centre]
+        right = [item for item in intervals if item[0] > centre]
+        here = [item for item in intervals if item[0] <= centre <= item[1]]
+
+        return {
+            'centre': centre,
+            'by_low': sorted(here, key=lambda item: item[0]),
+            'by_high': sorted(here, key=lambda item: item[1], reverse=True),
+            'left': self.build(left),
+            'right': self.build(right),
+        }
+
+    def overlapping(self, low, high):
+        """Returns the values of every interval overlapping [low, high]."""
+        found = []
+        node = self.node
+        stack = [node] if node else []
+
+        while stack:
+            node = stack.pop()
+            if high < node['centre']:
+                # Only intervals here that start at or before high can overlap
+                for item in node['by_low']:
+                    if item[0] > high:
+                        break
+                    found.append(item[2])
+                if node['left']:
+                    stack.append(node['left'])
+            elif low > node['centre']:
+                # Only intervals here that end at or after low can overlap
+                for item in node['by_high']:
+                    if item[1] < low:
+                        break
+                    found.append(item[2])
+                if node['right']:
+                    stack.append(node['right'])
+            else:
+                # The query covers the centre, so every interval here overlaps
+                found.extend(item[2] for item in node['by_low'])
+                if node['left']:
+                    stack.append(node['left'])
+                if node['right']:
+                    stack.append(node['right'])
+        return found
+
+
+def normalise_rules(security_group):
+    """
+    Yields every ingress rule of a security group as a (protocol, (from port, to port), network) triple - one per CIDR,
+    for both IPv4 and IPv6. Rules for all protocols ("-1") cover every port, and protocol numbers are given their names.
+    """
+    for rule in security_group.get('IpPermissions', []):
+        protocol = str(rule.get('IpProtocol', '-1')).lower()
+        protocol = PROTOCOL_NAMES.get(protocol, protocol)
+
+        if protocol == '-1' or rule.get('FromPort') in (None, -1):
+            ports = ALL_PORTS
+        else:
+            ports = (rule['FromPort'], rule['ToPort'])
+
+        for ip_range in rule.get('IpRanges', []):
+            yield protocol, ports, parse_network(ip_range['CidrIp'])
+        for ip_range in rule.get('Ipv6Ranges', []):
+            yield protocol, ports, parse_network(ip_range['CidrIpv6'])
+
+
+class SecurityGroupAnalyzer:
+    """
+    Finds ingress rules that expose critical ports to the internet, or to a very broad public network. A rule matches
+    a critical port when their port ranges overlap, so 0-65535 or 20-25 are caught as well as a single port.
+    """
+
+    def __init__(self, critical_ports=None, broad_prefix=None):
+        """
+        :param critical_ports: Catalogue of critical ports, see DEFAULT_CRITICAL_PORTS
+        :param broad_prefix: {IP version: prefix length}, networks shorter than this count as broad
+        """
+        self.broad_prefix = broad_prefix or BROAD_PREFIX
+        self.trees = {}
+        for protocol, ports in (critical_ports or DEFAULT_CRITICAL_PORTS).items():
+            self.trees[protocol] = IntervalTree(
+                (*parse_ports(port_range), (port_range, name)) for port_range, name in ports.items()
+            )
+
+    def exposure(self, network):
+        """Returns "open" for the whole internet, "broad" for a large public network, or None."""
+        if network.prefixlen == 0:
+            return "open"
+        if network.prefixlen < self.broad_prefix[network.version] and network.is_global:
+            return "broad"
+        return None
+
+    def critical_services(self, protocol, ports):
+        """Returns the (port range, service name) pairs in the catalogue a rule's ports overlap."""
+        if protocol == '-1':  # All protocols
+            return [match for tree in self.trees.values() for match in tree.overlapping(*ports)]
+        tree = self.trees.get(protocol)
+        return tree.overlapping(*ports) if tree else []
+
+    def analyse(self, security_groups, region=None):
+        """
+        Returns a finding for every rule exposing critical ports - "open_security_group" when open to the whole
+        internet, "broad_security_group" when open to a large public network.
+        """
+        findings = []
+
+        for sg in security_groups:
+            for protocol, ports, network in normalise_rules(sg):
+                exposure = self.exposure(network)
+                if not exposure:
+                    continue
+
+                services = self.critical_services(protocol, ports)
+                if not services:
+                    continue
+
+                names = ", ".join(sorted({f"{port_range} ({name})" for port_range, name in services}))
+                if ports == ALL_PORTS:
+                    port_text = "all ports"
+                elif ports[0] == ports[1]:
+                    port_text = f"port {ports[0]}"
+                else:
+                    port_text = f"ports {ports[0]}-{ports[1]}"
+                protocol_text = "all protocols" if protocol == '-1' else protocol.upper()
+                findings.append(make_finding(
+                    "EC2", f"{exposure}_security_group", sg['GroupId'],
+                    f"Allows {protocol_text} on {port_text} from {network}, exposing {names}",
+                    region=region, GroupName=sg.get('GroupName'), Protocol=protocol, FromPort=ports[0],
+                    ToPort=ports[1], Cidr=str(network), Services=sorted({name for _, name in services})
+                ))
+        return findings
@@ -0,0 +1,209 @@
+import argparse
+import base64
+import copy
+import gzip
+import json
+import threading
+from datetime import datetime, timezone
+import boto3
+from botocore.handlers import json_decode_policies
+from audit_engine import AuditEngine
+from reporting import Report, summarise, format_finding
+
+GLOBAL_SERVICES = {'iam', 'sts'}  # Their calls are recorded without a region - it depends on the botocore version
+
+
+def encode(value):
+    """json.dump default= hook for the types boto3 responses contain that JSON does not."""
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, bytes):
+        return {'__bytes__': base64.b64encode(value).decode('ascii')}
+    raise TypeError(f"Cannot save {type(value).__name__} in a snapshot")
+
+
+def decode(item):
+    """json.load object_hook= turning saved datetimes and bytes back into the real types."""
+    if '__datetime__' in item:
+        return datetime.fromisoformat(item['__datetime__'])
+    if '__bytes__' in item:
+        return base64.b64decode(item['__bytes__'])
+    return item
+
+
+class ReplayedResponse:
+    """Stands in for the HTTP response of a replayed call. The response is already parsed, so there is no raw body."""
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+        self.raw = None
+
+
+class Snapshot:
+    """
+    Records every AWS response the checks receive during an audit - the list, describe and get calls for all
+    services and regions - so the same audit can be run again later against the recording, with no network calls.
+
+    Recording and replaying both hook into the sessions the AuditEngine creates: while recording, each response
+    (errors included) is stored under the call's service, region, operation and parameters; while replaying, the
+    stored response is returned before botocore makes any request. Rules can then be tuned and re-run in milliseconds,
+    and snapshots taken at different times can be compared.
+    """
+
+    def __init__(self, calls=None, metadata=None, replay=False, session_factory=None):
+        """
+        :param calls: Recorded responses, keyed by call (see remember_call)
+        :param metadata: Details about the recording, e.g. when it was made and which regions it covers
+        :param replay: Answer calls from the recording instead of AWS
+        :param session_factory: While recording, creates the sessions to record (defaults to boto3.Session)
+        """
+        self.calls = calls or {}
+        self.metadata = metadata or {}
+        self.replay = replay
+        self.session_factory = session_factory or (lambda region=None: boto3.Session(region_name=region))
+        self.lock = threading.Lock()
+
+    def session(self, region=None):
+        """Returns a new boto3 session that records to, or replays from, this snapshot."""
+        if self.replay:
+            # Clients get the same default region as when recording, so their calls have the same keys. Nothing is
+            # sent to AWS, but botocore still wants some credentials to build clients with.
+            session = boto3.Session(region_name=region or self.metadata.get('default_region') or 'us-east-1',
+                                    aws_access_key_id='offline', aws_secret_access_key='offline')
+            # Policy documents were recorded after botocore decoded them, so they must not be decoded again
+            session.events.unregister('after-call.iam', json_decode_policies)
+        else:
+            session = self.session_factory(region)
+
+        session.events.register_first('before-parameter-build', self.remember_call)
+        if self.replay:
+            session.events.register('before-call', self.replay_call)
+        else:
+            session.events.register('after-call', self.record_call)
+        return session
+
+    def remember_call(self, params, model, context, **kwargs):
+        """Works out the key of a call from its service, region, operation and parameters, before botocore changes them."""
+        service = model.service_model.service_name
+        context['snapshot_key'] = "|".join([
+            service,
+            '' if service in GLOBAL_SERVICES else context.get('client_region') or '',
+            model.name,
+            json.dumps(params, sort_keys=True, default=str),
+        ])
+
+    def record_call(self, http_response, parsed, model, context, **kwargs):
+        """Stores a response (or error response). A repeated call, e.g. polling, keeps its latest response."""
+        response = {key: value for key, value in parsed.items() if key != 'ResponseMetadata'}
+        with self.lock:
+            self.calls[context['snapshot_key']] = {'status': http_response.status_code, 'response': response}
+
+    def replay_call(self, model, context, **kwargs):
+        """Returns the recorded response for a call. Calls that were never recorded fail with NotInSnapshot."""
+        recorded = self.calls.get(context['snapshot_key'])
+        if recorded is None:
+            return ReplayedResponse(400), {
+                'Error': {'Code': 'NotInSnapshot', 'Message': f"{model.name} was not recorded in the snapshot"},
+                'ResponseMetadata': {}
+            }
+        # botocore changes some responses in place (e.g. decoding IAM policy documents), so each replay gets a copy
+        return ReplayedResponse(recorded['status']), dict(copy.deepcopy(recorded['response']), ResponseMetadata={})
+
+    def save(self, path):
+        """Saves the snapshot as gzip compressed JSON."""
+        with gzip.open(path, 'wt', encoding='utf-8') as file:
+            json.dump({'metadata': self.metadata, 'calls': self.calls}, file, default=encode)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a saved snapshot, ready to replay."""
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            data = json.load(file, object_hook=decode)
+        return cls(data['calls'], data['metadata'], replay=True)
+
+
+def record(output_file, regions=None, workers=8, session_factory=None):
+    """Runs a live audit while recording every response, and saves the snapshot. Returns (findings, summary)."""
+    snapshot = Snapshot(session_factory=session_factory)
+    engine = AuditEngine(session_factory=snapshot.session, regions=regions, max_workers=workers)
+    regions = regions or engine.enabled_regions()
+    engine.regions = regions
+
+    created = datetime.now(timezone.utc)  # The report checks are replayed as of this time
+    findings, summary = engine.run()
+    # The region clients without one of their own (e.g. the S3 client listing buckets) ended up in
+    default_region = snapshot.session_factory().region_name or 'us-east-1'
+    snapshot.metadata = {'created': created.isoformat(), 'regions': regions, 'default_region': default_region}
+    snapshot.save(output_file)
+    print(f"Recorded {len(snapshot.calls)} API responses ({summary['findings']} findings) to {output_file}")
+    return findings, summary
+
+
+def evaluate(path, workers=8):
+    """Runs every check against a saved snapshot, with no network calls. Returns (findings, summary)."""
+    snapshot = Snapshot.load(path)
+    # Ages (of passwords, access keys, the credentials report) are worked out as of when the snapshot was recorded, so
+    # replaying a snapshot always gives the same findings
+    engine = AuditEngine(session_factory=snapshot.session, regions=snapshot.metadata['regions'], max_workers=workers,
+                         as_of=datetime.fromisoformat(snapshot.metadata['created']))
+    return engine.run()
+
+
+def finding_id(finding):
+    """Identifies a finding across snapshots (the same problem on the same resource)."""
+    return finding.get('account'), finding['service'], finding['check'], finding.get('region'), finding['resource'], \
+        finding['message']
+
+
+def diff(old_path, new_path):
+    """Prints the findings that appeared and disappeared between two snapshots."""
+    old = {finding_id(finding): finding for finding in evaluate(old_path)[0]}
+    new = {finding_id(finding): finding for finding in evaluate(new_path)[0]}
+
+    added = [new[key] for key in new.keys() - old.keys()]
+    resolved = [old[key] for key in old.keys() - new.keys()]
+    print(f"{len(added)} new finding(s), {len(resolved)} resolved:")
+    for finding in sorted(added, key=finding_id):
+        print(f"+ {finding['service']}/{finding['check']} {format_finding(finding)}")
+    for finding in sorted(resolved, key=finding_id):
+        print(f"- {finding['service']}/{finding['check']} {format_finding(finding)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record AWS audit snapshots, and re-run the checks offline")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="Audit the account live and save every API response")
+    record_parser.add_argument("output", help="Snapshot file to write, e.g. account.snapshot.json.gz")
+    record_parser.add_argument("--regions", nargs="+", help="Only these regions (default: all enabled regions)")
+    record_parser.add_argument("--workers", type=int, default=8)
+
+    audit_parser = commands.add_parser("audit", help="Run every check against a snapshot, offline")
+    audit_parser.add_argument("snapshot")
+    audit_parser.add_argument("--show", action="store_true", help="Print every finding, not just counts")
+
+    diff_parser = commands.add_parser("diff", help="Show findings that appeared or were resolved between snapshots")
+    diff_parser.add_argument("old")
+    diff_parser.add_argument("new")
+
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.output, args.regions, args.workers)
+
+    elif args.command == "audit":
+        findings, summary = evaluate(args.snapshot)
+        if args.show:
+            Report().show_all(findings)
+        else:
+            for check, count in sorted(summarise(findings).items()):
+                print(f"{check}: {count}")
+        print(f"{summary['findings']} finding(s) in {summary['seconds']} seconds.")
+
+    elif args.command == "diff":
+        diff(args.old, args.new)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+def make_finding(service, check, resource, message, region=None, **details):
+    """
+    Builds a finding - one security concern found by a check - in the same shape for every service, so findings
+    from IAM, S3 and EC2 can be merged into one report.
+
+    :param service: The AWS service, e.g. "IAM"
+    :param check: Short name of the check that raised it, e.g. "public_instance"
+    :param resource: The user, bucket, instance, etc. the finding is about
+    :param message: What is wrong, in plain words
+    :param region: The region of the resource, for regional services
+    :param details: Any extra key information about the resource
+    :return: Returns the finding as a dict
+    """
+    return {
+        "service": service,
+        "check": check,
+        "region": region,
+        "resource": resource,
+        "message": message,
+        "details": details
+    }
+
+
+PAGE_SIZE = 1000  # The most items most AWS list/describe calls will return per page
+
+
+def paginate(client, operation, result_key, **kwargs):
+    """
+    Yields every item from a boto3 list/describe call, one page at a time, so a check can work through accounts with
+    thousands of resources while only holding a single page in memory. Calls that a client cannot paginate (e.g.
+    list_buckets on older boto3 versions) are made once instead.
+
+    :param client: The boto3 client, e.g. the IAM client
+    :param operation: Name of the client method, e.g. "list_users"
+    :param result_key: Key of the list in each response, e.g. "Users"
+    :param kwargs: Parameters for the call, e.g. Filters to have AWS do the filtering before sending the results
+    :return: Returns a generator over the items
+    """
+    if not client.can_paginate(operation):
+        yield from getattr(client, operation)(**kwargs).get(result_key, [])
+        return
+
+    paginator = client.get_paginator(operation)
+    for page in paginator.paginate(**kwargs):
+        yield from page.get(result_key, [])
+
+
+def paginate_instances(ec2_client, filters=None):
+    """Yields every EC2 instance in the region matching the (server side) filters, page by page."""
+    for reservation in paginate(ec2_client, 'describe_instances', 'Reservations', Filters=filters or [],
+                                PaginationConfig={'PageSize': PAGE_SIZE}):
+        yield from reservation['Instances']